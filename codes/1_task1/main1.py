@@ -3,16 +3,19 @@
 
 # Import libraries:
 import requests
+import aiohttp
+import asyncio
 import argparse
 import json
 import os
-import stat
 from datetime import datetime, timedelta
 from tqdm import tqdm
 import logging
 import time
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+
+from raw_store import get_raw_store, FILE_MODE
 
 # WARNING: if you want to run the script directly and not using docker, 
 # ... then uncomment the following lines
@@ -39,6 +42,16 @@ logging.basicConfig(
 # Ensure output folder exists:
 os.makedirs("crypto_datafiles", exist_ok=True)
 
+# Storage backend for the raw responses (one JSON file per response, unless --store is given):
+RAW_STORE = get_raw_store("json", "crypto_datafiles")
+
+# CoinGecko endpoint and default rate limit (the Demo plan allows 30 calls per minute):
+API_URL = "https://api.coingecko.com/api/v3/coins/{coin_id}/history"
+DEFAULT_CALLS_PER_MINUTE = 30
+
+# Persistent record of downloaded (coin, date) pairs (not a '.json' file, so loaders ignore it):
+MANIFEST_PATH = "crypto_datafiles/download_manifest.jsonl"
+
 def iso_to_coingecko_date(
     iso_date_str
     ):
@@ -68,11 +81,98 @@ def iso_to_coingecko_date(
 
     return dt.strftime("%d-%m-%Y"), dt.strftime("%Y_%m_%d")
 
+def save_response(
+    data,
+    coin_id,
+    iso_date_str,
+    store=None
+    ):
+    """
+    Save a CoinGecko JSON response in the raw-data store.
+    --- Inputs ---
+    {data} [dict]: Parsed JSON response returned by the API.
+    {coin_id} [string]: The cryptocurrency ID used by CoinGecko.
+    {iso_date_str} [string]: Date in ISO8601 'YYYY-MM-DD' format.
+    {store} [JsonFileStore | SegmentStore | None]: Storage backend, default: RAW_STORE.
+
+    --- Returns ---
+    payload_hash [string]: SHA-256 hash of the stored payload.
+    """
+    store = store if store is not None else RAW_STORE
+    payload_hash = store.save(coin_id, iso_date_str, data)
+    logging.info(f"✅ Saved: {coin_id} {iso_date_str}")
+
+    return payload_hash
+
+class DownloadManifest:
+    """
+    Persistent, append-only manifest of the downloads, with one JSON line per (coin, date) attempt.
+    Each line stores the status ('ok' or 'failed'), the payload hash and the fetch time; the
+    latest line of a key wins. Lines are flushed as soon as each download finishes, so an
+    interrupted bulk run resumes where it stopped.
+    --- Inputs ---
+    {path} [string]: Path to the manifest file.
+    {store} [JsonFileStore | SegmentStore | None]: Storage backend, default: RAW_STORE.
+    """
+    def __init__(self, path=MANIFEST_PATH, store=None):
+        self.path = path
+        self.store = store if store is not None else RAW_STORE
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Skip a partially written line (interrupted run)
+                    self.entries[(entry["coin_id"], entry["date"])] = entry
+        self.file = open(path, "a")
+        os.chmod(path, FILE_MODE)
+
+    def record(self, coin_id, iso_date_str, status, payload_hash=None):
+        """
+        Append the result of a download to the manifest.
+        """
+        entry = {
+            "coin_id": coin_id,
+            "date": iso_date_str,
+            "status": status,
+            "sha256": payload_hash,
+            "fetched_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        }
+        self.entries[(coin_id, iso_date_str)] = entry
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def is_done(self, coin_id, iso_date_str):
+        """
+        Check if a (coin, date) pair was already downloaded. Files downloaded before the
+        manifest existed are adopted into it, so they are not requested again.
+        """
+        if not self.store.exists(coin_id, iso_date_str):
+            return False
+        entry = self.entries.get((coin_id, iso_date_str))
+        if entry is None or entry["status"] != "ok":
+            self.record(coin_id, iso_date_str, "ok", self.store.payload_hash(coin_id, iso_date_str))
+        return True
+
+    def close(self):
+        """
+        Close the manifest, rewriting it with only the latest line of each key.
+        """
+        self.file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
 def fetch_and_save(
     coin_id, 
     iso_date_str,
     max_attempts=5,
-    wait=5
+    wait=5,
+    manifest=None
     ):
     """
     Fetch historical cryptocurrency data from the CoinGecko API for a specific coin and date, 
@@ -88,6 +188,7 @@ def fetch_and_save(
     {max_attempts} [int]: Maximum number of attempts before giving up.
     {wait} [int]: Base wait time in seconds before retrying. An extra 10 seconds
     per attempt number is added to reduce API rate-limit issues.
+    {manifest} [DownloadManifest | None]: If provided, the result is recorded in the manifest.
 
     --- Returns ---
     None
@@ -104,7 +205,7 @@ def fetch_and_save(
         return
 
     # Define request and parameters:
-    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/history"
+    url = API_URL.format(coin_id=coin_id)
     params = {"date": formatted_date}
     headers = {"x-cg-demo-api-key": API_KEY}
 
@@ -114,14 +215,9 @@ def fetch_and_save(
         response = requests.get(url, params=params, headers=headers, timeout=10)
         # Successful request, save the file locally:
         if response.status_code == 200:
-            data = response.json()
-            filename = f"crypto_datafiles/{coin_id}_{filename_date}.json"
-            with open(filename, "w") as f:
-                json.dump(data, f, indent=2)
-
-            # Set file permission: read/write for all (chmod 0666)
-            os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
-            logging.info(f"✅ Saved: {filename}")
+            payload_hash = save_response(response.json(), coin_id, filename_date.replace("_", "-"))
+            if manifest is not None:
+                manifest.record(coin_id, iso_date_str, "ok", payload_hash)
             break # Exit the while loop
         # Failed request, re-attempt if allowed, else skip:
         else:
@@ -130,30 +226,234 @@ def fetch_and_save(
                 logging.info(f'Attempt failed, will try again. Remaining attempts: {max_attempts-i_attempt}')
             i_attempt += 1 # Update attempt counter
             time.sleep(wait+i_attempt*10)
+    # All attempts failed:
+    else:
+        if manifest is not None:
+            manifest.record(coin_id, iso_date_str, "failed")
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter shared by all concurrent requests of a bulk run.
+    Tokens are refilled continuously at the plan's rate, so the request flow stays
+    at the quota ceiling without exceeding it.
+    --- Inputs ---
+    {calls_per_minute} [int]: Number of calls per minute allowed by the CoinGecko plan.
+    {burst} [int]: Maximum number of tokens that can be accumulated (default: 1, no bursts).
+    """
+    def __init__(self, calls_per_minute, burst=1):
+        self.rate = calls_per_minute / 60.0 # Tokens per second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0 # Set when the API asks all clients to back off
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until a token is available and consume it.
+        """
+        # Waiters are served one at a time, in arrival order:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                # Respect a global pause (e.g. after a 429 response):
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                # Refill tokens according to the elapsed time:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # Sleep just long enough for the next token:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """
+        Block all requests for the given number of seconds and drop accumulated tokens.
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+def parse_retry_after(
+    value,
+    default
+    ):
+    """
+    Parse the value of a 'Retry-After' HTTP header.
+    --- Inputs ---
+    {value} [string | None]: Header value, either a number of seconds or an HTTP date.
+    {default} [float]: Seconds to return if the header is missing or cannot be parsed.
+
+    --- Returns ---
+    [float]: Number of seconds to wait before retrying.
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_dt = parsedate_to_datetime(value)
+        return max(0.0, retry_dt.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+async def fetch_and_save_async(
+    session,
+    limiter,
+    coin_id,
+    iso_date_str,
+    max_attempts=5,
+    wait=5
+    ):
+    """
+    Asynchronous version of `fetch_and_save`, used by the bulk download engine.
+    Every request goes through the shared rate limiter and the pooled HTTP session.
+
+    On a 429 response the whole engine is paused for the time given by the 'Retry-After'
+    header (the quota is shared, so every pending request must back off). Other failures
+    are retried with exponential backoff. Client errors such as 404 are not retried.
+
+    --- Inputs ---
+    {session} [aiohttp.ClientSession]: Shared HTTP session (keep-alive connection pool).
+    {limiter} [TokenBucket]: Shared rate limiter.
+    {coin_id} [string]: The cryptocurrency ID used by CoinGecko.
+    {iso_date_str} [string]: Date in ISO8601 'YYYY-MM-DD' format to request data for.
+    {max_attempts} [int]: Maximum number of attempts before giving up.
+    {wait} [int]: Base wait time in seconds before retrying, doubled at every attempt.
+
+    --- Returns ---
+    [string | None]: SHA-256 hash of the saved payload, or None if the download failed.
+    """
+    # Check provided date is valid:
+    try:
+        formatted_date, filename_date = iso_to_coingecko_date(iso_date_str)
+    except ValueError as e:
+        logging.warning(f"{iso_date_str} skipped: {e}")
+        return None
+
+    url = API_URL.format(coin_id=coin_id)
+    params = {"date": formatted_date}
+
+    for i_attempt in range(1, max_attempts + 1):
+        # Wait for our turn within the plan's quota:
+        await limiter.acquire()
+        backoff = wait * 2 ** (i_attempt - 1)
+        try:
+            async with session.get(url, params=params) as response:
+                # Successful request, save the file locally:
+                if response.status == 200:
+                    data = await response.json()
+                    payload_hash = save_response(data, coin_id, filename_date.replace("_", "-"))
+                    return payload_hash
+                # Rate limited: pause every request for the time requested by the API:
+                if response.status == 429:
+                    delay = parse_retry_after(response.headers.get("Retry-After"), backoff)
+                    limiter.pause(delay)
+                    logging.warning(f"⏳ Rate limited on {coin_id} {iso_date_str}, pausing {delay:.0f}s")
+                    continue
+                logging.error(f"❌ Failed for {coin_id} {iso_date_str}: {response.status}")
+                # Client errors (e.g. unknown coin) will not be fixed by retrying:
+                if 400 <= response.status < 500:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"❌ Failed for {coin_id} {iso_date_str}: {e!r}")
+        if i_attempt < max_attempts:
+            logging.info(f'Attempt failed, will try again. Remaining attempts: {max_attempts-i_attempt}')
+            await asyncio.sleep(backoff)
+
+    return None
+
+async def run_bulk_async(
+    pairs,
+    manifest,
+    max_workers=1,
+    calls_per_minute=DEFAULT_CALLS_PER_MINUTE
+    ):
+    """
+    Download every (coin, date) pair using one pooled HTTP session and one shared rate limiter.
+    --- Inputs ---
+    {pairs} [list]: (coin_id, date) pairs to download, dates in ISO8601 'YYYY-MM-DD' format.
+    {manifest} [DownloadManifest]: Manifest where the result of every download is recorded.
+    {max_workers} [int]: Maximum number of concurrent requests.
+    {calls_per_minute} [int]: Number of calls per minute allowed by the CoinGecko plan.
+
+    --- Returns ---
+    failed [list]: (coin_id, date) pairs that could not be downloaded.
+    """
+    # Fill a queue with all (coin, date) pairs:
+    queue = asyncio.Queue()
+    for pair in pairs:
+        queue.put_nowait(pair)
+    total = queue.qsize()
+
+    limiter = TokenBucket(calls_per_minute)
+    failed = []
+    progress = tqdm(total=total, desc="Fetching")
+
+    async def worker(session):
+        # Each worker takes the next pending pair until the queue is empty:
+        while not queue.empty():
+            coin_id, date = queue.get_nowait()
+            try:
+                payload_hash = await fetch_and_save_async(session, limiter, coin_id, date)
+            except Exception as e:
+                # Log any unexpected error and keep going with the rest of the pairs:
+                logging.error(f"⚠️ Error processing {coin_id} {date}: {e}")
+                payload_hash = None
+            # Record the result, so an interrupted run can resume from here:
+            if payload_hash:
+                manifest.record(coin_id, date, "ok", payload_hash)
+            else:
+                manifest.record(coin_id, date, "failed")
+                failed.append((coin_id, date))
+            progress.update(1)
+
+    # One keep-alive connection pool shared by all workers:
+    connector = aiohttp.TCPConnector(limit=max_workers, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=30)
+    headers = {"x-cg-demo-api-key": API_KEY}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+        await asyncio.gather(*(worker(session) for _ in range(max(1, min(max_workers, total)))))
+    progress.close()
+
+    return failed
 
 def run_bulk(
-    coin_id, 
-    start_date, 
-    end_date, 
-    max_workers=1
+    coin_ids,
+    start_date,
+    end_date,
+    max_workers=1,
+    calls_per_minute=DEFAULT_CALLS_PER_MINUTE,
+    force=False
     ):
     """
-    Download and save historical cryptocurrency data from the CoinGecko API 
-    for a given date range, using concurrent requests.
+    Download and save historical cryptocurrency data from the CoinGecko API
+    for a given date range and one or more coins, using the asynchronous download engine.
+    Pairs already downloaded (according to the download manifest) are skipped, so only
+    missing or failed pairs are requested.
 
     --- Inputs ---
-    {coin_id} [string]: The cryptocurrency ID used by CoinGecko (e.g. 'bitcoin').
+    {coin_ids} [string | list]: The cryptocurrency ID(s) used by CoinGecko (e.g. 'bitcoin').
     {start_date} [string]: Start date in ISO8601 'YYYY-MM-DD' format.
     {end_date} [string]: End date in ISO8601 'YYYY-MM-DD' format.
-    {max_workers} [int]: Maximum number of concurrent threads for fetching data .
+    {max_workers} [int]: Maximum number of concurrent requests.
+    {calls_per_minute} [int]: Number of calls per minute allowed by the CoinGecko plan.
+    {force} [bool]: If True, download all pairs again, even those already downloaded.
 
     --- Returns ---
     None
 
     --- Raises ---
-    ValueError: If start_date or end_date have invalid format (raised indirectly 
-    by datetime.strptime in `fetch_and_save`).
+    ValueError: If start_date or end_date have invalid format (raised by datetime.strptime).
     """
+    # Accept a single coin as well as a list of coins:
+    if isinstance(coin_ids, str):
+        coin_ids = [coin_ids]
+
     # Define time interval:
     start_dt = datetime.strptime(start_date, "%Y-%m-%d")
     end_dt = datetime.strptime(end_date, "%Y-%m-%d")
@@ -165,54 +465,109 @@ def run_bulk(
     # Define list for all available dates:
     date_list = [(start_dt + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(delta)]
 
+    # Select the pairs that still have to be downloaded:
+    manifest = DownloadManifest()
+    pairs = [
+        (coin_id, date) for coin_id in coin_ids for date in date_list
+        if force or not manifest.is_done(coin_id, date)
+    ]
+    n_skipped = len(coin_ids)*len(date_list) - len(pairs)
+
     # Start bulk processing:
-    logging.info(f"🔁 Bulk processing {len(date_list)} days for '{coin_id}' with max {max_workers} workers")
-    # Create thread pool for concurrent execution:
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit one fetch task per date to the executor:
-        futures = {
-            executor.submit(fetch_and_save, coin_id, date): date
-            for date in date_list
-        }
-        # Process completed tasks as they finish (tqdm for progress display):
-        for future in tqdm(as_completed(futures), total=len(futures), desc=f"Fetching {coin_id}"):
-            date = futures[future]
-            try:
-                # Get the result of the completed task (will raise if an exception occurred inside fetch_and_save)
-                future.result()
-            except Exception as e:
-                # Log any error that happened during the fetch for this date
-                logging.error(f"⚠️ Error processing {date}: {e}")
+    logging.info(
+        f"🔁 Bulk processing {len(date_list)} days for {len(coin_ids)} coin(s) "
+        f"with max {max_workers} workers at {calls_per_minute} calls/min "
+        f"({n_skipped} already downloaded, {len(pairs)} pending)")
+    try:
+        failed = asyncio.run(run_bulk_async(
+            pairs, manifest, max_workers=max_workers, calls_per_minute=calls_per_minute))
+    finally:
+        manifest.close()
+
+    # Final log:
+    if failed:
+        logging.error(f"⚠️ {len(failed)} request(s) failed: {failed}")
+    logging.info(f"Downloaded {len(pairs)-len(failed)} of {len(pairs)} pending files.")
+
+def read_coins_file(
+    path
+    ):
+    """
+    Read coin IDs from a text file.
+    --- Inputs ---
+    {path} [string]: Path to a file with coin IDs, separated by spaces or new lines.
+    Everything after a '#' in a line is considered a comment.
+
+    --- Returns ---
+    coin_ids [list]: Coin IDs in the same order as in the file.
+    """
+    coin_ids = []
+    with open(path, "r") as f:
+        for line in f:
+            coin_ids.extend(line.split("#", 1)[0].split())
+
+    return coin_ids
 
 # Main function:
 
 if __name__ == "__main__":
     # Define command-line interface (CLI) arguments:
     parser = argparse.ArgumentParser(description="CoinGecko Historical Downloader")
-    parser.add_argument("coin", help="Coin ID (e.g. bitcoin, ethereum, cardano)")
+    parser.add_argument("coin", nargs="?", help="Coin ID (e.g. bitcoin, ethereum, cardano)")
     parser.add_argument("date", nargs="?", help="Date in YYYY-MM-DD")
+    parser.add_argument("--coins", nargs="+", help="Several coin IDs, separated by spaces")
+    parser.add_argument("--coins_file", help="File with coin IDs, one per line")
+    parser.add_argument("--date", dest="date_opt", help="Date in YYYY-MM-DD (alternative to the positional date)")
     parser.add_argument("--bulk", action="store_true", help="Run bulk mode")
     parser.add_argument("--start", help="Start date for bulk mode (YYYY-MM-DD)")
     parser.add_argument("--end", help="End date for bulk mode (YYYY-MM-DD)")
-    parser.add_argument("--workers", type=int, default=1, help="Max concurrent workers (default: 1)")
+    parser.add_argument("--workers", type=int, default=1, help="Max concurrent requests (default: 1)")
+    parser.add_argument("--calls_per_minute", type=int, default=DEFAULT_CALLS_PER_MINUTE,
+        help=f"Calls per minute allowed by your CoinGecko plan (default: {DEFAULT_CALLS_PER_MINUTE})")
+    parser.add_argument("--force", action="store_true", help="Download again files that already exist")
+    parser.add_argument("--store", default="json", choices=["json", "segment"],
+        help="Storage for responses: one JSON file each (default) or compressed segment files")
+    parser.add_argument("--codec", default="gzip", choices=["gzip", "zstd"], help="Compression codec for segment files (default: gzip)")
     # Parse the CLI arguments:
     args = parser.parse_args()
 
+    # Gather all requested coins, removing duplicates but keeping their order:
+    coin_ids = [args.coin] if args.coin else []
+    coin_ids += args.coins if args.coins else []
+    coin_ids += read_coins_file(args.coins_file) if args.coins_file else []
+    coin_ids = list(dict.fromkeys(coin_ids))
+    date = args.date_opt if args.date_opt else args.date
+
     # Ensure output folder for downloaded data exists:
     os.makedirs("crypto_datafiles", exist_ok=True)
+    # Select the storage backend:
+    RAW_STORE = get_raw_store(args.store, "crypto_datafiles", codec=args.codec)
 
+    # Check that at least one coin is provided:
+    if not coin_ids:
+        logging.error("❌ Provide a coin ID, --coins or --coins_file.")
     # If bulk mode is enabled:
-    if args.bulk:
+    elif args.bulk:
         # Check that both start and end dates are provided:
         if not args.start or not args.end:
             logging.error("❌ Bulk mode requires --start and --end.")
         else:
             # Run bulk download over the specified date range:
-            run_bulk(args.coin, args.start, args.end, max_workers=args.workers)
+            run_bulk(coin_ids, args.start, args.end, max_workers=args.workers,
+                calls_per_minute=args.calls_per_minute, force=args.force)
     else:
         # Single-date mode: ensure date is provided:
-        if not args.date:
+        if not date:
             logging.error("❌ Provide a date in YYYY-MM-DD format.")
+        elif len(coin_ids) > 1:
+            # Several coins: download all of them in one process, sharing one connection pool:
+            run_bulk(coin_ids, date, date, max_workers=args.workers,
+                calls_per_minute=args.calls_per_minute, force=args.force)
         else:
-            # Download and save data for the specified date:
-            fetch_and_save(args.coin, args.date)
\ No newline at end of file
+            # Download and save data for the specified date, unless it is already downloaded:
+            manifest = DownloadManifest()
+            if args.force or not manifest.is_done(coin_ids[0], date):
+                fetch_and_save(coin_ids[0], date, manifest=manifest)
+            else:
+                logging.info(f"⏭️ {coin_ids[0]} {date} already downloaded, skipped.")
+            manifest.close()
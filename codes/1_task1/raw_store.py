@@ -0,0 +1,296 @@
+# raw_store.py
+# Storage backends for the raw CoinGecko responses downloaded in Task 1.
+
+# Import libraries:
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import stat
+
+# zstd compression is optional, gzip is always available:
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Read/write permissions for all (chmod 0666), same as the downloaded files:
+FILE_MODE = stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH
+
+class JsonFileStore:
+    """
+    Original storage format: one indented JSON file per (coin, date), named
+    "coinid_YYYY_MM_DD.json" inside the data folder.
+    --- Inputs ---
+    {folder} [string]: Path to the data folder.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, coin_id, iso_date_str):
+        """
+        Path of the file for a (coin, date) pair, date in 'YYYY-MM-DD' format.
+        """
+        return os.path.join(self.folder, f"{coin_id}_{iso_date_str.replace('-', '_')}.json")
+
+    def save(self, coin_id, iso_date_str, data):
+        """
+        Save a JSON response and return the SHA-256 hash of the stored payload.
+        """
+        filename = self.path(coin_id, iso_date_str)
+        payload = json.dumps(data, indent=2).encode("utf-8")
+        with open(filename, "wb") as f:
+            f.write(payload)
+        os.chmod(filename, FILE_MODE)
+
+        return hashlib.sha256(payload).hexdigest()
+
+    def exists(self, coin_id, iso_date_str):
+        """
+        Check if a (coin, date) pair is stored.
+        """
+        return os.path.exists(self.path(coin_id, iso_date_str))
+
+    def payload_hash(self, coin_id, iso_date_str):
+        """
+        SHA-256 hash of the stored payload of a (coin, date) pair.
+        """
+        with open(self.path(coin_id, iso_date_str), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def iter_records(self):
+        """
+        Yield (coin_id, iso_date_str, data) for every stored file.
+        """
+        for filename in sorted(os.listdir(self.folder)):
+            if filename.endswith(".json"):
+                coin_id, y, m, d = filename[:-len(".json")].split("_")
+                with open(os.path.join(self.folder, filename), "r") as f:
+                    yield coin_id, f"{y}-{m}-{d}", json.load(f)
+
+class SegmentStore:
+    """
+    Compact storage format: responses are written as compact JSON, compressed one by one
+    (gzip or zstd) and appended to one segment file per month ("raw_YYYY_MM.seg").
+    Every segment has an append-only offset index ("raw_YYYY_MM.idx", one JSON line per
+    record with coin_id, date, offset, length, codec and hash), so any record can be read
+    with a single seek, and all records can be streamed without opening thousands of files.
+    When a (coin, date) pair is written twice, the latest index line wins.
+    --- Inputs ---
+    {folder} [string]: Path to the folder for segment and index files.
+    {codec} [string]: Compression codec for new records, either 'gzip' (default) or 'zstd'.
+    """
+    def __init__(self, folder, codec="gzip"):
+        if codec not in ("gzip", "zstd"):
+            raise ValueError("codec must be 'gzip' or 'zstd'")
+        if codec == "zstd" and zstandard is None:
+            raise ValueError("codec 'zstd' requires the 'zstandard' package (pip install zstandard)")
+        self.folder = folder
+        self.codec = codec
+        self.indexes = {} # Loaded indexes, by partition
+        os.makedirs(folder, exist_ok=True)
+
+    def partition(self, iso_date_str):
+        """
+        Partition name of a date in 'YYYY-MM-DD' format, e.g. 'raw_2025_01'.
+        """
+        return "raw_" + iso_date_str[:7].replace("-", "_")
+
+    def partitions(self):
+        """
+        Names of all stored partitions, in chronological order.
+        """
+        return sorted(name[:-len(".idx")] for name in os.listdir(self.folder) if name.endswith(".idx"))
+
+    def read_index(self, partition, start=0):
+        """
+        Read the index lines of a partition from a byte offset of the index file.
+        --- Inputs ---
+        {partition} [string]: Partition name.
+        {start} [int]: Byte offset in the index file to start reading from (default: 0, the whole index).
+
+        --- Returns ---
+        entries [list]: Index entries, in the order they were written.
+        end [int]: Byte offset after the last complete line, to resume reading later.
+        """
+        entries = []
+        end = start
+        idx_path = os.path.join(self.folder, partition + ".idx")
+        if os.path.exists(idx_path):
+            with open(idx_path, "rb") as f:
+                f.seek(start)
+                for line in f:
+                    # Stop at a partially written line (interrupted run):
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass
+                    end += len(line)
+
+        return entries, end
+
+    def load_index(self, partition):
+        """
+        Load the index of a partition as a dictionary {(coin_id, date): entry}.
+        """
+        if partition not in self.indexes:
+            entries, _ = self.read_index(partition)
+            self.indexes[partition] = {(entry["coin_id"], entry["date"]): entry for entry in entries}
+
+        return self.indexes[partition]
+
+    def compress(self, payload):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=10).compress(payload)
+        return gzip.compress(payload, compresslevel=9)
+
+    @staticmethod
+    def decompress(blob, codec):
+        if codec == "zstd":
+            if zstandard is None:
+                raise ValueError("Reading zstd records requires the 'zstandard' package (pip install zstandard)")
+            return zstandard.ZstdDecompressor().decompress(blob)
+        return gzip.decompress(blob)
+
+    def save(self, coin_id, iso_date_str, data):
+        """
+        Append a JSON response to its segment and return the SHA-256 hash of the compact payload.
+        """
+        partition = self.partition(iso_date_str)
+        seg_path = os.path.join(self.folder, partition + ".seg")
+        idx_path = os.path.join(self.folder, partition + ".idx")
+        index = self.load_index(partition)
+
+        # Compact and compress the payload:
+        payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        blob = self.compress(payload)
+
+        # Append the record first and the index line afterwards, so the index never
+        # points to incomplete data (unindexed bytes are simply ignored):
+        with open(seg_path, "ab") as f:
+            offset = f.tell()
+            f.write(blob)
+        entry = {
+            "coin_id": coin_id,
+            "date": iso_date_str,
+            "offset": offset,
+            "length": len(blob),
+            "codec": self.codec,
+            "sha256": hashlib.sha256(payload).hexdigest()
+        }
+        with open(idx_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        for path in (seg_path, idx_path):
+            os.chmod(path, FILE_MODE)
+        index[(coin_id, iso_date_str)] = entry
+
+        return entry["sha256"]
+
+    def exists(self, coin_id, iso_date_str):
+        """
+        Check if a (coin, date) pair is stored.
+        """
+        return (coin_id, iso_date_str) in self.load_index(self.partition(iso_date_str))
+
+    def payload_hash(self, coin_id, iso_date_str):
+        """
+        SHA-256 hash of the stored payload of a (coin, date) pair.
+        """
+        return self.load_index(self.partition(iso_date_str))[(coin_id, iso_date_str)]["sha256"]
+
+    def read(self, coin_id, iso_date_str):
+        """
+        Read the JSON response of a (coin, date) pair.
+        """
+        partition = self.partition(iso_date_str)
+        entry = self.load_index(partition)[(coin_id, iso_date_str)]
+        with open(os.path.join(self.folder, partition + ".seg"), "rb") as f:
+            f.seek(entry["offset"])
+            blob = f.read(entry["length"])
+
+        return json.loads(self.decompress(blob, entry["codec"]))
+
+    def iter_entries(self, partition, entries):
+        """
+        Yield (coin_id, iso_date_str, data) for the given index entries of a partition.
+        """
+        # Read entries in offset order, so the segment is read sequentially:
+        with open(os.path.join(self.folder, partition + ".seg"), "rb") as f:
+            for entry in sorted(entries, key=lambda e: e["offset"]):
+                f.seek(entry["offset"])
+                blob = f.read(entry["length"])
+                yield entry["coin_id"], entry["date"], json.loads(self.decompress(blob, entry["codec"]))
+
+    def iter_records(self):
+        """
+        Yield (coin_id, iso_date_str, data) for every stored record, one segment at a time.
+        """
+        for partition in self.partitions():
+            yield from self.iter_entries(partition, self.load_index(partition).values())
+
+def get_raw_store(
+    kind,
+    data_folder,
+    codec="gzip"
+    ):
+    """
+    Build the storage backend for raw responses.
+    --- Inputs ---
+    {kind} [string]: Either 'json' (one file per response) or 'segment' (compressed segments).
+    {data_folder} [string]: Path to the data folder. Segments are stored in its 'segments' subfolder.
+    {codec} [string]: Compression codec for the segment store, either 'gzip' or 'zstd'.
+
+    --- Returns ---
+    [JsonFileStore | SegmentStore]: Storage backend.
+
+    --- Raises ---
+    ValueError: If the kind of store or the codec are not valid.
+    """
+    if kind == "json":
+        return JsonFileStore(data_folder)
+    if kind == "segment":
+        return SegmentStore(os.path.join(data_folder, "segments"), codec=codec)
+    raise ValueError("Store must be 'json' or 'segment'")
+
+def convert_json_to_segments(
+    data_folder,
+    codec="gzip",
+    remove=False
+    ):
+    """
+    Move all the JSON files of a data folder into the segment store.
+    --- Inputs ---
+    {data_folder} [string]: Path to the data folder with "coinid_YYYY_MM_DD.json" files.
+    {codec} [string]: Compression codec, either 'gzip' or 'zstd'.
+    {remove} [bool]: If True, remove each JSON file once it is stored in its segment.
+
+    --- Returns ---
+    n_records [int]: Number of converted files.
+    """
+    json_store = JsonFileStore(data_folder)
+    segment_store = get_raw_store("segment", data_folder, codec=codec)
+    n_records = 0
+    for coin_id, iso_date_str, data in json_store.iter_records():
+        if not segment_store.exists(coin_id, iso_date_str):
+            segment_store.save(coin_id, iso_date_str, data)
+        if remove:
+            os.remove(json_store.path(coin_id, iso_date_str))
+        n_records += 1
+
+    return n_records
+
+if __name__ == "__main__":
+    # Define command-line interface (CLI) arguments:
+    parser = argparse.ArgumentParser(description="Convert downloaded JSON files into compressed segments")
+    parser.add_argument("--folder", default="crypto_datafiles", help="Data folder (default: crypto_datafiles)")
+    parser.add_argument("--codec", default="gzip", choices=["gzip", "zstd"], help="Compression codec (default: gzip)")
+    parser.add_argument("--remove", action="store_true", help="Remove the JSON files after conversion")
+    # Parse the CLI arguments:
+    args = parser.parse_args()
+
+    n_records = convert_json_to_segments(args.folder, codec=args.codec, remove=args.remove)
+    print(f"✅ Converted {n_records} files into segments at {os.path.join(args.folder, 'segments')}")
@@ -8,6 +8,12 @@ DATA_DIR="$ROOT/crypto_datafiles"
 DOCKER="/usr/bin/docker"                                   # run: `which docker` to confirm
 IMAGE="api_request:latest"                                 # make sure this name/tag exists
 
+# --- COINS AND REQUEST SETTINGS ---
+COINS="bitcoin ethereum cardano"                           # coin IDs, separated by spaces
+COINS_FILE=""                                              # optional: absolute path to a file with one coin ID per line (replaces COINS)
+WORKERS=4                                                  # max concurrent requests
+CALLS_PER_MINUTE=30                                        # calls per minute allowed by your CoinGecko plan
+
 # Make sure the output folder exists
 mkdir -p "$DATA_DIR"
 
@@ -15,11 +21,21 @@ mkdir -p "$DATA_DIR"
 DATE_STR="$(date -d 'yesterday' '+%Y-%m-%d')"
 USER_IDS="$(id -u):$(id -g)"                      # compute once
 
-for COIN in bitcoin ethereum cardano; do
-  "$DOCKER" run --rm \
-    --env-file "$ENV_FILE" \
-    -u "$USER_IDS" \
-    -v "$DATA_DIR:/app/crypto_datafiles" \
-    "$IMAGE" "$COIN" "$DATE_STR"
-done
+# Pass the coins either as a list or as a file mounted in the container
+if [ -n "$COINS_FILE" ]; then
+  COIN_ARGS=(--coins_file /app/coins.txt)
+  MOUNT_ARGS=(-v "$COINS_FILE:/app/coins.txt:ro")
+else
+  read -r -a COIN_LIST <<< "$COINS"
+  COIN_ARGS=(--coins "${COIN_LIST[@]}")
+  MOUNT_ARGS=()
+fi
 
+# Download all coins in a single container (one process and one connection pool)
+"$DOCKER" run --rm \
+  --env-file "$ENV_FILE" \
+  -u "$USER_IDS" \
+  -v "$DATA_DIR:/app/crypto_datafiles" \
+  ${MOUNT_ARGS[@]+"${MOUNT_ARGS[@]}"} \
+  "$IMAGE" "${COIN_ARGS[@]}" --date "$DATE_STR" \
+  --workers "$WORKERS" --calls_per_minute "$CALLS_PER_MINUTE"
@@ -4,5 +4,11 @@ CREATE TABLE IF NOT EXISTS crypto_daily_data (
     price_usd NUMERIC,
     date DATE NOT NULL,
     response_json JSONB NOT NULL,
+    market_cap_usd NUMERIC,
+    market_cap_eur NUMERIC,
+    market_cap_btc NUMERIC,
+    total_volume_usd NUMERIC,
+    total_volume_eur NUMERIC,
+    total_volume_btc NUMERIC,
     UNIQUE (coin_id, date)
 );
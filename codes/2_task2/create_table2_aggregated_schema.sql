@@ -5,6 +5,20 @@ CREATE TABLE IF NOT EXISTS crypto_aggregated_info (
     month INT NOT NULL,
     max_price_usd NUMERIC,
     min_price_usd NUMERIC,
+    avg_price_usd NUMERIC,
+    n_days INT,
+    first_price_usd NUMERIC,
+    last_price_usd NUMERIC,
+    total_volume_usd NUMERIC,
+    updated_at TIMESTAMP DEFAULT NOW(),
     UNIQUE (coin_id, year, month)
 );
 
+-- Columns added after the first version of the table (no effect on new tables) --
+ALTER TABLE crypto_aggregated_info
+    ADD COLUMN IF NOT EXISTS avg_price_usd NUMERIC,
+    ADD COLUMN IF NOT EXISTS n_days INT,
+    ADD COLUMN IF NOT EXISTS first_price_usd NUMERIC,
+    ADD COLUMN IF NOT EXISTS last_price_usd NUMERIC,
+    ADD COLUMN IF NOT EXISTS total_volume_usd NUMERIC,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
@@ -4,12 +4,35 @@
 # Import libraries:
 
 import os
+import io
+import sys
+import csv
 import json
+import argparse
+import hashlib
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from sqlalchemy import create_engine, Column, Integer, String, Numeric, Date, JSON, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from psycopg2.extras import execute_values
 
+# The raw-data store is shared with Task 1 (codes/1_task1/raw_store.py):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "1_task1"))
+from raw_store import get_raw_store, SegmentStore
+
+# Fast JSON parser, if available (pip install orjson), otherwise the standard library:
+try:
+    import orjson
+    json_loads = orjson.loads
+    def json_dumps(data):
+        return orjson.dumps(data).decode("utf-8")
+except ImportError:
+    json_loads = json.loads
+    def json_dumps(data):
+        return json.dumps(data, separators=(",", ":"))
 
 # WARNING: if you want to run the script directly and not using docker, 
 # ... then uncomment the following lines
@@ -38,6 +61,47 @@ except Exception as e:
     print(f"❌ Failed to connect to the database: {e}")
     raise SystemExit(1)
 
+# Market metrics stored as typed columns "{metric}_{currency}" (e.g. market_cap_usd), so analytical
+# queries do not need to parse 'response_json'. More currencies can be added with --metric_currencies:
+METRIC_FIELDS = ("market_cap", "total_volume")
+DEFAULT_METRIC_CURRENCIES = ("usd", "eur", "btc")
+
+# Ledger of processed local sources, used for incremental loading:
+LEDGER_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS crypto_ingest_ledger (
+        source VARCHAR(255) PRIMARY KEY,
+        mtime_ns BIGINT NOT NULL,
+        size BIGINT NOT NULL,
+        sha256 CHAR(64),
+        n_records INT NOT NULL,
+        loaded_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )"""
+
+# Monthly aggregates table (same schema as create_table2_aggregated_schema.sql):
+AGGREGATES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS crypto_aggregated_info (
+        id SERIAL PRIMARY KEY,
+        coin_id VARCHAR(64) NOT NULL,
+        year INT NOT NULL,
+        month INT NOT NULL,
+        max_price_usd NUMERIC,
+        min_price_usd NUMERIC,
+        avg_price_usd NUMERIC,
+        n_days INT,
+        first_price_usd NUMERIC,
+        last_price_usd NUMERIC,
+        total_volume_usd NUMERIC,
+        updated_at TIMESTAMP DEFAULT NOW(),
+        UNIQUE (coin_id, year, month)
+    );
+    ALTER TABLE crypto_aggregated_info
+        ADD COLUMN IF NOT EXISTS avg_price_usd NUMERIC,
+        ADD COLUMN IF NOT EXISTS n_days INT,
+        ADD COLUMN IF NOT EXISTS first_price_usd NUMERIC,
+        ADD COLUMN IF NOT EXISTS last_price_usd NUMERIC,
+        ADD COLUMN IF NOT EXISTS total_volume_usd NUMERIC,
+        ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()"""
+
 # Create a configured "Session" class and a Base class for defining ORM models:
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -60,6 +124,12 @@ class CoinDailyData(Base):
     price_usd = Column(Numeric)
     date = Column(Date, nullable=False)
     response_json = Column(JSON, nullable=False)
+    market_cap_usd = Column(Numeric)
+    market_cap_eur = Column(Numeric)
+    market_cap_btc = Column(Numeric)
+    total_volume_usd = Column(Numeric)
+    total_volume_eur = Column(Numeric)
+    total_volume_btc = Column(Numeric)
 
     # Enforce one record per (coin_id, date)
     __table_args__ = (UniqueConstraint('coin_id', 'date', name='unique_coin_date'),)
@@ -100,59 +170,532 @@ def extract_price_usd(json_data):
     except Exception:
         return None
 
+def plan_local_sources(
+    data_folder,
+    ledger=None,
+    ledger_updates=None
+    ):
+    """
+    List the local sources to be read, both JSON files and records in compressed segments.
+    If a ledger of processed sources is given, only new or modified sources are listed:
+    - JSON files are skipped when their modification time and size match the ledger (their
+    content hash is checked later, when they are read).
+    - Segment indexes are append-only, so only the index lines written after the byte offset
+    stored in the ledger are listed.
+    --- Inputs ---
+    {data_folder} [string]: path to data folder which stores the .json files (and the 'segments' subfolder)
+    {ledger} [dict | None]: Processed sources, {source: (mtime_ns, size, sha256)}. If None, all sources are listed.
+    {ledger_updates} [list | None]: If given, a (source, mtime_ns, size, sha256, n_records) tuple is
+    appended for every listed segment index, to be stored in the ledger once the records are loaded.
+
+    --- Returns ---
+    tasks [list]: Sources to read, either ("json", path, mtime_ns, size, previous_sha256) or
+    ("segment", segment_folder, partition, index_entries) tuples.
+    """
+    ledger = ledger if ledger is not None else {}
+    tasks = []
+
+    # One JSON file per record (scandir gives modification times without opening the files):
+    for item in os.scandir(data_folder):
+        if not item.name.endswith('.json'):
+            continue
+        st = item.stat()
+        previous = ledger.get(item.name)
+        if previous is not None and previous[:2] == (st.st_mtime_ns, st.st_size):
+            continue
+        tasks.append(("json", item.path, st.st_mtime_ns, st.st_size, previous[2] if previous else None))
+
+    # Records appended to compressed segment files:
+    if os.path.isdir(os.path.join(data_folder, "segments")):
+        segment_store = get_raw_store("segment", data_folder)
+        for partition in segment_store.partitions():
+            source = f"segments/{partition}.idx"
+            st = os.stat(os.path.join(segment_store.folder, partition + ".idx"))
+            previous = ledger.get(source)
+            # Resume after the last processed index line (start over if the index was rewritten):
+            start = previous[1] if previous is not None and previous[1] <= st.st_size else 0
+            if start == st.st_size:
+                continue
+            entries, end = segment_store.read_index(partition, start=start)
+            if ledger_updates is not None:
+                ledger_updates.append((source, st.st_mtime_ns, end, None, len(entries)))
+            tasks.append(("segment", segment_store.folder, partition, entries))
+
+    return tasks
+
+def read_local_sources(
+    tasks,
+    ledger_updates=None
+    ):
+    """
+    Read the sources listed by `plan_local_sources`.
+    --- Inputs ---
+    {tasks} [list]: Sources to read, as returned by `plan_local_sources`.
+    {ledger_updates} [list | None]: If given, a (source, mtime_ns, size, sha256, n_records) tuple is
+    appended for every JSON file read, to be stored in the ledger once the records are loaded.
+
+    --- Returns ---
+    Generator of (source, coin_id, record_date, data) tuples, where {source} names the file or segment
+    the record was read from.
+    """
+    for task in tasks:
+        if task[0] == "json":
+            _, path, mtime_ns, size, previous_sha256 = task
+            filename = os.path.basename(path)
+            # Read data, skipping files that were touched but whose content did not change:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            sha256 = hashlib.sha256(payload).hexdigest()
+            if ledger_updates is not None:
+                ledger_updates.append((filename, mtime_ns, size, sha256, 1))
+            if sha256 == previous_sha256:
+                continue
+            # Derive metadata from filename:
+            coin_id, record_date = extract_coin_and_date(filename)
+            yield filename, coin_id, record_date, json_loads(payload)
+        else:
+            _, segment_folder, partition, entries = task
+            for coin_id, iso_date_str, data in SegmentStore(segment_folder).iter_entries(partition, entries):
+                record_date = datetime.strptime(iso_date_str, "%Y-%m-%d").date()
+                yield f"segment record {coin_id} {iso_date_str}", coin_id, record_date, data
+
+def get_metric_columns(currencies=DEFAULT_METRIC_CURRENCIES):
+    """
+    Names of the typed metric columns for the given currencies.
+    --- Inputs ---
+    {currencies} [list]: Currency codes used by CoinGecko (e.g. 'usd', 'eur', 'btc').
+
+    --- Returns ---
+    [list]: Column names "{metric}_{currency}", for every metric in METRIC_FIELDS.
+
+    --- Raises ---
+    ValueError: If a currency code is not a valid lowercase identifier.
+    """
+    for currency in currencies:
+        if not re.fullmatch(r"[a-z0-9]+", currency):
+            raise ValueError(f"Invalid currency code: {currency}")
+
+    return [f"{metric}_{currency}" for metric in METRIC_FIELDS for currency in currencies]
+
+def extract_metrics(
+    json_data,
+    metric_columns
+    ):
+    """
+    Extract market metrics from a CoinGecko history JSON data.
+    --- Inputs ---
+    {json_data} [dict]: Parsed JSON object returned by the API.
+    {metric_columns} [list]: Column names "{metric}_{currency}", as returned by get_metric_columns.
+
+    --- Returns ---
+    [list]: Metric values, in the same order as {metric_columns} (None if not available).
+    """
+    market_data = json_data.get("market_data") or {}
+    values = []
+    for column in metric_columns:
+        metric, currency = column.rsplit("_", 1)
+        values.append((market_data.get(metric) or {}).get(currency))
+
+    return values
+
+def ensure_metric_columns(
+    cursor,
+    metric_columns
+    ):
+    """
+    Add the missing metric columns to 'crypto_daily_data', and fill them for the rows already
+    in the table, from their 'response_json'.
+    --- Inputs ---
+    {cursor} [psycopg2 cursor]: Cursor of the loading transaction.
+    {metric_columns} [list]: Column names "{metric}_{currency}", as returned by get_metric_columns.
+
+    --- Returns ---
+    None
+    """
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'crypto_daily_data'")
+    existing = {row[0] for row in cursor.fetchall()}
+    for column in metric_columns:
+        if column not in existing:
+            metric, currency = column.rsplit("_", 1)
+            cursor.execute(f"ALTER TABLE crypto_daily_data ADD COLUMN {column} NUMERIC")
+            cursor.execute(f"""
+                UPDATE crypto_daily_data
+                SET {column} = (response_json->'market_data'->'{metric}'->>'{currency}')::numeric
+                WHERE response_json->'market_data'->'{metric}' ? '{currency}'""")
+
+def iter_local_records(
+    data_folder,
+    ledger=None,
+    ledger_updates=None
+    ):
+    """
+    Stream the raw responses stored locally, both as JSON files and in compressed segments.
+    --- Inputs ---
+    {data_folder} [string]: path to data folder which stores the .json files (and the 'segments' subfolder)
+    {ledger} [dict | None]: Processed sources, {source: (mtime_ns, size, sha256)}. If None, all records are read.
+    {ledger_updates} [list | None]: If given, ledger rows of the new or modified sources are appended to it.
+
+    --- Returns ---
+    Generator of (source, coin_id, record_date, data) tuples.
+    """
+    tasks = plan_local_sources(data_folder, ledger, ledger_updates)
+    yield from read_local_sources(tasks, ledger_updates)
+
+def parse_sources_chunk(
+    tasks,
+    metric_columns
+    ):
+    """
+    Parse a chunk of local sources into rows ready to be loaded (runs in a worker process).
+    --- Inputs ---
+    {tasks} [list]: Sources to read, as returned by `plan_local_sources`.
+    {metric_columns} [list]: Metric columns to extract, as returned by get_metric_columns.
+
+    --- Returns ---
+    rows [list]: (coin_id, date, price_usd, *metrics, response_json) tuples, with {response_json}
+    as a compact JSON string.
+    ledger_updates [list]: Ledger rows for the JSON files read.
+    """
+    ledger_updates = []
+    rows = [
+        (coin_id, record_date.isoformat(), extract_price_usd(data),
+            *extract_metrics(data, metric_columns), json_dumps(data))
+        for _, coin_id, record_date, data in read_local_sources(tasks, ledger_updates)
+    ]
+
+    return rows, ledger_updates
+
+def iter_parsed_chunks(
+    tasks,
+    metric_columns,
+    workers=1,
+    chunk_size=5000
+    ):
+    """
+    Parse local sources in parallel, as a producer/consumer pipeline: a pool of worker processes
+    parses chunks of sources, and the results are handed over, in order, to the single consumer
+    (the database writer). At most two chunks per worker are in flight, so memory use stays flat.
+    --- Inputs ---
+    {tasks} [list]: Sources to read, as returned by `plan_local_sources`.
+    {metric_columns} [list]: Metric columns to extract, as returned by get_metric_columns.
+    {workers} [int]: Number of worker processes (1 parses in the current process).
+    {chunk_size} [int]: Maximum number of records per chunk.
+
+    --- Returns ---
+    Generator of (rows, ledger_updates) tuples, as returned by `parse_sources_chunk`.
+    """
+    # Split sources in chunks of at most {chunk_size} records:
+    chunks = []
+    json_tasks = [task for task in tasks if task[0] == "json"]
+    for i in range(0, len(json_tasks), chunk_size):
+        chunks.append(json_tasks[i:i+chunk_size])
+    for _, segment_folder, partition, entries in (task for task in tasks if task[0] == "segment"):
+        for i in range(0, len(entries), chunk_size):
+            chunks.append([("segment", segment_folder, partition, entries[i:i+chunk_size])])
+
+    # Parse in the current process:
+    if workers <= 1:
+        for chunk in chunks:
+            yield parse_sources_chunk(chunk, metric_columns)
+        return
+
+    # Parse in a pool of processes, keeping a bounded queue of pending chunks:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parse_sources_chunk, chunk, metric_columns))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 def populate_crypto_daily_data(data_folder):
     """
-    Populate the 'crypto_daily_data' table from local JSON files.
+    Populate the 'crypto_daily_data' table from local JSON files, with the default metric columns.
     --- Inputs ---
-    {data_folder} [string]: path to data folder which stores the .json files
+    {data_folder} [string]: path to data folder which stores the .json files (and the 'segments' subfolder)
 
     --- Returns ---
     None: Performs inserts into the database and prints an import summary.
     """
 
     # Initiate:
+    metric_columns = get_metric_columns()
+    with engine.begin() as connection:
+        ensure_metric_columns(connection.connection.cursor(), metric_columns)
     session = SessionLocal()
     file_count = 0
 
-    # Iterate all files in the folder; only process *.json
-    for filename in os.listdir(data_folder):
-        if filename.endswith('.json'):
-            # Get full path:
-            full_path = os.path.join(data_folder, filename)
+    # Iterate all local records (JSON files and segments):
+    for source, coin_id, record_date, data in iter_local_records(data_folder):
+        # Extract USD price information:
+        price_usd = extract_price_usd(data)
+
+        # Build ORM instance for insertion:
+        entry = CoinDailyData(
+            coin_id=coin_id,
+            price_usd=price_usd,
+            date=record_date,
+            response_json=data,
+            **dict(zip(metric_columns, extract_metrics(data, metric_columns)))
+        )
+
+        # Insert row; if duplicate or other error, rollback and skip:
+        try:
+            session.add(entry)
+            session.commit()
+            file_count += 1
+        except Exception as e:
+            session.rollback()
+            print(f"Skipping {source}: {e}")
 
-            # Derive metadata from filename:
-            coin_id, record_date = extract_coin_and_date(filename)
+    # Close session:
+    session.close()
+    # Final log:
+    print(f"Imported {file_count} records into crypto_daily_data.")
 
-            # Read data:
-            with open(full_path, 'r') as f:
-                data = json.load(f)
+def copy_rows_to_staging(
+    cursor,
+    rows,
+    columns
+    ):
+    """
+    Stream a batch of rows into the staging table using COPY (its {seq} column numbers the rows in
+    the order they are sent).
+    --- Inputs ---
+    {cursor} [psycopg2 cursor]: Cursor of the loading transaction.
+    {rows} [list]: Tuples of values, as returned by `parse_sources_chunk`.
+    {columns} [list]: Staging column names, in the same order as the values in {rows}.
 
-            # Extract USD price information:
-            price_usd = extract_price_usd(data)
+    --- Returns ---
+    None
+    """
+    # Write the batch as CSV (None becomes an empty field, which COPY reads as NULL):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY crypto_daily_data_staging ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+def refresh_monthly_aggregates(
+    cursor,
+    buckets
+    ):
+    """
+    Recompute the 'crypto_aggregated_info' rows of the given (coin, year, month) buckets from
+    'crypto_daily_data', inserting new buckets and updating existing ones. Only the daily rows of
+    those buckets are read (through the (coin_id, date) index), so the cost depends on the size of
+    the loaded batch and not on the size of the table.
+    If the aggregates table is still empty, every bucket of 'crypto_daily_data' is computed instead.
+    --- Inputs ---
+    {cursor} [psycopg2 cursor]: Cursor of the loading transaction.
+    {buckets} [list]: (coin_id, year, month) tuples touched by the load.
 
-            # Build ORM instance for insertion:
-            entry = CoinDailyData(
-                coin_id=coin_id,
-                price_usd=price_usd,
-                date=record_date,
-                response_json=data
-            )
+    --- Returns ---
+    n_buckets [int]: Number of refreshed buckets.
+    """
+    cursor.execute(AGGREGATES_TABLE_SQL)
+    ensure_metric_columns(cursor, ["total_volume_usd"])
+
+    # First run: backfill all the buckets:
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM crypto_aggregated_info)")
+    if not cursor.fetchone()[0]:
+        cursor.execute("""
+            SELECT DISTINCT coin_id, EXTRACT(YEAR FROM date)::int, EXTRACT(MONTH FROM date)::int
+            FROM crypto_daily_data""")
+        buckets = cursor.fetchall()
+    if not buckets:
+        return 0
+    coin_ids, years, months = (list(values) for values in zip(*buckets))
+    cursor.execute("""
+        INSERT INTO crypto_aggregated_info (
+            coin_id, year, month, max_price_usd, min_price_usd, avg_price_usd,
+            n_days, first_price_usd, last_price_usd, total_volume_usd, updated_at)
+        SELECT
+            b.coin_id,
+            b.year,
+            b.month,
+            MAX(d.price_usd),
+            MIN(d.price_usd),
+            AVG(d.price_usd),
+            COUNT(*),
+            (ARRAY_AGG(d.price_usd ORDER BY d.date))[1],
+            (ARRAY_AGG(d.price_usd ORDER BY d.date DESC))[1],
+            SUM(d.total_volume_usd),
+            NOW()
+        FROM unnest(%s::varchar[], %s::int[], %s::int[]) AS b(coin_id, year, month)
+        JOIN crypto_daily_data AS d
+            ON d.coin_id = b.coin_id
+            AND d.date >= make_date(b.year, b.month, 1)
+            AND d.date < make_date(b.year, b.month, 1) + INTERVAL '1 month'
+        GROUP BY b.coin_id, b.year, b.month
+        ON CONFLICT (coin_id, year, month) DO UPDATE SET
+            max_price_usd = EXCLUDED.max_price_usd,
+            min_price_usd = EXCLUDED.min_price_usd,
+            avg_price_usd = EXCLUDED.avg_price_usd,
+            n_days = EXCLUDED.n_days,
+            first_price_usd = EXCLUDED.first_price_usd,
+            last_price_usd = EXCLUDED.last_price_usd,
+            total_volume_usd = EXCLUDED.total_volume_usd,
+            updated_at = EXCLUDED.updated_at""", (coin_ids, years, months))
+
+    return len(buckets)
+
+def bulk_load_crypto_daily_data(
+    data_folder,
+    batch_size=5000,
+    on_conflict="nothing",
+    incremental=True,
+    workers=1,
+    metric_currencies=DEFAULT_METRIC_CURRENCIES,
+    update_aggregates=True
+    ):
+    """
+    Populate the 'crypto_daily_data' table from local records in a single transaction.
+    Rows are streamed with COPY into a temporary staging table, in batches, and then merged
+    into the table with one INSERT ... ON CONFLICT statement, so duplicates cost nothing.
 
-            # Insert row; if duplicate or other error, rollback and skip:
-            try:
-                session.add(entry)
-                session.commit()
-                file_count += 1
-            except Exception as e:
-                session.rollback()
-                print(f"Skipping {filename}: {e}")
+    Local files are read and parsed by a pool of {workers} processes, and a single writer
+    sends the parsed rows to Postgres. Market cap and total volume in {metric_currencies}
+    are extracted into typed numeric columns (added to the table if missing).
+
+    In incremental mode, the processed sources are recorded in the 'crypto_ingest_ledger' table
+    (in the same transaction), so each run only reads the files and segment records that are
+    new or modified since the previous run.
+
+    The monthly aggregates in 'crypto_aggregated_info' are refreshed for the (coin, year, month)
+    buckets touched by the load, also in the same transaction.
+    --- Inputs ---
+    {data_folder} [string]: path to data folder which stores the .json files (and the 'segments' subfolder)
+    {batch_size} [int]: Number of rows parsed by a worker and sent with each COPY.
+    {on_conflict} [string]: 'nothing' to keep rows already in the table (default), 'update' to overwrite them.
+    {incremental} [bool]: If True (default), skip the sources already recorded in the ledger.
+    {workers} [int]: Number of worker processes to read and parse local files.
+    {metric_currencies} [list]: Currencies of the typed metric columns.
+    {update_aggregates} [bool]: If True (default), refresh the monthly aggregates of the touched buckets.
+
+    --- Returns ---
+    None: Performs inserts into the database and prints an import summary.
+
+    --- Raises ---
+    ValueError: If {on_conflict} or a currency code are not valid.
+    """
+    # Define loaded columns:
+    metric_columns = get_metric_columns(metric_currencies)
+    columns = ["coin_id", "date", "price_usd"] + metric_columns + ["response_json"]
+
+    # Define how to handle rows that are already in the table:
+    if on_conflict == "nothing":
+        conflict_sql = "DO NOTHING"
+    elif on_conflict == "update":
+        updates = ",\n            ".join(f"{c} = EXCLUDED.{c}" for c in columns[2:])
+        conflict_sql = f"""DO UPDATE SET
+            {updates}
+            WHERE crypto_daily_data.response_json IS DISTINCT FROM EXCLUDED.response_json"""
+    else:
+        raise ValueError("on_conflict must be 'nothing' or 'update'")
+
+    # Use the psycopg2 connection behind the engine, all in one transaction:
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        # Load the ledger of processed sources:
+        ledger = {}
+        ledger_updates = []
+        cursor.execute(LEDGER_TABLE_SQL)
+        if incremental:
+            cursor.execute("SELECT source, mtime_ns, size, sha256 FROM crypto_ingest_ledger")
+            ledger = {source: (mtime_ns, size, sha256) for source, mtime_ns, size, sha256 in cursor.fetchall()}
+
+        # Make sure the metric columns exist:
+        ensure_metric_columns(cursor, metric_columns)
+
+        # Staging table, dropped at the end of the transaction ({seq} numbers the rows in load order:
+        # JSON files first, then segment records in index order):
+        metric_ddl = "".join(f"{c} NUMERIC,\n                " for c in metric_columns)
+        cursor.execute(f"""
+            CREATE TEMP TABLE crypto_daily_data_staging (
+                seq BIGSERIAL,
+                coin_id VARCHAR(64) NOT NULL,
+                date DATE NOT NULL,
+                price_usd NUMERIC,
+                {metric_ddl}response_json JSONB NOT NULL
+            ) ON COMMIT DROP""")
+
+        # Stream all new local records to the staging table, in batches parsed by the workers:
+        record_count = 0
+        tasks = plan_local_sources(data_folder, ledger, ledger_updates)
+        for rows, chunk_ledger_updates in iter_parsed_chunks(
+                tasks, metric_columns, workers=workers, chunk_size=batch_size):
+            if rows:
+                copy_rows_to_staging(cursor, rows, columns)
+            record_count += len(rows)
+            ledger_updates.extend(chunk_ledger_updates)
+
+        # Merge into the table (keeping the last loaded row per (coin_id, date) of the staging table,
+        # as the latest index line wins in the segment store), and count the inserted or updated rows per (coin, year, month) bucket:
+        cursor.execute(f"""
+            WITH merged AS (
+                INSERT INTO crypto_daily_data ({', '.join(columns)})
+                SELECT DISTINCT ON (coin_id, date) {', '.join(columns)}
+                FROM crypto_daily_data_staging
+                ORDER BY coin_id, date, seq DESC
+                ON CONFLICT (coin_id, date) {conflict_sql}
+                RETURNING coin_id, date
+            )
+            SELECT coin_id, EXTRACT(YEAR FROM date)::int, EXTRACT(MONTH FROM date)::int, COUNT(*)
+            FROM merged
+            GROUP BY 1, 2, 3""")
+        bucket_counts = cursor.fetchall()
+        file_count = sum(count for _, _, _, count in bucket_counts)
+
+        # Refresh the monthly aggregates of the touched buckets:
+        n_buckets = 0
+        if update_aggregates:
+            n_buckets = refresh_monthly_aggregates(cursor, [bucket[:3] for bucket in bucket_counts])
+
+        # Record the processed sources in the ledger:
+        execute_values(cursor, """
+            INSERT INTO crypto_ingest_ledger (source, mtime_ns, size, sha256, n_records)
+            VALUES %s
+            ON CONFLICT (source) DO UPDATE SET
+                mtime_ns = EXCLUDED.mtime_ns,
+                size = EXCLUDED.size,
+                sha256 = EXCLUDED.sha256,
+                n_records = EXCLUDED.n_records,
+                loaded_at = NOW()""", ledger_updates)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-    # Close session:
-    session.close()
     # Final log:
-    print(f"Imported {file_count} records into crypto_daily_data.")
+    print(f"Imported {file_count} records into crypto_daily_data ({record_count} new or modified local records read).")
+    if update_aggregates:
+        print(f"Refreshed {n_buckets} monthly buckets in crypto_aggregated_info.")
 
 if __name__ == "__main__":
+    # Define command-line interface (CLI) arguments:
+    parser = argparse.ArgumentParser(description="Load local CoinGecko records into Postgres")
+    parser.add_argument("--mode", default="bulk", choices=["bulk", "orm"],
+        help="bulk: COPY in a single transaction (default), orm: one insert and commit per record")
+    parser.add_argument("--on_conflict", default="nothing", choices=["nothing", "update"],
+        help="Bulk mode only: keep (default) or update rows already in the table")
+    parser.add_argument("--full", action="store_true", help="Bulk mode only: read all local records, ignoring the ingest ledger")
+    parser.add_argument("--batch_size", type=int, default=5000, help="Bulk mode only: rows per COPY batch (default: 5000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+        help="Bulk mode only: processes to parse local files (default: number of CPUs)")
+    parser.add_argument("--no_aggregates", action="store_true",
+        help="Bulk mode only: do not refresh the monthly aggregates in crypto_aggregated_info")
+    parser.add_argument("--metric_currencies", nargs="+", default=list(DEFAULT_METRIC_CURRENCIES),
+        help="Bulk mode only: currencies for the market_cap/total_volume columns (default: usd eur btc)")
+    # Parse the CLI arguments:
+    args = parser.parse_args()
+
     # WARNING: Leave only the lines that works for your setup:
 
     # If running from docker:
@@ -161,4 +704,9 @@ if __name__ == "__main__":
     # If running directly from python (remember also to change lines at the top of the script):
     # data_folder_path = "../1_task1/crypto_datafiles/"
 
-    populate_crypto_daily_data(data_folder_path)
\ No newline at end of file
+    if args.mode == "bulk":
+        bulk_load_crypto_daily_data(data_folder_path, batch_size=args.batch_size, on_conflict=args.on_conflict,
+            incremental=not args.full, workers=args.workers, metric_currencies=args.metric_currencies,
+            update_aggregates=not args.no_aggregates)
+    else:
+        populate_crypto_daily_data(data_folder_path)
\ No newline at end of file
@@ -1,10 +1,28 @@
-INSERT INTO crypto_aggregated_info (coin_id, year, month, max_price_usd, min_price_usd)
+-- Full refresh of the monthly aggregates. The Stage 2 loader (main2.py) keeps them up to date --
+-- incrementally, refreshing only the (coin, year, month) buckets touched by each load. --
+INSERT INTO crypto_aggregated_info (
+    coin_id, year, month, max_price_usd, min_price_usd, avg_price_usd,
+    n_days, first_price_usd, last_price_usd, total_volume_usd, updated_at)
 SELECT
     coin_id,
     EXTRACT(YEAR FROM date) AS year,
     EXTRACT(MONTH FROM date) AS month,
     MAX(price_usd) AS max_price_usd,
-    MIN(price_usd) AS min_price_usd
+    MIN(price_usd) AS min_price_usd,
+    AVG(price_usd) AS avg_price_usd,
+    COUNT(*) AS n_days,
+    (ARRAY_AGG(price_usd ORDER BY date))[1] AS first_price_usd,
+    (ARRAY_AGG(price_usd ORDER BY date DESC))[1] AS last_price_usd,
+    SUM(total_volume_usd) AS total_volume_usd,
+    NOW() AS updated_at
 FROM crypto_daily_data
 GROUP BY coin_id, year, month
-ON CONFLICT (coin_id, year, month) DO NOTHING;
+ON CONFLICT (coin_id, year, month) DO UPDATE SET
+    max_price_usd = EXCLUDED.max_price_usd,
+    min_price_usd = EXCLUDED.min_price_usd,
+    avg_price_usd = EXCLUDED.avg_price_usd,
+    n_days = EXCLUDED.n_days,
+    first_price_usd = EXCLUDED.first_price_usd,
+    last_price_usd = EXCLUDED.last_price_usd,
+    total_volume_usd = EXCLUDED.total_volume_usd,
+    updated_at = EXCLUDED.updated_at;
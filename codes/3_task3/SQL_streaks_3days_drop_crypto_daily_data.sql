@@ -12,8 +12,9 @@ WITH params AS (
         NULLIF(:'init_date','')::date AS init_date,
         NULLIF(:'final_date','')::date AS final_date
 ),
+-- Only the typed columns are read (market_cap_usd is extracted from the JSON response at load time) --
 filtered_data AS (
-    SELECT c.*
+    SELECT c.coin_id, c.date, c.price_usd, c.market_cap_usd
     FROM crypto_daily_data AS c
     CROSS JOIN params AS p
     WHERE (p.init_date IS NULL OR c.date >= p.init_date)
@@ -30,7 +31,7 @@ price_usd_changes AS (
         PARTITION BY coin_id
         ORDER BY date
     ) AS price_change_1day_usd,
-    (response_json->'market_data'->'market_cap'->>'usd')::numeric AS market_cap_usd
+    market_cap_usd
     FROM filtered_data
 ),
 -- Flag drop days --
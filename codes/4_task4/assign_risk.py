@@ -7,7 +7,7 @@ import psycopg2
 import argparse
 from dotenv import load_dotenv
 
-from helper_functions import get_data_from_postgres, add_risks_to_df
+from helper_functions import CACHE_DIR, get_data_from_postgres, add_risks_to_df
 
 # Get environmental variables:
 load_dotenv("../../.env")
@@ -17,6 +17,10 @@ if __name__ == "__main__":
 	# Define command-line interface (CLI) arguments:
 	parser = argparse.ArgumentParser(description="Assign a risk type for each month based on a dropping-streak criterion")
 	parser.add_argument("--table", type=str, help="Table name: crypto_daily_data (default) or coin_data")
+	parser.add_argument("--no_cache", action="store_true", help="Read from Postgres instead of the local Parquet cache")
+	parser.add_argument("--coins", nargs="+", help="Coins to analyze (space-separated). Leave off for all.")
+	parser.add_argument("--start_date", type=str, help="First date to read, YYYY-MM-DD (default: earliest)")
+	parser.add_argument("--end_date", type=str, help="Last date to read, YYYY-MM-DD (default: latest)")
 	parser.add_argument("--streak_days", type=int, help="Number of dropping streak days for risk assignment (default: 1)")
 	parser.add_argument("--risk_period_days", type=int, help="Number of days for the risk period (default: 30)")
 
@@ -31,7 +35,9 @@ if __name__ == "__main__":
 	risk_period_days = args.risk_period_days if args.risk_period_days else 30
 
 	# Get information as dataframe:
-	df = get_data_from_postgres(password=PASSWORD,table=table)
+	df = get_data_from_postgres(
+		password=PASSWORD,table=table,coins=args.coins,start_date=args.start_date,end_date=args.end_date,
+		cache_dir=None if args.no_cache else CACHE_DIR)
 
 	# Assign risks:
 	df_risks = add_risks_to_df(df,drop_streak_days=streak_days,risk_period_days=risk_period_days)
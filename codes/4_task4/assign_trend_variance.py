@@ -7,7 +7,7 @@ import psycopg2
 import argparse
 from dotenv import load_dotenv
 
-from helper_functions import get_data_from_postgres, add_trend_and_variance_to_df, plot_trend
+from helper_functions import CACHE_DIR, get_data_from_postgres, add_trend_and_variance_to_df, plot_trend
 
 # Get environmental variables:
 load_dotenv("../../.env")
@@ -17,6 +17,10 @@ if __name__ == "__main__":
 	# Define command-line interface (CLI) arguments:
 	parser = argparse.ArgumentParser(description="Assign trend and variance for each coin, daily")
 	parser.add_argument("--table", type=str, help="Table name: crypto_daily_data (default) or coin_data")
+	parser.add_argument("--no_cache", action="store_true", help="Read from Postgres instead of the local Parquet cache")
+	parser.add_argument("--coins", nargs="+", help="Coins to analyze (space-separated). Leave off for all.")
+	parser.add_argument("--start_date", type=str, help="First date to read, YYYY-MM-DD (default: earliest)")
+	parser.add_argument("--end_date", type=str, help="Last date to read, YYYY-MM-DD (default: latest)")
 	parser.add_argument("--trend", type=str, help="Trending criterion, either slope (default) or compare_extremes")
 	parser.add_argument("--window", type=int, help="Time window to look back and calculate trend and variance, in days, default: 7")
 	parser.add_argument("--frac", type=float, help="Tolerance for trend criterion, a fraction of the current price, default: 0.05")
@@ -40,7 +44,9 @@ if __name__ == "__main__":
 	save_image = args.save_image if args.save_image else False
 
 	# Get information as dataframe:
-	df = get_data_from_postgres(password=PASSWORD,table=table)
+	df = get_data_from_postgres(
+		password=PASSWORD,table=table,coins=args.coins,start_date=args.start_date,end_date=args.end_date,
+		cache_dir=None if args.no_cache else CACHE_DIR)
 
 	# Assign trend and variance:
 	df_trend_var = add_trend_and_variance_to_df(
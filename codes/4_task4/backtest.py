@@ -0,0 +1,212 @@
+# backtest.py
+# Walk-forward backtest of the per-coin ML models.
+
+import os
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from threadpoolctl import threadpool_limits
+
+from parallel_training import coin_matrix, feature_columns, run_coin_tasks
+
+# ==============
+
+def walk_forward_folds(
+	dates,
+	bounds,
+	test_days=365,
+	retrain_every=1,
+	train_window_days=None,
+	min_train_rows=30
+	):
+	"""
+	Fold boundaries of a walk-forward backtest, as row slices of a matrix sorted by coin and date.
+	A model is retrained every {retrain_every} days over the last {test_days} days of the data, on all
+	the previous days (expanding window) or on the previous {train_window_days} days (rolling window),
+	and tested on the days until the next retraining. Fold numbers are shared by all coins.
+	--- Inputs ---
+	{dates} [numpy array]: Dates, sorted by coin and date.
+	{bounds} [numpy array]: Row where every coin starts, plus the total number of rows (see `coin_matrix`).
+	{test_days} [int]: Number of days covered by the test folds.
+	{retrain_every} [int]: Days between two retrainings.
+	{train_window_days} [int]: Days of the rolling training window (default: None, expanding window).
+	{min_train_rows} [int]: Minimum number of training rows of a fold (smaller folds are skipped).
+
+	--- Returns ---
+	folds [list]: Array of (fold, train_start, test_start, test_stop) rows for every coin.
+	fold_dates [pandas DatetimeIndex]: First test date of every fold.
+	"""
+	dates = np.asarray(dates, dtype='datetime64[ns]')
+	last_date = pd.Timestamp(dates.max()).normalize()
+	fold_dates = pd.date_range(
+		last_date - pd.Timedelta(days=int(test_days) - 1), last_date, freq=f'{int(retrain_every)}D')
+	fold_starts = fold_dates.to_numpy()
+
+	folds = []
+	for b0, b1 in zip(bounds[:-1], bounds[1:]):
+		coin_dates = dates[b0:b1]
+		# Test rows of fold k: from its first date to the first date of fold k+1:
+		splits = b0 + np.searchsorted(coin_dates, fold_starts, side='left')
+		stops = np.r_[splits[1:], b1]
+		if train_window_days:
+			starts = b0 + np.searchsorted(
+				coin_dates, fold_starts - np.timedelta64(int(train_window_days), 'D'), side='left')
+		else:
+			starts = np.full(len(splits), b0)
+		keep = (stops > splits) & (splits - starts >= min_train_rows)
+		folds.append(np.column_stack([np.flatnonzero(keep), starts[keep], splits[keep], stops[keep]]))
+
+	return folds, fold_dates
+
+def backtest_coin(
+	data,
+	coin,
+	folds,
+	n_features,
+	estimator,
+	threads=None
+	):
+	"""
+	Fit and test a copy of {estimator} on every fold of one coin.
+	--- Inputs ---
+	{data} [numpy array | string]: Matrix built by `coin_matrix`, or the path of its .npy file.
+	{coin} [string]: Coin name.
+	{folds} [numpy array]: (fold, train_start, test_start, test_stop) rows (see `walk_forward_folds`).
+	{n_features} [int]: Number of feature columns of the matrix.
+	{estimator} [sklearn estimator]: Unfitted model, cloned for every fold.
+	{threads} [int]: Maximum number of threads of the fits (default: None, no limit).
+
+	--- Returns ---
+	coin [string]: Coin name.
+	folds [numpy array]: Same as the input.
+	y_pred_norm [numpy array]: Predictions of all the test rows, fold after fold.
+	"""
+	if isinstance(data, str):
+		data = np.load(data, mmap_mode='r')
+
+	predictions = []
+	with threadpool_limits(limits=threads):
+		for _, start, split, stop in folds:
+			model = clone(estimator)
+			if threads is not None and 'n_jobs' in model.get_params():
+				model.set_params(n_jobs=threads)
+			model.fit(data[start:split, :n_features], data[start:split, n_features])
+			predictions.append(model.predict(data[split:stop, :n_features]))
+
+	return coin, folds, np.concatenate(predictions) if predictions else np.empty(0)
+
+# ==============
+
+def walk_forward_backtest(
+	df,
+	estimator,
+	target='price_usd',
+	ref_price='price_usd-1_orig',
+	coin_col='coin_id',
+	date_col='date',
+	drop_cols=['coin_id', 'date', 'risk_level', 'trend'],
+	test_days=365,
+	retrain_every=1,
+	train_window_days=None,
+	min_train_rows=30,
+	max_workers=None,
+	threads_per_worker=1
+	):
+	"""
+	Backtest a model retrained at a fixed cadence, as it would have run day after day (see
+	`walk_forward_folds`). The feature matrix of all coins is built once, the folds are row slices of
+	it, and the coins are spread across a pool of processes (see `run_coin_tasks`).
+	--- Inputs ---
+	{df} [pandas DataFrame]: Features, target and reference price of every coin and day (no NaN values).
+	{estimator} [sklearn estimator]: Unfitted model, cloned for every coin and fold.
+	{target} [string]: Target column (absolute price), normalized by {ref_price} for training.
+	{ref_price} [string]: Reference price to scale the target back to absolute prices.
+	{coin_col} [string]: Coin column.
+	{date_col} [string]: Date column.
+	{drop_cols} [list]: Columns not used as predictors, with their per-window variants (see `feature_columns`).
+		The target and reference price are always dropped.
+	{test_days}, {retrain_every}, {train_window_days}, {min_train_rows}: See `walk_forward_folds`.
+	{max_workers} [int]: Number of processes (default: None, all cores).
+	{threads_per_worker} [int]: Maximum number of threads of every fit in the pool (default: 1).
+
+	--- Returns ---
+	metrics [pandas DataFrame]: One row per coin and fold, then one row per coin with fold 'all' (all its
+		test days) and a last row with coin 'all' and fold 'all'. Columns: train and test dates, n_train,
+		n_test, RMSE_abs_price and MAE_abs_price.
+	predictions [pandas DataFrame]: Test rows, with the fold, the true and predicted absolute prices.
+	"""
+	# Build the feature matrix once (rows sorted by coin and date):
+	feature_cols = feature_columns(df, drop_cols, [ref_price, target])
+	n_features = len(feature_cols)
+	data, coins, bounds = coin_matrix(df, feature_cols, target, ref_price, coin_col, date_col)
+	coin_codes = pd.factorize(df[coin_col], sort=True)[0]
+	order = np.lexsort((df[date_col].to_numpy(), coin_codes))
+	dates = df[date_col].to_numpy(dtype='datetime64[ns]')[order]
+
+	# Fold boundaries, as row slices:
+	folds, fold_dates = walk_forward_folds(
+		dates, bounds, test_days=test_days, retrain_every=retrain_every,
+		train_window_days=train_window_days, min_train_rows=min_train_rows)
+
+	# Fit every coin's folds, in parallel:
+	parallel = min(max_workers or os.cpu_count() or 1, len(coins)) > 1
+	tasks = [
+		(coin, coin_folds, n_features, estimator, threads_per_worker if parallel else None)
+		for coin, coin_folds in zip(coins, folds) if len(coin_folds)]
+	y_pred_norm = np.full(len(data), np.nan)
+	fold_of_row = np.full(len(data), -1)
+	for coin, coin_folds, coin_predictions in run_coin_tasks(data, backtest_coin, tasks, max_workers=max_workers):
+		rows = np.concatenate([np.arange(split, stop) for _, _, split, stop in coin_folds])
+		y_pred_norm[rows] = coin_predictions
+		fold_of_row[rows] = np.repeat(coin_folds[:, 0], coin_folds[:, 3] - coin_folds[:, 2])
+
+	# Scale the test rows back to absolute prices, in one step:
+	test_rows = np.flatnonzero(fold_of_row >= 0)
+	ref_prices = data[test_rows, n_features + 1]
+	predictions = pd.DataFrame({
+		coin_col: pd.Categorical.from_codes(np.searchsorted(bounds, test_rows, side='right') - 1, categories=coins),
+		date_col: dates[test_rows],
+		'fold': fold_of_row[test_rows],
+		'price_abs': data[test_rows, n_features] * ref_prices,
+		'prediction_abs': y_pred_norm[test_rows] * ref_prices})
+
+	# Training slices of every fold:
+	all_folds = np.concatenate(folds) if folds else np.empty((0, 4), dtype=int)
+	fold_coins = np.repeat(np.arange(len(coins)), [len(coin_folds) for coin_folds in folds])
+	train_info = pd.DataFrame({
+		coin_col: pd.Categorical.from_codes(fold_coins, categories=coins),
+		'fold': all_folds[:, 0],
+		'train_start': dates[all_folds[:, 1]],
+		'train_end': dates[all_folds[:, 2] - 1],
+		'n_train': all_folds[:, 2] - all_folds[:, 1]})
+
+	# Per-fold, per-coin and overall metrics, as grouped reductions over the test rows:
+	errors = predictions.assign(
+		sq_error=(predictions['prediction_abs'] - predictions['price_abs'])**2,
+		abs_error=(predictions['prediction_abs'] - predictions['price_abs']).abs())
+	def summarize(grouped):
+		summary = grouped.agg(
+			test_start=(date_col, 'min'), test_end=(date_col, 'max'), n_test=(date_col, 'size'),
+			RMSE_abs_price=('sq_error', 'mean'), MAE_abs_price=('abs_error', 'mean'))
+		summary['RMSE_abs_price'] = np.sqrt(summary['RMSE_abs_price'])
+		return summary
+
+	per_fold = summarize(errors.groupby([coin_col, 'fold'], observed=True)).reset_index()
+	per_fold = train_info.merge(per_fold, on=[coin_col, 'fold']).sort_values([coin_col, 'fold'])
+	per_coin = summarize(errors.groupby(coin_col, observed=True)).reset_index()
+	overall = summarize(errors.assign(**{coin_col: 'all'}).groupby(coin_col))
+	overall = overall.reset_index() if len(errors) else overall.reset_index().iloc[:0]
+
+	# One table: every coin's folds followed by its summary, then the overall summary:
+	per_fold[coin_col] = per_fold[coin_col].astype(str)
+	per_coin[coin_col] = per_coin[coin_col].astype(str)
+	metrics = pd.concat([
+		per_fold.astype({'fold': object}).assign(is_summary=False),
+		per_coin.assign(fold='all', is_summary=True)], ignore_index=True)
+	metrics = metrics.sort_values([coin_col, 'is_summary'], kind='stable')
+	metrics = pd.concat([metrics, overall.assign(fold='all')], ignore_index=True)
+	metrics['n_train'] = metrics['n_train'].astype('Int64')
+
+	return metrics[[
+		coin_col, 'fold', 'train_start', 'train_end', 'test_start', 'test_end',
+		'n_train', 'n_test', 'RMSE_abs_price', 'MAE_abs_price']], predictions
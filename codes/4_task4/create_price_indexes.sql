@@ -0,0 +1,3 @@
+-- Indexes used by the filtered reads of Task 4 (get_data_from_postgres in helper_functions.py) --
+-- crypto_daily_data is already indexed on (coin_id, date) by its UNIQUE constraint. --
+CREATE INDEX IF NOT EXISTS coin_data_coin_date_idx ON coin_data (coin, date);
@@ -0,0 +1,150 @@
+# evaluation.py
+# Test-set predictions of the ML models and their metrics for all coins at once.
+
+import numpy as np
+import pandas as pd
+
+# ==============
+
+def rescale_predictions(
+	coin_codes,
+	coins,
+	dates,
+	y_norm,
+	y_pred_norm,
+	ref_prices,
+	coin_col='coin_id',
+	date_col='date'
+	):
+	"""
+	Scale the test rows of all coins back to absolute prices in one step.
+	--- Inputs ---
+	{coin_codes} [numpy array]: Index of the coin of every row in {coins}.
+	{coins} [list]: Coins, in sorted order.
+	{dates} [numpy array]: Date of every row.
+	{y_norm} [numpy array]: Target of every row, normalized by the reference price.
+	{y_pred_norm} [numpy array]: Prediction of every row, normalized by the reference price.
+	{ref_prices} [numpy array]: Reference price of every row.
+	{coin_col} [string]: Coin column.
+	{date_col} [string]: Date column.
+
+	--- Returns ---
+	predictions [pandas DataFrame]: Coin (categorical), date, true and predicted absolute prices.
+	"""
+	ref_prices = np.asarray(ref_prices, dtype=float)
+	return pd.DataFrame({
+		coin_col: pd.Categorical.from_codes(coin_codes, categories=coins),
+		date_col: dates,
+		'price_abs': np.asarray(y_norm, dtype=float) * ref_prices,
+		'prediction_abs': np.asarray(y_pred_norm, dtype=float) * ref_prices})
+
+def coin_metrics(
+	predictions,
+	coin_col='coin_id'
+	):
+	"""
+	RMSE, MAE and MAPE (%) on absolute prices of every coin, as grouped sums over all the test rows at
+	once (one `np.bincount` per metric), instead of one metric call per coin.
+	--- Inputs ---
+	{predictions} [pandas DataFrame]: Test rows, with the coin, 'price_abs' and 'prediction_abs' (see
+		`rescale_predictions`).
+	{coin_col} [string]: Coin column.
+
+	--- Returns ---
+	metrics [pandas DataFrame]: coin_id, RMSE_abs_price, MAE_abs_price and MAPE_abs_price of every coin
+		with test rows, in sorted order.
+	"""
+	# Coin index of every row:
+	coins = predictions[coin_col]
+	if isinstance(coins.dtype, pd.CategoricalDtype):
+		codes, names = coins.cat.codes.to_numpy(), coins.cat.categories
+	else:
+		codes, names = pd.factorize(coins, sort=True)
+	n_coins = len(names)
+
+	# Grouped sums of the errors:
+	y_true = predictions['price_abs'].to_numpy(dtype=float)
+	error = predictions['prediction_abs'].to_numpy(dtype=float) - y_true
+	n_rows = np.bincount(codes, minlength=n_coins)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		rmse = np.sqrt(np.bincount(codes, weights=error**2, minlength=n_coins) / n_rows)
+		mae = np.bincount(codes, weights=np.abs(error), minlength=n_coins) / n_rows
+		mape = 100 * np.bincount(codes, weights=np.abs(error / y_true), minlength=n_coins) / n_rows
+
+	keep = n_rows > 0
+	return pd.DataFrame({
+		'coin_id': np.asarray(names, dtype=str)[keep],
+		'RMSE_abs_price': rmse[keep],
+		'MAE_abs_price': mae[keep],
+		'MAPE_abs_price': mape[keep]})
+
+def rmse_abs_price(
+	y_norm,
+	y_pred_norm,
+	ref_prices
+	):
+	"""
+	RMSE on absolute prices of the rows of one coin, without building the predictions table (see
+	`rescale_predictions`).
+	--- Inputs ---
+	{y_norm} [numpy array]: Target of every row, normalized by the reference price.
+	{y_pred_norm} [numpy array]: Prediction of every row, normalized by the reference price.
+	{ref_prices} [numpy array]: Reference price of every row.
+
+	--- Returns ---
+	rmse [float]: RMSE_abs_price of the rows.
+	"""
+	ref_prices = np.asarray(ref_prices, dtype=float)
+	error = (np.asarray(y_pred_norm, dtype=float) - np.asarray(y_norm, dtype=float)) * ref_prices
+	return float(np.sqrt(np.mean(error**2)))
+
+# ==============
+
+def per_coin_test_predictions(
+	df,
+	models,
+	feature_cols,
+	target='price_usd',
+	ref_price='price_usd-1_orig',
+	coin_col='coin_id',
+	date_col='date',
+	train_frac=0.75
+	):
+	"""
+	Predictions of the per-coin models on the test rows of every coin (same chronological split as in
+	training, see `split_train_test`). The rows are sorted once, every model scores a slice of them and
+	the predictions are rescaled together.
+	--- Inputs ---
+	{df} [pandas DataFrame]: Features, target and reference price of every coin and day.
+	{models} [dict]: Fitted models, by coin (coins without a model are skipped).
+	{feature_cols} [list]: Columns used as predictors.
+	{target} [string]: Target column (absolute price).
+	{ref_price} [string]: Reference price to scale the predictions back to absolute prices.
+	{coin_col} [string]: Coin column.
+	{date_col} [string]: Date column.
+	{train_frac} [float]: Fraction of the days of every coin used for training.
+
+	--- Returns ---
+	predictions [pandas DataFrame]: Test rows (see `rescale_predictions`).
+	"""
+	# Sort by coin and date once:
+	coin_codes, coins = pd.factorize(df[coin_col], sort=True)
+	order = np.lexsort((df[date_col].to_numpy(), coin_codes))
+	coin_codes = coin_codes[order]
+	bounds = np.searchsorted(coin_codes, np.arange(len(coins) + 1))
+	X = df[list(feature_cols)].iloc[order]
+
+	# Score the test slice of every coin with its model:
+	y_pred_norm = np.full(len(df), np.nan)
+	for coin, start, stop in zip(coins, bounds[:-1], bounds[1:]):
+		if coin in models:
+			split = start + int((stop - start) * train_frac)
+			y_pred_norm[split:stop] = models[coin].predict(X.iloc[split:stop])
+	test_rows = np.flatnonzero(~np.isnan(y_pred_norm))
+
+	# Normalize the target as in training, then rescale everything together:
+	ref_prices = df[ref_price].to_numpy(dtype=float)[order][test_rows]
+	return rescale_predictions(
+		coin_codes[test_rows], list(coins), df[date_col].to_numpy()[order][test_rows],
+		df[target].to_numpy(dtype=float)[order][test_rows] / ref_prices, y_pred_norm[test_rows],
+		ref_prices, coin_col=coin_col, date_col=date_col)
@@ -0,0 +1,261 @@
+# feature_pipeline.py
+# Declarative feature pipeline for the daily cryptocurrency prices.
+
+import json
+import numpy as np
+import pandas as pd
+
+from helper_functions import (
+	coin_positions, risk_levels, trend_and_variance, lagged_matrix, calendar_flags, HOLIDAY_CALENDARS)
+
+# ==============
+
+class FeaturePipeline:
+	"""
+	Feature transformations of `apply_transformation_to_orig_df`, recorded first and computed in
+	a single pass. `transform` sorts the input once by coin and date, computes every requested
+	feature as a NumPy array and builds the output dataframe once, from the final columns only
+	(no intermediate copies, sorts or merges of the whole frame).
+
+	Example:
+		pipeline = FeaturePipeline().add_risk().add_trend_and_variance().add_lagged_prices()
+		df_full = pipeline.transform(df)
+	"""
+	def __init__(self):
+		self.stages = [] # (name, options), in the order they were added
+
+	def add_risk(
+		self,
+		drop_streak_days=1,
+		risk_period_days=30,
+		map_to_numbers=True,
+		risk_map={'Low': 1, 'Medium': 2, 'High': 3}
+		):
+		"""
+		Add 'risk_level' (see `add_risks_to_df`), mapped to numbers if {map_to_numbers}.
+		"""
+		self.stages.append(('risk', {
+			'drop_streak_days': drop_streak_days, 'risk_period_days': risk_period_days,
+			'risk_map': risk_map if map_to_numbers else None}))
+		return self
+
+	def add_trend_and_variance(
+		self,
+		trend_method='slope',
+		window_back_days=7,
+		fraction_criterion=0.05
+		):
+		"""
+		Add 'variance' and 'trend' (see `add_trend_and_variance_to_df`). With a list of windows,
+		the columns are named 'variance_{N}' and 'trend_{N}'.
+		"""
+		self.stages.append(('trend_var', {
+			'trend_method': trend_method, 'window_back_days': window_back_days,
+			'fraction_criterion': fraction_criterion}))
+		return self
+
+	def add_lagged_prices(
+		self,
+		win=7,
+		normalize=True,
+		target_col='price_usd'
+		):
+		"""
+		Add the lagged prices '{target_col}-1' to '{target_col}-{win}' of every coin (see `add_lagged_features`),
+		normalized by the previous-day price if {normalize} (see `normalize_prices`).
+		"""
+		self.stages.append(('lags', {'win': win, 'normalize': normalize, 'target_col': target_col}))
+		return self
+
+	def add_calendar_features(
+		self,
+		calendars=HOLIDAY_CALENDARS
+		):
+		"""
+		Add 'is_weekend' and 'is_{label}_holiday' for every holiday calendar (see `add_calendar_features`).
+		"""
+		self.stages.append(('calendar', {'calendars': dict(calendars)}))
+		return self
+
+	def transform(
+		self,
+		df,
+		columns=None
+		):
+		"""
+		Compute the recorded features.
+		--- Inputs ---
+		{df} [pandas DataFrame]: Daily prices, with coin_id, date and price_usd columns.
+		{columns} [list]: Output columns (default: None, all). Stages that produce none of them are skipped.
+
+		--- Returns ---
+		df_full [pandas DataFrame]: Selected columns, sorted by coin and date (new index).
+		"""
+		n = len(df)
+
+		# Plan one sort for all the stages:
+		coin_codes = pd.factorize(df['coin_id'], sort=True)[0]
+		order = np.lexsort((df['date'].to_numpy(), coin_codes))
+		positions = coin_positions(coin_codes[order])
+
+		# Plan the stages to run and the output columns:
+		stages = [
+			(name, options) for name, options in self.stages
+			if columns is None or set(self.stage_outputs(name, options)) & set(columns)]
+		output_order = self.plan_columns(df.columns, stages)
+		if columns is not None:
+			output_order = [col for col in output_order if col in columns]
+
+		# Preallocate one block for all the float columns (one contiguous row per column),
+		# other columns are kept apart:
+		float_outputs = {col for name, options in stages for col in self.float_outputs(name, options)}
+		float_cols = [
+			col for col in output_order
+			if col in float_outputs or (col in df.columns and df[col].dtype.kind == 'f')]
+		floats = np.empty((len(float_cols), n))
+		row = {col: i for i, col in enumerate(float_cols)}
+		data = {}
+
+		def buffer(col):
+			# Output row of a float column, or a scratch array if the column is not selected:
+			return floats[row[col]] if col in row else np.empty(n)
+
+		# Gather the input columns in sorted order (dtypes, e.g. categorical coin_id, are kept):
+		for col in df.columns:
+			if col in row:
+				np.take(df[col].to_numpy(dtype=float), order, out=floats[row[col]])
+			elif col in output_order:
+				data[col] = df[col].array.take(order)
+		prices = buffer('price_usd')
+		if 'price_usd' not in row:
+			np.take(df['price_usd'].to_numpy(dtype=float), order, out=prices)
+		dates = df['date'].to_numpy().take(order)
+
+		for name, options in stages:
+			if name == 'risk':
+				risk = risk_levels(
+					positions, dates, prices,
+					drop_streak_days=options['drop_streak_days'], risk_period_days=options['risk_period_days'])
+				if options['risk_map'] is not None:
+					risk = pd.Series(risk).map(options['risk_map']).to_numpy()
+				data['risk_level'] = risk
+
+			elif name == 'trend_var':
+				windows = options['window_back_days']
+				for window in (windows if isinstance(windows, (list, tuple)) else [windows]):
+					suffix = f"_{window}" if isinstance(windows, (list, tuple)) else ""
+					variance, data[f'trend{suffix}'] = trend_and_variance(
+						prices, positions, window_back_days=window, trend_method=options['trend_method'],
+						fraction_criterion=options['fraction_criterion'])
+					buffer(f'variance{suffix}')[:] = variance
+
+			elif name == 'lags':
+				target_col = options['target_col']
+				values = prices if target_col == 'price_usd' else df[target_col].to_numpy(dtype=float)[order]
+				lag_cols = [f'{target_col}-{i}' for i in range(1, options['win'] + 1)]
+				# Write the lags straight into the output block when all of them are selected:
+				if all(col in row for col in lag_cols):
+					lags = lagged_matrix(
+						values, options['win'], positions=positions,
+						out=floats[row[lag_cols[0]]:row[lag_cols[-1]] + 1].T)
+				else:
+					lags = lagged_matrix(values, options['win'], positions=positions)
+				if options['normalize']:
+					buffer(f'{target_col}-1_orig')[:] = lags[:, 0]
+					lags /= lags[:, :1].copy()
+				for i, col in enumerate(lag_cols):
+					if col in row and not np.shares_memory(lags, floats[row[col]]):
+						floats[row[col]] = lags[:, i]
+
+			elif name == 'calendar':
+				data.update(calendar_flags(dates, options['calendars']))
+
+		# Materialize the final projection only: the float block is used as is, and the other
+		# columns are inserted at their positions:
+		df_full = pd.DataFrame(floats.T, columns=float_cols, copy=False)
+		for loc, col in enumerate(output_order):
+			if col not in row:
+				df_full.insert(loc, col, data[col])
+
+		return df_full
+
+	@staticmethod
+	def plan_columns(input_columns, stages):
+		"""
+		Output columns of the stages, in the same order as `apply_transformation_to_orig_df`.
+		"""
+		output_order = list(input_columns)
+		for name, options in stages:
+			if name == 'lags':
+				# The target goes after the other columns, then the lags:
+				output_order.remove(options['target_col'])
+				output_order.append(options['target_col'])
+			output_order.extend(
+				col for col in FeaturePipeline.stage_outputs(name, options) if col not in output_order)
+
+		return output_order
+
+	@staticmethod
+	def float_outputs(name, options):
+		"""
+		Columns of a stage stored as floats.
+		"""
+		if name == 'trend_var':
+			return [col for col in FeaturePipeline.stage_outputs(name, options) if col.startswith('variance')]
+		if name == 'lags':
+			return FeaturePipeline.stage_outputs(name, options)
+		return []
+
+	def params(self):
+		"""
+		JSON description of the recorded stages (used to identify a feature set).
+		"""
+		return json.dumps(self.stages, sort_keys=True, default=str)
+
+	@classmethod
+	def from_params(
+		cls,
+		params
+		):
+		"""
+		Rebuild a pipeline from the JSON description of `params`.
+		"""
+		pipeline = cls()
+		pipeline.stages = [(name, options) for name, options in json.loads(params)]
+		return pipeline
+
+	def lookback_days(self):
+		"""
+		Number of consecutive days, up to a given day, needed to compute the features of that day
+		(risk period and drop streaks, trend windows and lags).
+		"""
+		days = 1
+		for name, options in self.stages:
+			if name == 'risk':
+				days = max(days, options['risk_period_days'] + options['drop_streak_days'] + 2)
+			elif name == 'trend_var':
+				windows = options['window_back_days']
+				days = max(days, *(int(w) + 1 for w in (windows if isinstance(windows, (list, tuple)) else [windows])))
+			elif name == 'lags':
+				days = max(days, options['win'] + 1)
+
+		return days
+
+	@staticmethod
+	def stage_outputs(name, options):
+		"""
+		Columns added by a stage, in output order.
+		"""
+		if name == 'risk':
+			return ['risk_level']
+		if name == 'trend_var':
+			windows = options['window_back_days']
+			if isinstance(windows, (list, tuple)):
+				return [f'{col}_{window}' for window in windows for col in ('variance', 'trend')]
+			return ['variance', 'trend']
+		if name == 'lags':
+			lag_cols = [f"{options['target_col']}-{i}" for i in range(1, options['win'] + 1)]
+			return lag_cols + ([f"{options['target_col']}-1_orig"] if options['normalize'] else [])
+		if name == 'calendar':
+			return ['is_weekend'] + [f'is_{label}_holiday' for label in options['calendars']]
+		raise ValueError(f"Unknown stage: {name}")
@@ -0,0 +1,172 @@
+# feature_store.py
+# Materialized feature sets, reused across runs and extended with the new days only.
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+from online_features import OnlineFeatureEngine
+
+# Parquet support is optional, without it the features are computed every time:
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+
+# ==============
+
+class FeatureStore:
+	"""
+	Feature sets computed by a `FeaturePipeline`, stored as Parquet parts in
+	"<store_dir>/<key>/part-NNNNN.parquet" plus a "meta.json" file.
+
+	The key is a hash of the pipeline stages and their parameters, the input columns, the coins and
+	the first date of the input data, so runs with the same flags share the same feature set.
+	The metadata keeps the data watermark (latest date with features), a fingerprint of the
+	input rows up to it and the per-coin state of an `OnlineFeatureEngine`. When the input data:
+	- has the same rows as the stored feature set, the features are read from disk;
+	- only adds new dates after the watermark, the features of the new rows are computed from the
+	  stored state (see online_features.py) and appended as a new part;
+	- changed in any other way (updated, deleted or backfilled rows), everything is recomputed.
+	--- Inputs ---
+	{store_dir} [string]: Root folder of the feature store.
+	{max_parts} [int]: Number of parts of a feature set above which they are merged into one.
+	"""
+	def __init__(self, store_dir, max_parts=16):
+		self.store_dir = store_dir
+		self.max_parts = max_parts
+
+	@staticmethod
+	def available():
+		"""
+		Check if Parquet files can be written and read (requires pyarrow).
+		"""
+		return pyarrow is not None
+
+	@staticmethod
+	def key(pipeline, df):
+		"""
+		Identifier of the feature set of a pipeline over a dataset.
+		"""
+		identity = json.dumps({
+			'stages': pipeline.params(),
+			'columns': list(df.columns),
+			'coins': sorted(str(coin) for coin in pd.unique(df['coin_id'])),
+			'first_date': str(df['date'].min())
+		}, sort_keys=True)
+		return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+	@staticmethod
+	def fingerprint(df):
+		"""
+		Hash of the input rows, independent of their order.
+		"""
+		df_sorted = df.sort_values(['coin_id', 'date'])
+		row_hashes = pd.util.hash_pandas_object(df_sorted, index=False).to_numpy()
+		return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+	def load_meta(self, folder):
+		"""
+		Read the metadata of a feature set, or None if there is no valid one.
+		"""
+		try:
+			with open(os.path.join(folder, 'meta.json'), 'r') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def save_meta(self, folder, meta):
+		"""
+		Write the metadata atomically: parts not listed in it are ignored.
+		"""
+		tmp_path = os.path.join(folder, 'meta.json.tmp')
+		with open(tmp_path, 'w') as f:
+			json.dump(meta, f, indent=2)
+		os.replace(tmp_path, os.path.join(folder, 'meta.json'))
+
+	def write_part(self, folder, meta, df_features):
+		"""
+		Append features as a new part.
+		"""
+		part = f"part-{meta['next_part']:05d}.parquet"
+		df_features.to_parquet(os.path.join(folder, part), index=False)
+		meta['parts'].append(part)
+		meta['next_part'] += 1
+
+	def read_parts(self, folder, meta, coin_dtype):
+		"""
+		Read all the parts of a feature set, sorted by coin and date.
+		"""
+		df_full = pd.concat(
+			[pd.read_parquet(os.path.join(folder, part)) for part in meta['parts']], ignore_index=True)
+		# Categories may differ between parts:
+		df_full['coin_id'] = df_full['coin_id'].astype(str).astype(coin_dtype)
+		coin_codes = pd.factorize(df_full['coin_id'], sort=True)[0]
+		order = np.lexsort((df_full['date'].to_numpy(), coin_codes))
+		return df_full.take(order).reset_index(drop=True)
+
+	def compact(self, folder, meta, df_full):
+		"""
+		Replace the parts of a feature set by a single one, if there are too many.
+		"""
+		if len(meta['parts']) <= self.max_parts:
+			return
+		old_parts = meta['parts']
+		meta['parts'] = []
+		self.write_part(folder, meta, df_full)
+		self.save_meta(folder, meta)
+		for part in old_parts:
+			os.remove(os.path.join(folder, part))
+
+	def get(
+		self,
+		pipeline,
+		df
+		):
+		"""
+		Get the features of a pipeline over a dataset, from the store when possible.
+		--- Inputs ---
+		{pipeline} [FeaturePipeline]: Pipeline with the recorded stages.
+		{df} [pandas DataFrame]: Daily prices, with coin_id, date and price_usd columns.
+
+		--- Returns ---
+		df_full [pandas DataFrame]: Same result as pipeline.transform(df).
+		"""
+		folder = os.path.join(self.store_dir, self.key(pipeline, df))
+		meta = self.load_meta(folder)
+		watermark = str(df['date'].max())
+
+		if meta is not None:
+			stored_watermark = pd.Timestamp(meta['watermark'])
+			df_old = df[df['date'] <= stored_watermark]
+			if 'state' in meta and len(df_old) == meta['n_rows'] and self.fingerprint(df_old) == meta['fingerprint']:
+				# Same data as the stored features:
+				if watermark == meta['watermark']:
+					return self.read_parts(folder, meta, df['coin_id'].dtype)
+
+				# Only new dates: compute their features from the stored state of every coin:
+				engine = OnlineFeatureEngine.from_dict(pipeline, meta['state'])
+				self.write_part(folder, meta, engine.update(df[df['date'] > stored_watermark]))
+				meta.update({
+					'watermark': watermark, 'n_rows': len(df), 'fingerprint': self.fingerprint(df),
+					'state': engine.to_dict()})
+				self.save_meta(folder, meta)
+				df_full = self.read_parts(folder, meta, df['coin_id'].dtype)
+				self.compact(folder, meta, df_full)
+				return df_full
+
+		# No valid feature set: compute everything from scratch:
+		df_full = pipeline.transform(df)
+		shutil.rmtree(folder, ignore_errors=True)
+		os.makedirs(folder)
+		meta = {'stages': json.loads(pipeline.params()), 'parts': [], 'next_part': 0}
+		self.write_part(folder, meta, df_full)
+		meta.update({
+			'watermark': watermark, 'n_rows': len(df), 'fingerprint': self.fingerprint(df),
+			'state': OnlineFeatureEngine(pipeline).fit(df).to_dict()})
+		self.save_meta(folder, meta)
+
+		return df_full
@@ -1,6 +1,10 @@
 # helper_functions.py
 # Helper functions for cryptocurrency analysis
 
+import os
+import re
+import tempfile
+import functools
 import psycopg2
 import pandas as pd
 import numpy as np
@@ -10,9 +14,12 @@ import matplotlib.pyplot as plt
 import calendar
 import holidays
 from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error
 from sklearn.ensemble import RandomForestRegressor
 
+from price_cache import PriceCache
+from parallel_training import feature_columns, fit_per_coin_models
+from evaluation import coin_metrics, per_coin_test_predictions
+
 # ==============
 
 # Set global plot parameters:
@@ -35,16 +42,65 @@ LINE_COINS = {
 
 # ==============
 
+# Coin and price columns of the supported price tables:
+PRICE_TABLES = {
+	"crypto_daily_data": ('coin_id', 'price_usd'),
+	"coin_data": ('coin', 'price')
+}
+
+# Local Parquet cache of the price tables (see price_cache.py):
+CACHE_DIR = 'cache'
+
+# Materialized feature sets (see feature_store.py):
+FEATURE_STORE_DIR = 'features'
+
+# Saved ML models (see model_registry.py):
+MODEL_REGISTRY_DIR = 'models'
+
+# Holiday calendars of the calendar features, as {label: (kind, code)}: kind is 'country'
+# (holidays.country_holidays) or 'market' (holidays.financial_holidays, e.g. ('market', 'NYSE')).
+# Every calendar adds an 'is_{label}_holiday' column:
+HOLIDAY_CALENDARS = {
+	"US": ('country', 'US'),
+	"China": ('country', 'CN')
+}
+
 def get_data_from_postgres(
 	host='127.0.0.1',
 	port=5432,
 	dbname='postgres',
 	user='postgres',
 	password='',
-	table='crypto_daily_data'
+	table='crypto_daily_data',
+	coins=None,
+	start_date=None,
+	end_date=None,
+	last_n_days=None,
+	extra_cols=None,
+	loader='copy',
+	cache_dir=None
 	):
 	"""
-	XXxx
+	Read daily prices from Postgres. Coin, date filters and extra columns are pushed down into
+	a parameterized SQL query, so only the requested rows and columns are transferred; the
+	filters are served by the (coin_id, date) index of the table (see create_price_indexes.sql).
+	--- Inputs ---
+	{host}, {port}, {dbname}, {user}, {password}: Postgres connection details.
+	{table} [string]: Either 'crypto_daily_data' (default) or 'coin_data'.
+	{coins} [list]: Coins to read (default: None, all coins).
+	{start_date} [string]: First date to read, in 'YYYY-MM-DD' format (default: None, no limit).
+	{end_date} [string]: Last date to read, in 'YYYY-MM-DD' format (default: None, no limit).
+	{last_n_days} [int]: Only read the last N days up to end_date, or up to the latest date of the
+		table if end_date is None (default: None, no limit).
+	{extra_cols} [list]: Additional columns of the table to read, e.g. ['market_cap_usd'] (default: None).
+	{loader} [string]: 'copy' (default) streams the result with COPY ... TO STDOUT (CSV) into a spooled
+		buffer parsed straight into NumPy columns; 'pandas' uses pd.read_sql (row by row, slower).
+	{cache_dir} [string]: If given, read from the local Parquet cache in this folder, which is first
+		refreshed with the rows added to the table since its last refresh (default: None, no cache).
+
+	--- Returns ---
+	df [pandas DataFrame]: Columns coin_id (categorical), date (datetime), price_usd (float64) and the
+		extra columns, sorted by coin and date.
 	"""
 	# Set connection details for information request:
 	db_params = {
@@ -55,32 +111,138 @@ def get_data_from_postgres(
 		"password": password
 	}
 
-	# Set table variables:
-	if table=='crypto_daily_data':
-		coin_var = 'coin_id'
-		price_var = 'price_usd'
-	elif table=='coin_data':
-		coin_var = 'coin'
-		price_var = 'price'
-	else:
+	# Check table:
+	if table not in PRICE_TABLES:
 		print("❌ Choose a valid table: either 'crypto_daily_data' or 'coin_data'.")
 		sys.exit(1)
 
+	# Read through the local cache, if available:
+	if cache_dir and PriceCache.available():
+		cache = PriceCache(cache_dir, table, price_var=PRICE_TABLES[table][1])
+		with psycopg2.connect(**db_params) as conn:
+			cache.refresh(
+				conn,
+				lambda conn, **filters: read_prices(conn, table=table, loader=loader, **filters),
+				extra_cols=extra_cols)
+		return cache.read(
+			coins=coins, start_date=start_date, end_date=end_date,
+			last_n_days=last_n_days, extra_cols=extra_cols)
+	elif cache_dir:
+		print("⚠️ The Parquet cache requires 'pyarrow' (pip install pyarrow), reading from Postgres.")
+
+	# Connect, run query and get dataframe:
+	with psycopg2.connect(**db_params) as conn:
+		df = read_prices(
+			conn, table=table, coins=coins, start_date=start_date, end_date=end_date,
+			last_n_days=last_n_days, extra_cols=extra_cols, loader=loader)
+
+	return df
+
+# ==============
+
+def read_prices(
+	conn,
+	table='crypto_daily_data',
+	coins=None,
+	start_date=None,
+	end_date=None,
+	last_n_days=None,
+	extra_cols=None,
+	loader='copy'
+	):
+	"""
+	Build and run the filtered price query of `get_data_from_postgres` on an open connection.
+	--- Inputs ---
+	{conn} [psycopg2 connection]: Open connection.
+	Other inputs: same as `get_data_from_postgres`.
+
+	--- Returns ---
+	df [pandas DataFrame]: Columns coin_id (categorical), date (datetime), price_usd (float64) and the
+		extra columns, sorted by coin and date.
+	"""
+	# Set table variables:
+	coin_var, price_var = PRICE_TABLES[table]
+
+	# Extra columns are inserted in the query, so only plain column names are accepted:
+	extra_cols = list(extra_cols) if extra_cols else []
+	for col in extra_cols:
+		if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", col):
+			print(f"❌ Invalid column name: {col!r}.")
+			sys.exit(1)
+	select_extra = "".join(f",\n\t\t{col}" for col in extra_cols)
+
+	# Build the filters, with values passed as query parameters:
+	params = {}
+	filters = []
+	if coins:
+		filters.append(f"{coin_var} = ANY(%(coins)s)")
+		params['coins'] = list(coins)
+	if start_date:
+		filters.append("date >= %(start_date)s::date")
+		params['start_date'] = str(start_date)
+	if end_date:
+		filters.append("date <= %(end_date)s::date")
+		params['end_date'] = str(end_date)
+	if last_n_days:
+		filters.append(
+			f"date > COALESCE(%(end_date)s::date, (SELECT MAX(date) FROM {table})) - %(last_n_days)s")
+		params['end_date'] = str(end_date) if end_date else None
+		params['last_n_days'] = int(last_n_days)
+	where = ("WHERE " + "\n\t\tAND ".join(filters)) if filters else ""
+
 	# Define SQL query:
 	SQL_query = f"""
 		SELECT
 		{coin_var} AS coin_id,
 		date,
-		{price_var} AS price_usd
+		{price_var} AS price_usd{select_extra}
 		FROM {table}
+		{where}
+		ORDER BY {coin_var}, date
 		"""
 
-	# Connect, run query and get dataframe:
-	with psycopg2.connect(**db_params) as conn:
-		df = pd.read_sql(SQL_query, conn)
+	# Run query and get dataframe:
+	if loader == 'copy':
+		df = copy_query_to_df(conn, SQL_query, params)
+	elif loader == 'pandas':
+		df = pd.read_sql(SQL_query, conn, params=params or None)
+	else:
+		raise ValueError("loader must be 'copy' or 'pandas'")
 
-	# Convert date from string to datetime:
+	# Convert date from string to datetime, prices from NUMERIC (Decimal) to float64:
 	df['date'] = pd.to_datetime(df['date'])
+	df['price_usd'] = df['price_usd'].astype('float64')
+	df['coin_id'] = df['coin_id'].astype('category')
+
+	return df
+
+# ==============
+
+def copy_query_to_df(
+	conn,
+	SQL_query,
+	params=None,
+	spool_max_size=64 * 1024**2
+	):
+	"""
+	Run a query through COPY ... TO STDOUT in CSV format and parse the result with pd.read_csv.
+	The output is streamed into a spooled buffer (kept in memory up to {spool_max_size} bytes,
+	then moved to a temporary file), so no Python object is built per row.
+	--- Inputs ---
+	{conn} [psycopg2 connection]: Open connection.
+	{SQL_query} [string]: SELECT query, with psycopg2 placeholders.
+	{params} [dict]: Query parameters (default: None).
+	{spool_max_size} [int]: Maximum in-memory size of the buffer, in bytes.
+
+	--- Returns ---
+	df [pandas DataFrame]: Query result, with coin_id as category and price_usd as float64.
+	"""
+	with conn.cursor() as cursor, tempfile.SpooledTemporaryFile(max_size=spool_max_size, mode='w+b') as buffer:
+		# COPY does not accept parameters, so they are bound on the client side:
+		query = cursor.mogrify(SQL_query, params or None).decode()
+		cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", buffer)
+		buffer.seek(0)
+		df = pd.read_csv(buffer, dtype={'coin_id': 'category', 'price_usd': 'float64'})
 
 	return df
 
@@ -159,64 +321,142 @@ def get_month_df(
 
 # ==============
 
+def coin_positions(
+	coin_ids
+	):
+	"""
+	Position of every row within its coin, for a frame sorted by coin and date.
+	--- Inputs ---
+	{coin_ids} [array-like]: Coin of every row, sorted.
+
+	--- Returns ---
+	positions [numpy array]: 0 for the first day of every coin, 1 for the second day, etc.
+	"""
+	codes = pd.factorize(np.asarray(coin_ids))[0]
+	idx = np.arange(len(codes))
+	is_first = np.ones(len(codes), dtype=bool)
+	is_first[1:] = codes[1:] != codes[:-1]
+
+	return idx - np.maximum.accumulate(np.where(is_first, idx, 0))
+
+# ==============
+
+def drop_runs(
+	positions,
+	prices
+	):
+	"""
+	Length of the current streak of daily drops at every row of a frame sorted by coin and date,
+	for drops of 50% or more and for drops between 20% and 50% (see `add_risks_to_df`).
+	--- Inputs ---
+	{positions} [numpy array]: Position of each row within its coin (see `coin_positions`).
+	{prices} [numpy array]: Prices.
+
+	--- Returns ---
+	run50 [numpy array]: Consecutive days with a drop of 50% or more, ending at each row (0 if no drop).
+	run20 [numpy array]: Consecutive days with a drop between 20% and 50%, ending at each row.
+	"""
+	prices = np.asarray(prices, dtype=float)
+	idx = np.arange(len(prices))
+
+	# Get daily percentual change (NaN for the first day of every coin):
+	pct_change = np.full(len(prices), np.nan)
+	pct_change[1:] = (prices[1:] / prices[:-1] - 1) * 100
+	pct_change[positions == 0] = np.nan
+
+	# Check if there was a 50% or more drop, or between 20% and 50% drop:
+	drop50 = (pct_change <= -50)
+	drop20_50 = ((pct_change <= -20) & (pct_change > -50))
+
+	def run_lengths(drops):
+		# Count the cumulative days in drop streaks (the first day of a coin is never a drop,
+		# so streaks never continue across coins). Example:
+		# drops:      T   T   F   T   T   T   F
+		# last F:    -1  -1   2   2   2   2   6      # position of the latest non-drop day
+		# run:        1   2   0   1   2   3   0      # position minus latest non-drop position
+		return idx - np.maximum.accumulate(np.where(drops, -1, idx))
+
+	return run_lengths(drop50), run_lengths(drop20_50)
+
+# ==============
+
+def risk_levels(
+	positions,
+	dates,
+	prices,
+	drop_streak_days=1,
+	risk_period_days=30
+	):
+	"""
+	Risk level of every row of a frame sorted by coin and date (see `add_risks_to_df`).
+	--- Inputs ---
+	{positions} [numpy array]: Position of each row within its coin (see `coin_positions`).
+	{dates} [numpy array]: Dates, sorted within every coin.
+	{prices} [numpy array]: Prices.
+	{drop_streak_days} [int]: Number of consecutive drop days required.
+	{risk_period_days} [int]: Number of days to look back.
+
+	--- Returns ---
+	risk [numpy array]: 'Low', 'Medium' or 'High' for every row.
+	"""
+	dates = np.asarray(dates, dtype='datetime64[ns]')
+	idx = np.arange(len(dates))
+	is_first = positions == 0
+	coin_start = idx - positions
+
+	def had_streak_prior(run):
+		# Check if there is at least a {drop_streak_days}-day streak:
+		cond = run >= drop_streak_days
+		# Latest day that satisfied the condition, up to each row:
+		last_trigger = np.maximum.accumulate(np.where(cond, idx, -1))
+		# A day is flagged if, up to the previous day of the same coin, the latest trigger falls within
+		# the {risk_period_days} days ending on the previous day (same window as rolling('30D') + shift(1)):
+		had = np.zeros(len(run), dtype=bool)
+		prev_trigger = last_trigger[:-1]
+		in_coin = ~is_first[1:] & (prev_trigger >= coin_start[1:])
+		cutoff = dates[:-1] - np.timedelta64(risk_period_days, 'D')
+		had[1:] = in_coin & (dates[np.maximum(prev_trigger, 0)] > cutoff)
+		return had
+
+	run50, run20 = drop_runs(positions, prices)
+	had50_prior = had_streak_prior(run50)
+	had20_prior = had_streak_prior(run20)
+
+	# Assign precedence High > Medium > Low
+	return np.where(had50_prior, 'High', np.where(had20_prior, 'Medium', 'Low')).astype(object)
+
+# ==============
+
 def add_risks_to_df(
 	dfm,
 	drop_streak_days=1,
 	risk_period_days=30
 	):
 	"""
-	Xxx
+	Assign a risk level to every coin and day, according to the price drops of the previous
+	{risk_period_days} days (the current day excluded):
+	- 'High' if there was a streak of {drop_streak_days} consecutive daily drops of 50% or more.
+	- 'Medium' if there was such a streak of drops between 20% and 50%.
+	- 'Low' otherwise.
+	All coins are labelled in one vectorized pass over the frame sorted by coin and date.
+	--- Inputs ---
+	{dfm} [pandas DataFrame]: Daily prices, with coin_id, date and price_usd columns.
+	{drop_streak_days} [int]: Number of consecutive drop days required.
+	{risk_period_days} [int]: Number of days to look back.
+
+	--- Returns ---
+	df_risk [pandas DataFrame]: Input dataframe sorted by coin and date (new index), with a
+		risk_level column.
 	"""
 	# Copy input dataframe and sort values:
-	dfm = dfm.sort_values(['coin_id', 'date'])
-
-	# Evaluate risks for each coin separately:
-	coin_risk = [] # Initiate
-	for coin, df_coin in dfm.groupby('coin_id',sort=False):
-		# Copy dataframe and set date as index:
-		df_coin = df_coin.copy().set_index('date')
-		# Get daily percentual change:
-		df_coin['pct_change'] = df_coin['price_usd'].pct_change() * 100
-
-		# Check if there was a 50% or more drop for consecutive days:
-		drop50 = (df_coin['pct_change'] <= -50)
-		# Check if there was between 20% and 50% drop for consecutive days:
-		drop20_50 = ((df_coin['pct_change'] <= -20) & (df_coin['pct_change'] > -50))
-
-		# Count the cumulative days in drop streaks, below is an example of how it works:
-		run50 = drop50.groupby((~drop50).cumsum()).cumsum()
-		run20 = drop20_50.groupby((~drop20_50).cumsum()).cumsum()
-		# Example for run50:
-		# drop50:  T   T   F   T   T   T   F
-		# groups:  0   0   1   1   1   1   2      # (~drop50).cumsum()
-		# run50:   1   2   0   1   2   3   0      # cumsum within each group
-
-		# Check if there is at least a {drop_streak_days}-day in the series:
-		cond50 = run50.ge(drop_streak_days)
-		cond20 = run20.ge(drop_streak_days)
-
-		# Use a time-based rolling window over the previous {risk_period_days}:
-		# rolling(...).max() is True if ANY day in the window satisfied cond50 / cond20.
-		# shift(1) excludes "today" from the window.
-		had50_prior = cond50.rolling(f'{risk_period_days}D').max().shift(1).fillna(False).astype(bool)
-		had20_prior = cond20.rolling(f'{risk_period_days}D').max().shift(1).fillna(False).astype(bool)
-
-		# Assign precedence High > Medium > Low
-		risk = pd.Series('Low', index=df_coin.index) # All are Low by default
-		risk = risk.mask(had20_prior, 'Medium') # Updated to Medium if conditions are met
-		risk = risk.mask(had50_prior, 'High') # Updated to High if conditions are met
-
-		# Save the risks for this coin
-		coin_risk.append(
-			df_coin.assign(risk_level=risk.values) # Assign risk values
-			.reset_index()[['coin_id', 'date', 'risk_level']] # Restore the indexes
-		)
+	df_risk = dfm.sort_values(['coin_id', 'date']).reset_index(drop=True)
 
-	# Combine per-coin risks and merge back to original dataframe:
-	risk_all_coins = pd.concat(coin_risk, ignore_index=True)
-	df_risk = dfm.merge(risk_all_coins, on=['coin_id', 'date'], how='left')
+	# Label all coins:
+	df_risk['risk_level'] = risk_levels(
+		coin_positions(df_risk['coin_id']), df_risk['date'].to_numpy(), df_risk['price_usd'].to_numpy(),
+		drop_streak_days=drop_streak_days, risk_period_days=risk_period_days)
 
-	return pd.DataFrame(df_risk)
+	return df_risk
 
 # ==============
 
@@ -232,67 +472,146 @@ def slope_lin(a):
 
 # ==============
 
-def add_trend_and_variance_to_df(
-    df,
-    trend_method="slope", 
-    window_back_days=7,
-    fraction_criterion=0.05
+def rolling_slope_and_variance(
+	prices,
+	positions,
+	win
 	):
 	"""
-	Xxxx
+	Rolling OLS slope and variance of all coins at once, for windows of {win} rows ending at each row.
+	The frame must be sorted by coin and date; windows that would cross into the previous coin are
+	left as NaN. The slope of y over x = 0..win-1 is the weighted sum of the window values with the
+	closed-form weights (x - mean(x)) / sum((x - mean(x))^2), so no least-squares solve is needed.
+	Sums run over the window offset k, each step vectorized over all rows.
+	--- Inputs ---
+	{prices} [numpy array]: Prices, sorted by coin and date.
+	{positions} [numpy array]: Position of each row within its coin (0 for the first day of a coin).
+	{win} [int]: Window length, in rows (including the current day).
+
+	--- Returns ---
+	slope [numpy array]: Slope in price units per day (NaN where the window is incomplete).
+	variance [numpy array]: Sample variance of the prices in the window (NaN where incomplete).
 	"""
+	n = len(prices)
+	slope = np.full(n, np.nan)
+	variance = np.full(n, np.nan)
+	if n < win:
+		return slope, variance
+
+	# Closed-form OLS weights for x = 0, 1, ..., win-1:
+	x_centered = np.arange(win, dtype=float) - (win - 1) / 2
+	weights = x_centered / np.sum(x_centered**2)
+
+	# Accumulate over the window offsets (row i of the sums is the window ending at row i+win-1):
+	m = n - win + 1
+	weighted_sum = np.zeros(m)
+	total = np.zeros(m)
+	for k in range(win):
+		y_k = prices[k:k + m]
+		weighted_sum += weights[k] * y_k
+		total += y_k
+	mean = total / win
+	squares = np.zeros(m)
+	for k in range(win):
+		squares += (prices[k:k + m] - mean)**2
+
+	# Keep only windows fully inside one coin:
+	valid = positions[win - 1:] >= win - 1
+	slope[win - 1:] = np.where(valid, weighted_sum, np.nan)
+	variance[win - 1:] = np.where(valid, squares / (win - 1), np.nan)
+
+	return slope, variance
 
-	# Copy original dataframe:
-	df_trend = df.copy()
+# ==============
 
-	# Make sure dates are sorted in ascending order:
-	df_trend = df_trend.sort_values(["coin_id", "date"])
+def trend_and_variance(
+	prices,
+	positions,
+	window_back_days=7,
+	trend_method="slope",
+	fraction_criterion=0.05
+	):
+	"""
+	Variance and general trend of every row of a frame sorted by coin and date, for one window
+	(see `add_trend_and_variance_to_df`).
+	--- Inputs ---
+	{prices} [numpy array]: Prices, sorted by coin and date.
+	{positions} [numpy array]: Position of each row within its coin (see `coin_positions`).
+	Other inputs: same as `add_trend_and_variance_to_df`, for a single window.
+
+	--- Returns ---
+	variance [numpy array]: Variance of the prices in the window.
+	trend [numpy array]: 'Rising', 'Flat', 'Dropping' or None (incomplete window).
+	"""
+	prices = np.asarray(prices, dtype=float)
 
 	# Window length, including the current day:
-	win = int(window_back_days) + 1
+	window = int(window_back_days)
+	win = window + 1
 
-	# Calculate variance for each coin:
-	df_trend["variance"] = (
-		df_trend.groupby("coin_id")["price_usd"].transform(
-			lambda s: s.rolling(win, min_periods=win).var())
-	)
+	# Calculate slope and variance for all coins:
+	slope, variance = rolling_slope_and_variance(prices, positions, win)
 
 	# Analyze the general trend, according to the input criterion:
 	if trend_method == "compare_extremes":
 		# Compare the price at current day p0 vs price 7 days before (p-7) using a relative threshold:
-		base = df_trend.groupby("coin_id")["price_usd"].shift(window_back_days) # p-7
-		rel_diff = (df_trend["price_usd"] - base) / base  # Relative difference over the window
-		# Assign trend category:
-		df_trend["trend"] = np.select(
-			[rel_diff >  fraction_criterion,
-			np.abs(rel_diff) <= fraction_criterion,
-			rel_diff < -fraction_criterion],
-			["Rising", "Flat","Dropping"],
-			default=None # This gives the Flat category to NaN values
-		)
-
+		base = np.full(len(prices), np.nan) # p-7
+		if window < len(prices):
+			base[window:] = np.where(positions[window:] >= window, prices[:len(prices) - window], np.nan)
+		rel_diff = (prices - base) / base  # Relative difference over the window
 	elif trend_method == "slope":
 		# Analyze the slope of the present and last 7 days using linear regression,
-		# ... and assign trend category using the tolerance fraction:
-
-		# Calculate the slope for rolling windows:
-		slope_series = (
-			df_trend.groupby("coin_id")["price_usd"].transform(
-				lambda s: s.rolling(win, min_periods=win).apply(slope_lin, raw=True))
-		)
-		# Determine relative change compared to current price:
-		rel_change = slope_series*win / df_trend["price_usd"]
-		# Assign trend category:
-		df_trend["trend"] = np.select(
-			[rel_change >  fraction_criterion,
-			np.abs(rel_change) <= fraction_criterion,
-			rel_change < -fraction_criterion],
-			["Rising", "Flat", "Dropping"],
-			default=None
-		)
+		# ... and determine relative change compared to current price:
+		rel_diff = slope*win / prices
 	else:
 		raise ValueError("trend_method must be 'slope' or 'compare_extremes'")
 
+	# Assign trend category:
+	trend = np.select(
+		[rel_diff >  fraction_criterion,
+		np.abs(rel_diff) <= fraction_criterion,
+		rel_diff < -fraction_criterion],
+		["Rising", "Flat", "Dropping"],
+		default=None # Incomplete windows (NaN) get no category
+	)
+
+	return variance, trend
+
+# ==============
+
+def add_trend_and_variance_to_df(
+    df,
+    trend_method="slope", 
+    window_back_days=7,
+    fraction_criterion=0.05
+	):
+	"""
+	Add the variance and the general trend ('Rising', 'Flat' or 'Dropping') of the price over the
+	current day and the previous {window_back_days} days, for every coin.
+	--- Inputs ---
+	{df} [pandas DataFrame]: Daily prices, with coin_id, date and price_usd columns.
+	{trend_method} [string]: 'slope' (linear regression over the window) or 'compare_extremes'
+		(current price vs. the price {window_back_days} days before).
+	{window_back_days} [int | list]: Days to look back. With a list, all windows are computed in one
+		pass and the columns are named 'variance_{N}' and 'trend_{N}' for each N.
+	{fraction_criterion} [float]: Tolerance for the trend, as a fraction of the current price.
+
+	--- Returns ---
+	df_trend [pandas DataFrame]: Input dataframe sorted by coin and date, with the new columns.
+	"""
+	# Make sure dates are sorted in ascending order (this also copies the original dataframe):
+	df_trend = df.sort_values(["coin_id", "date"])
+	prices = df_trend["price_usd"].to_numpy(dtype=float)
+	positions = coin_positions(df_trend["coin_id"])
+
+	# One or several windows:
+	windows = window_back_days if isinstance(window_back_days, (list, tuple)) else [window_back_days]
+	for window in windows:
+		suffix = f"_{window}" if isinstance(window_back_days, (list, tuple)) else ""
+		df_trend[f"variance{suffix}"], df_trend[f"trend{suffix}"] = trend_and_variance(
+			prices, positions, window_back_days=window, trend_method=trend_method,
+			fraction_criterion=fraction_criterion)
+
 	return df_trend
 
 # ==============
@@ -341,49 +660,167 @@ def plot_trend(
 
 # ==============
 
+def lagged_matrix(
+	values,
+	win=7,
+	positions=None,
+	out=None
+	):
+	"""
+	Lagged values as a single 2-D block: column i-1 holds the value of i rows before, within the
+	same coin. The values must be sorted by coin and date.
+	--- Inputs ---
+	{values} [numpy array]: Values, sorted by coin and date.
+	{win} [int]: Number of lags.
+	{positions} [numpy array]: Position of each row within its coin (see `coin_positions`). If None,
+		all rows are treated as one series.
+	{out} [numpy array]: Array of shape (len(values), win) to write into (default: None, new array).
+
+	--- Returns ---
+	lags [numpy array]: Array of shape (len(values), win), NaN where the coin has no previous row.
+	"""
+	values = np.asarray(values, dtype=float)
+	lags = np.empty((len(values), win)) if out is None else out
+	lags[:] = np.nan
+	for i in range(1, win + 1):
+		if positions is None:
+			lags[i:, i - 1] = values[:-i]
+		else:
+			# Rows less than i days into their coin would get the previous coin's values:
+			lags[i:, i - 1] = np.where(positions[i:] >= i, values[:-i], np.nan)
+
+	return lags
+
+# ==============
+
 def add_lagged_features(
     df, 
     target_col='price_usd',
     win=7
     ):
 	"""
-	Xxxx
-	"""
-	# Add lagged features:
-	df_lagged = df.copy()
-	for i in range(1, win + 1):
-		df_lagged[f"{target_col}-{i}"] = df_lagged[target_col].shift(i)
+	Add the values of the previous {win} days of {target_col} for every coin, as columns
+	'{target_col}-1' to '{target_col}-{win}'. The lags are taken within each coin, ordered by date,
+	whatever the order of the rows in df (which is kept).
+	--- Inputs ---
+	{df} [pandas DataFrame]: Input dataframe, with coin_id and date columns.
+	{target_col} [string | list]: Column(s) to lag.
+	{win} [int]: Number of lags.
 
-	# Reorder columns: everything except target, then target, then lags
-	lag_cols = [f"{target_col}-{i}" for i in range(1, win + 1)]
-	other_cols = [c for c in df.columns if c != target_col]
-	df_lagged = df_lagged[other_cols + [target_col] + lag_cols]
+	--- Returns ---
+	df_lagged [pandas DataFrame]: Columns of df except the targets, then the targets, then the lags
+		of every target.
+	"""
+	target_cols = [target_col] if isinstance(target_col, str) else list(target_col)
+
+	# Sort once by coin and date:
+	coin_codes = pd.factorize(df['coin_id'], sort=True)[0]
+	order = np.lexsort((df['date'].to_numpy(), coin_codes))
+	positions = coin_positions(coin_codes[order])
+
+	# Build the lags of all the targets in one block, in sorted order:
+	lags_sorted = np.empty((len(df), win * len(target_cols)))
+	for j, col in enumerate(target_cols):
+		lagged_matrix(
+			df[col].to_numpy(dtype=float)[order], win, positions=positions,
+			out=lags_sorted[:, j * win:(j + 1) * win])
+	# Back to the order of the rows of df:
+	lags = np.empty_like(lags_sorted)
+	lags[order] = lags_sorted
+	lag_cols = [f"{col}-{i}" for col in target_cols for i in range(1, win + 1)]
+
+	# Reorder columns: everything except targets, then targets, then lags
+	other_cols = [c for c in df.columns if c not in target_cols]
+	df_lagged = pd.concat(
+		[df[other_cols + target_cols], pd.DataFrame(lags, columns=lag_cols, index=df.index)], axis=1)
 
 	return df_lagged
 
 # ==============
 
-def add_calendar_features(
-	df
+@functools.lru_cache(maxsize=None)
+def holiday_days(
+	kind,
+	code,
+	first_year,
+	last_year
 	):
 	"""
-	XXxxx
+	Holidays of one calendar between two years, built once per process (memoized).
+	--- Inputs ---
+	{kind} [string]: 'country' or 'market'.
+	{code} [string]: Country code (e.g. 'US') or market code (e.g. 'NYSE') of the holidays package.
+	{first_year} [int]: First year.
+	{last_year} [int]: Last year (included).
+
+	--- Returns ---
+	days [numpy array]: Sorted, unique holidays as datetime64[D] (read-only).
+
+	--- Raises ---
+	ValueError: If the kind of calendar is not valid.
 	"""
-	# Make dataset copy:
-	df_calendar = df.copy()
+	years = range(first_year, last_year + 1)
+	if kind == 'country':
+		calendar_days = holidays.country_holidays(code, years=years)
+	elif kind == 'market':
+		calendar_days = holidays.financial_holidays(code, years=years)
+	else:
+		raise ValueError("Holiday calendar kind must be 'country' or 'market'")
+
+	days = np.unique(np.array(list(calendar_days), dtype='datetime64[D]'))
+	days.setflags(write=False)
+	return days
 
-	# Add weekend flag (Saturday=5, Sunday=6):
-	df_calendar['is_weekend'] = df_calendar['date'].dt.weekday.isin([5, 6]).astype(int)
+def calendar_flags(
+	dates,
+	calendars=HOLIDAY_CALENDARS
+	):
+	"""
+	Weekend and holiday flags of a series of dates (see `add_calendar_features`). Every date is
+	looked up in the sorted holiday arrays of `holiday_days` with a binary search.
+	--- Inputs ---
+	{dates} [pandas Series]: Dates (datetime).
+	{calendars} [dict]: Holiday calendars, as {label: (kind, code)} (see HOLIDAY_CALENDARS).
+
+	--- Returns ---
+	flags [dict]: Integer arrays 'is_weekend' and 'is_{label}_holiday' for every calendar.
+	"""
+	days = pd.Series(dates).to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+	valid = ~np.isnat(days)
+
+	# Weekend flag (Saturday=5, Sunday=6; 1970-01-01 was a Thursday=3):
+	weekday = (days.view('int64') + 3) % 7
+	flags = {'is_weekend': (valid & (weekday >= 5)).astype(int)}
+	if not valid.any():
+		flags.update({f'is_{label}_holiday': np.zeros(len(days), dtype=int) for label in calendars})
+		return flags
+
+	# Holiday flags, for the years covered by the dates:
+	years = days[valid].astype('datetime64[Y]').astype(int) + 1970
+	for label, (kind, code) in calendars.items():
+		holiday_array = holiday_days(kind, code, int(years.min()), int(years.max()))
+		pos = np.searchsorted(holiday_array, days)
+		found = holiday_array[np.minimum(pos, len(holiday_array) - 1)] == days if len(holiday_array) else False
+		flags[f'is_{label}_holiday'] = (valid & (pos < len(holiday_array)) & found).astype(int)
+
+	return flags
 
-	# Prepare holiday calendars:
-	us_holidays = holidays.UnitedStates(years=df_calendar['date'].dt.year.unique())
-	cn_holidays = holidays.China(years=df_calendar['date'].dt.year.unique())
+# ==============
 
-	# Add holiday flags:
-	df_calendar['is_US_holiday'] = df_calendar['date'].dt.date.isin(us_holidays).astype(int)
-	df_calendar['is_China_holiday'] = df_calendar['date'].dt.date.isin(cn_holidays).astype(int)
+def add_calendar_features(
+	df,
+	calendars=HOLIDAY_CALENDARS
+	):
+	"""
+	Add weekend and holiday flags (by default, US and China) for every day.
+	--- Inputs ---
+	{df} [pandas DataFrame]: Input dataframe, with a date column.
+	{calendars} [dict]: Holiday calendars, as {label: (kind, code)} (see HOLIDAY_CALENDARS).
 
-	return df_calendar
+	--- Returns ---
+	df_calendar [pandas DataFrame]: Input dataframe with is_weekend and is_{label}_holiday for every calendar.
+	"""
+	return df.assign(**calendar_flags(df['date'], calendars))
 
 # ==============
 
@@ -393,14 +830,13 @@ def map_risks_to_numbers(
 	risk_map={'Low': 1, 'Medium': 2, 'High': 3}
 	):
 	"""
-	XXxx
+	Replace the risk levels by numbers, according to {risk_map} (if not done yet).
 	"""
-	df_mapped = df.copy()
 	# Map risk levels to numbers (if not done yet):
 	if df[risk_col].dtype == object:
-	    df_mapped[risk_col] = df_mapped[risk_col].map(risk_map)
+		return df.assign(**{risk_col: df[risk_col].map(risk_map)})
 
-	return df_mapped
+	return df.copy()
 
 # ==============
 
@@ -410,21 +846,26 @@ def normalize_prices(
 	col_price_root='price_usd'
 	):
 	"""
-	XXxx
-	"""
-	df_norm_prices = df.copy()
-	# Keep the original yesterday price:
-	df_norm_prices[f'{col_price_root}-1_orig'] = df[f'{col_price_root}-1']
-	# Normalize the price features:
-	for lag in range(1, lag_window+1):
-		df_norm_prices[f'{col_price_root}-{lag}'] = df[f'{col_price_root}-{lag}'] / df[f'{col_price_root}-1']
+	Divide the lagged prices by the price of the previous day, keeping the original previous-day
+	price in '{col_price_root}-1_orig'.
+	--- Inputs ---
+	{df} [pandas DataFrame]: Input dataframe, with lagged prices (see `add_lagged_features`).
+	{lag_window} [int]: Number of lags.
+	{col_price_root} [string]: Name of the lagged column.
 
-	return df_norm_prices
+	--- Returns ---
+	df_norm_prices [pandas DataFrame]: Input dataframe with normalized lags.
+	"""
+	lag_cols = [f'{col_price_root}-{lag}' for lag in range(1, lag_window+1)]
+	lags = df[lag_cols].to_numpy(dtype=float)
+	# Normalize the price features, keeping the original yesterday price:
+	return df.assign(
+		**dict(zip(lag_cols, (lags / lags[:, :1]).T)),
+		**{f'{col_price_root}-1_orig': lags[:, 0]})
 
 # ==============
 
-def apply_transformation_to_orig_df(
-	df,
+def build_feature_pipeline(
 	apply_risk=True,
 	risk_streak_days=1,
 	risk_period_days=30,
@@ -435,37 +876,87 @@ def apply_transformation_to_orig_df(
 	apply_lagged_prices=True,
 	apply_calendar_features=True,
 	apply_riks_mapping=True,
-	apply_price_normalization=True
+	apply_price_normalization=True,
+	holiday_calendars=HOLIDAY_CALENDARS
 	):
 	"""
-	XXxx
+	Record the selected feature transformations in a `FeaturePipeline` (see feature_pipeline.py).
+	Same options as `apply_transformation_to_orig_df`.
+
+	--- Returns ---
+	pipeline [FeaturePipeline]: Pipeline with the selected stages.
 	"""
-	df_full = df.copy()
+	# Imported here, since feature_pipeline builds on the functions of this module:
+	from feature_pipeline import FeaturePipeline
 
-	# Apply risk assignment:
+	# Record the requested stages:
+	pipeline = FeaturePipeline()
 	if apply_risk:
-		df_full = add_risks_to_df(df_full,drop_streak_days=risk_streak_days,risk_period_days=risk_period_days)
-		# Apply risk transformation from string to integers:
-		if apply_riks_mapping:
-			df_full = map_risks_to_numbers(df_full)
-
-	# Apply trend and variance assignment:
+		pipeline.add_risk(
+			drop_streak_days=risk_streak_days,risk_period_days=risk_period_days,map_to_numbers=apply_riks_mapping)
 	if apply_trend_var:
-		df_full = add_trend_and_variance_to_df(
-			df_full,trend_method=trend_method,window_back_days=trend_var_window,fraction_criterion=trend_frac)
-
-	# Apply lagged prices:
+		pipeline.add_trend_and_variance(
+			trend_method=trend_method,window_back_days=trend_var_window,fraction_criterion=trend_frac)
 	if apply_lagged_prices:
-		df_full = add_lagged_features(df_full,win=7)
-		# Apply price normalization:
-		if apply_price_normalization:
-			df_full = normalize_prices(df_full,7)
-
-	# Apply calendar features:
+		pipeline.add_lagged_prices(win=7,normalize=apply_price_normalization)
 	if apply_calendar_features:
-		df_full = add_calendar_features(df_full)
+		pipeline.add_calendar_features(calendars=holiday_calendars)
+
+	return pipeline
+
+# ==============
 
-	return df_full
+def apply_transformation_to_orig_df(
+	df,
+	apply_risk=True,
+	risk_streak_days=1,
+	risk_period_days=30,
+	apply_trend_var=True,
+	trend_method='slope',
+	trend_var_window=7,
+	trend_frac=0.05,
+	apply_lagged_prices=True,
+	apply_calendar_features=True,
+	apply_riks_mapping=True,
+	apply_price_normalization=True,
+	holiday_calendars=HOLIDAY_CALENDARS,
+	store_dir=None
+	):
+	"""
+	Apply the selected feature transformations to the daily prices, through a `FeaturePipeline`
+	(see feature_pipeline.py): the frame is sorted once and the output is built in one step.
+	If {store_dir} is given, the features are read from the feature store in that folder when they
+	were already computed with the same options, and only the new dates are computed
+	(see feature_store.py).
+
+	--- Returns ---
+	df_full [pandas DataFrame]: Daily prices with the features, sorted by coin and date.
+	"""
+	# Imported here, since feature_store builds on the functions of this module:
+	from feature_store import FeatureStore
+
+	pipeline = build_feature_pipeline(
+		apply_risk=apply_risk,
+		risk_streak_days=risk_streak_days,
+		risk_period_days=risk_period_days,
+		apply_trend_var=apply_trend_var,
+		trend_method=trend_method,
+		trend_var_window=trend_var_window,
+		trend_frac=trend_frac,
+		apply_lagged_prices=apply_lagged_prices,
+		apply_calendar_features=apply_calendar_features,
+		apply_riks_mapping=apply_riks_mapping,
+		apply_price_normalization=apply_price_normalization,
+		holiday_calendars=holiday_calendars
+		)
+
+	# Reuse the stored features, if available:
+	if store_dir and FeatureStore.available():
+		return FeatureStore(store_dir).get(pipeline, df)
+	elif store_dir:
+		print("⚠️ The feature store requires 'pyarrow' (pip install pyarrow), computing all features.")
+
+	return pipeline.transform(df)
 
 # ==============
 
@@ -529,48 +1020,29 @@ def train_per_coin_models_LinearRegression(
     coin_col='coin_id',
     date_col='date',
     drop_cols = ['coin_id', 'date', 'risk_level', 'trend'],
-    train_frac=0.75
+    train_frac=0.75,
+    max_workers=None,
+    return_predictions=False
     ):
     """
     Train a Linear Regression model per coin to predict T0 price based on past 7 days
-    and other available features.
+    and other available features. The coins are trained in parallel, across {max_workers}
+    processes (default: None, all cores; see parallel_training.py). The test predictions
+    of all coins are evaluated at once (see evaluation.py), and are also returned if
+    {return_predictions} is True (e.g. for `plot_predictions`).
     """
-    # Initialize model and results
-    models = {}
-    results = []
-
-    # Features to drop (not used for training)
-    drop_cols = check_drop_cols(drop_cols,[ref_price, target])
+    # Features to drop (not used for training), with their per-window variants:
+    feature_cols = feature_columns(df, drop_cols, [ref_price, target])
     
-    # Train and evaluate a ML model for each coin:
-    for coin, df_coin in df.groupby(coin_col):
-        df_coin = df_coin.sort_values(date_col).reset_index(drop=True)
-        
-        # Split chronological:
-        train_df, test_df = split_train_test(df_coin,train_frac=train_frac)
-        
-        # Define predictors (X) and targets (y) for train/test:
-        X_train, y_train, X_test, y_test = prepare_inputs_ML(train_df,test_df,drop_cols,target)
-       
-        # Fit model
-        model = LinearRegression()
-        model.fit(X_train, y_train)
-        models[coin] = model
-        
-        # Predict (normalized)
-        y_pred_norm = model.predict(X_test)
-        
-        # Scale back to absolute prices
-        y_pred_abs = y_pred_norm * test_df[ref_price].values
-        y_test_abs = y_test * test_df[ref_price].values
-        
-        # Compute RMSE on absolute prices
-        rmse = mean_squared_error(y_test_abs, y_pred_abs, squared=False)
-        
-        # Compute results
-        results.append({'coin_id': coin, 'RMSE_abs_price': rmse})
+    # Train a ML model for each coin and keep its test predictions:
+    models, predictions = fit_per_coin_models(
+        df, LinearRegression(), feature_cols, target=target, ref_price=ref_price, coin_col=coin_col,
+        date_col=date_col, train_frac=train_frac, max_workers=max_workers)
     
-    results_df = pd.DataFrame(results)
+    # Metrics of all coins at once:
+    results_df = coin_metrics(predictions, coin_col=coin_col)
+    if return_predictions:
+        return models, results_df, predictions
     return models, results_df
 
 # ==============
@@ -587,54 +1059,44 @@ def train_per_coin_rf_models(
     max_depth=10,
     min_samples_leaf=1,
     random_state=17,
-    n_jobs=-1
+    n_jobs=-1,
+    max_workers=None,
+    return_predictions=False
     ):
     """
     Train a Random Forest Regressor model per coin to predict T0 price based on past 7 days
-    and other available features.
+    and other available features. The coins are trained in parallel, across {max_workers}
+    processes (default: None, all cores; see parallel_training.py), and every forest uses
+    {n_jobs} threads (default: -1, the cores left for each process). The test predictions
+    of all coins are evaluated at once (see evaluation.py), and are also returned if
+    {return_predictions} is True (e.g. for `plot_predictions`).
     """
-    # Initialize model and results
-    models = {}
-    results = []
+    # Features to drop (not used for training), with their per-window variants:
+    feature_cols = feature_columns(df, drop_cols, [ref_price, target])
 
-    # Features to drop (not used for training)
-    drop_cols = check_drop_cols(drop_cols,[ref_price, target])
+    # Split the cores between the processes, instead of one full-size thread pool per process:
+    n_cores = os.cpu_count() or 1
+    threads_per_worker = n_jobs if n_jobs > 0 else max(1, n_cores // (max_workers or n_cores))
     
-    # Train and evaluate a ML model for each coin:
-    for coin, df_coin in df.groupby(coin_col):
-        df_coin = df_coin.sort_values(date_col).reset_index(drop=True)
-        
-        # Split chronological:
-        train_df, test_df = split_train_test(df_coin,train_frac=train_frac)
-        
-        # Define predictors (X) and targets (y) for train/test:
-        X_train, y_train, X_test, y_test = prepare_inputs_ML(train_df,test_df,drop_cols,target)
-       
-        # Fit model
-        rf = RandomForestRegressor(
-            n_estimators=n_estimators,
-            max_depth=max_depth,
-            min_samples_leaf=min_samples_leaf,
-            random_state=random_state,
-            n_jobs=n_jobs
-        )
-        rf.fit(X_train, y_train)
-        models[coin] = rf
-        
-        # Predict (normalized)
-        y_pred_norm = rf.predict(X_test)
-        
-        # Scale back to absolute prices
-        y_pred_abs = y_pred_norm * test_df[ref_price].values
-        y_test_abs = y_test * test_df[ref_price].values
-        
-        # Compute RMSE on absolute prices
-        rmse = mean_squared_error(y_test_abs, y_pred_abs, squared=False)
-        
-        # Compute results
-        results.append({'coin_id': coin, 'RMSE_abs_price': rmse})
+    # Define model:
+    rf = RandomForestRegressor(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        min_samples_leaf=min_samples_leaf,
+        random_state=random_state,
+        n_jobs=n_jobs
+    )
+
+    # Train a ML model for each coin and keep its test predictions:
+    models, predictions = fit_per_coin_models(
+        df, rf, feature_cols, target=target, ref_price=ref_price, coin_col=coin_col,
+        date_col=date_col, train_frac=train_frac, max_workers=max_workers,
+        threads_per_worker=threads_per_worker)
     
-    results_df = pd.DataFrame(results)
+    # Metrics of all coins at once:
+    results_df = coin_metrics(predictions, coin_col=coin_col)
+    if return_predictions:
+        return models, results_df, predictions
     return models, results_df
 
 # ==============
@@ -649,46 +1111,42 @@ def plot_predictions(
     drop_cols = ['coin_id', 'date', 'risk_level', 'trend'],
     coin_to_plot=None,
     train_frac=0.75,
-    save_image=False
+    save_image=False,
+    predictions=None
 	):
     """
     Plot predictions vs ground truth for the test set of each coin (or a specific one).
+    The test predictions returned by `train_per_coin_*` (return_predictions=True) are
+    reused if given in {predictions}; otherwise they are computed once for all coins.
     """
     
-    # Features to drop:
-    drop_cols = check_drop_cols(drop_cols,[ref_price, target])
-    
     # Check coins to be analyzed:
     coins = [coin_to_plot] if coin_to_plot else list(models.keys())
     
-    # Make predictions for every coin and plot:
+    # Test predictions (absolute prices) and RMSE of all coins:
+    if predictions is None:
+        feature_cols = feature_columns(df, drop_cols, [ref_price, target])
+        predictions = per_coin_test_predictions(
+            df, {coin: models[coin] for coin in coins}, feature_cols, target=target, ref_price=ref_price,
+            coin_col=coin_col, date_col=date_col, train_frac=train_frac)
+    rmse_by_coin = coin_metrics(predictions, coin_col=coin_col).set_index('coin_id')['RMSE_abs_price']
+    test_rows = predictions.groupby(coin_col, observed=True).indices
+    
+    # Plot every coin:
     for coin in coins:
-    	# Prepare test dataset:
-        df_coin = df[df[coin_col] == coin].sort_values(date_col).reset_index(drop=True)
-        split_idx = int(len(df_coin) * train_frac)
-        test_df = df_coin.iloc[split_idx:]
-        
-        # Prepare predictors and targets:
-        feature_cols = [c for c in df_coin.columns if c not in drop_cols]
-        X_test = test_df[feature_cols]
-        y_test = test_df[target]
-        
-        # Predict (normalized) and rescale
-        y_pred_norm = models[coin].predict(X_test)
-        y_pred_abs = y_pred_norm * test_df[ref_price].values
-        y_test_abs = y_test * test_df[ref_price].values
-
-        # Compute RMSE on absolute prices
-        rmse = mean_squared_error(y_test_abs, y_pred_abs, squared=False)
+        test_df = predictions.iloc[test_rows[coin]]
+        y_test_abs = test_df['price_abs']
+        y_pred_abs = test_df['prediction_abs']
+        rmse = rmse_by_coin[coin]
 
         # Prepare ML model's name:
         model_name = str(models[coin]).split('(')[0] 
 
         # Plot
         fig = plt.figure(figsize=(10, 5))
-        plt.plot(test_df['date'], y_test_abs, label='Ground Truth', 
+        plt.plot(test_df[date_col], y_test_abs, label='Ground Truth', 
         	lw=1, ls='--', alpha=0.7, color=COLOR_COINS[coin])
-        plt.plot(test_df['date'], y_pred_abs, label='Prediction', lw=2, 
+        plt.plot(test_df[date_col], y_pred_abs, label='Prediction', lw=2, 
         	ls='-', alpha=0.9, color=COLOR_COINS[coin])
         plt.title(f'{coin} — Ground Truth vs Prediction — Model {model_name} — RMSE {rmse}')
         plt.xlabel('Date')
@@ -2,15 +2,23 @@
 # Make ML predictions for cryptocurrency prices
 
 import os
+import sys
 import pandas as pd
 import psycopg2
 import argparse
 from dotenv import load_dotenv
+from sklearn.linear_model import LinearRegression
+from sklearn.ensemble import RandomForestRegressor
 
 from helper_functions import (
-	get_data_from_postgres, apply_transformation_to_orig_df,
+	CACHE_DIR, FEATURE_STORE_DIR, MODEL_REGISTRY_DIR, get_data_from_postgres, apply_transformation_to_orig_df,
+	build_feature_pipeline,
 	train_per_coin_models_LinearRegression, plot_predictions,
 	train_per_coin_rf_models)
+from backtest import walk_forward_backtest
+from pooled_model import train_pooled_model
+from rf_sweep import sweep_random_forest
+from model_registry import ModelRegistry
 
 # Get environmental variables:
 load_dotenv("../../.env")
@@ -20,6 +28,11 @@ if __name__ == "__main__":
 	# Define command-line interface (CLI) arguments:
 	parser = argparse.ArgumentParser(description="Apply feature engineering to daily datasets")
 	parser.add_argument("--table", type=str, help="Table name: crypto_daily_data (default) or coin_data")
+	parser.add_argument("--no_cache", action="store_true", help="Read from Postgres instead of the local Parquet cache")
+	parser.add_argument("--no_feature_store", action="store_true", help="Compute all features instead of reusing the stored ones")
+	parser.add_argument("--coins", nargs="+", help="Coins to analyze (space-separated). Leave off for all.")
+	parser.add_argument("--start_date", type=str, help="First date to read, YYYY-MM-DD (default: earliest)")
+	parser.add_argument("--end_date", type=str, help="Last date to read, YYYY-MM-DD (default: latest)")
 	parser.add_argument("--apply_risk", action="store_true", help="Assign risks")
 	parser.add_argument("--risk_streak_days", type=int, help="Number of dropping streak days for risk assignment (default: 1)")
 	parser.add_argument("--risk_period_days", type=int, help="Number of days for the risk period (default: 30)")
@@ -35,6 +48,20 @@ if __name__ == "__main__":
 	parser.add_argument("--allow_ML_RF_Model", action="store_true", help="Allow to train and evaluate a Random Forest Regressor model")
 	parser.add_argument("--RF_n_estimators", type=int, help="Number of estimators for the RF model default: 500")
 	parser.add_argument("--RF_max_depth", type=int, help="Max depth for the RF model default: 10")
+	parser.add_argument("--max_workers", type=int, help="Number of processes to train the coins in parallel (default: all cores)")
+	parser.add_argument("--pooled", action="store_true", help="Train one model for all coins (coin as a feature) instead of one model per coin")
+	parser.add_argument("--backtest_days", type=int, help="Walk-forward backtest of the selected models over the last N days, instead of a single train/test split")
+	parser.add_argument("--retrain_every", type=int, help="Days between retrainings in the backtest (default: 1)")
+	parser.add_argument("--train_window_days", type=int, help="Rolling training window of the backtest, in days (default: expanding window)")
+	parser.add_argument("--sweep", action="store_true", help="Hyperparameter sweep of the per-coin RF models, instead of a single training")
+	parser.add_argument("--sweep_n_estimators", type=int, nargs="+", help="Numbers of trees of the sweep, grown by warm start (default: 100 200 500)")
+	parser.add_argument("--sweep_max_depth", type=int, nargs="+", help="Max depths of the sweep, 0 for no limit (default: 5 10 20)")
+	parser.add_argument("--sweep_min_samples_leaf", type=int, nargs="+", help="Minimum samples per leaf of the sweep (default: 1 5)")
+	parser.add_argument("--sweep_max_features", type=str, nargs="+", help="Max features of the sweep, fractions or sqrt/log2 (default: 1.0 sqrt)")
+	parser.add_argument("--sweep_n_iter", type=int, help="Number of configurations drawn at random (default: all, grid search)")
+	parser.add_argument("--sweep_keep_fraction", type=float, help="Fraction of the configurations grown to the next number of trees (default: 0.5)")
+	parser.add_argument("--sweep_output", type=str, help="CSV file of the sweep results (default: rf_sweep_results.csv)")
+	parser.add_argument("--register", action="store_true", help="Save the trained models in the model registry, for predict.py")
 	parser.add_argument("--save_image", type=bool, help="Save image condition (default: False)")
 	
 	# Parse the CLI arguments:
@@ -72,11 +99,12 @@ if __name__ == "__main__":
 	save_image = args.save_image if args.save_image else False		
 
 	# Get information as dataframe:
-	df = get_data_from_postgres(password=PASSWORD,table=table)
+	df = get_data_from_postgres(
+		password=PASSWORD,table=table,coins=args.coins,start_date=args.start_date,end_date=args.end_date,
+		cache_dir=None if args.no_cache else CACHE_DIR)
 
 	# Apply transformations
-	df_full = apply_transformation_to_orig_df(
-		df,
+	feature_options = dict(
 		apply_risk=apply_risk,
 		risk_streak_days=risk_streak_days,
 		risk_period_days=risk_period_days,
@@ -89,16 +117,91 @@ if __name__ == "__main__":
 		apply_riks_mapping=apply_risk_mapping,
 		apply_price_normalization=apply_price_normalization
 		)
+	df_full = apply_transformation_to_orig_df(
+		df,
+		**feature_options,
+		store_dir=None if args.no_feature_store else FEATURE_STORE_DIR
+		)
 
 	# Drop rows that contain NaN values (the first rows with not enough information)
 	df_full = df_full.dropna()
 
+	def register(model_name, models, results_df):
+		# Save the models with their feature pipeline and the latest training date:
+		version = ModelRegistry(MODEL_REGISTRY_DIR).save(
+			model_name, models, build_feature_pipeline(**feature_options).params(), df_full['date'].max(),
+			results_df=results_df)
+		print(f"✅ Saved {model_name} {version} in {MODEL_REGISTRY_DIR}/{model_name}")
+
+	# Hyperparameter sweep of the per-coin RF models:
+	if args.sweep:
+		param_grid = {
+			'n_estimators': args.sweep_n_estimators or [100, 200, 500],
+			'max_depth': [depth or None for depth in (args.sweep_max_depth or [5, 10, 20])],
+			'min_samples_leaf': args.sweep_min_samples_leaf or [1, 5],
+			'max_features': [
+				float(value) if value.replace('.', '', 1).isdigit() else value
+				for value in (args.sweep_max_features or ['1.0', 'sqrt'])]
+			}
+		sweep_output = args.sweep_output if args.sweep_output else 'rf_sweep_results.csv'
+		results, best = sweep_random_forest(
+			df_full,param_grid,n_iter=args.sweep_n_iter,
+			keep_fraction=args.sweep_keep_fraction if args.sweep_keep_fraction else 0.5,
+			max_workers=args.max_workers)
+		results.to_csv(sweep_output, index=False)
+		print(f"✅ RF sweep of {results['config'].nunique()} configurations over {len(best)} coins:")
+		print(best.to_string(index=False))
+		print(f'Sweep results saved: "{sweep_output}"')
+		sys.exit(0)
+
+	# Walk-forward backtest of the selected models:
+	if args.backtest_days:
+		estimators = {}
+		if allow_ML_Linear_Model:
+			estimators['LinearRegression'] = LinearRegression()
+		if allow_ML_RF_Model:
+			estimators['RandomForestRegressor'] = RandomForestRegressor(
+				n_estimators=RF_n_estimators,max_depth=RF_max_depth,random_state=17)
+		for model_name, estimator in estimators.items():
+			metrics, _ = walk_forward_backtest(
+				df_full,estimator,test_days=args.backtest_days,retrain_every=args.retrain_every or 1,
+				train_window_days=args.train_window_days,max_workers=args.max_workers)
+			print(f"✅ Walk-forward backtest of {model_name} over the last {args.backtest_days} days:")
+			print(metrics.loc[metrics['fold'] == 'all', [
+				'coin_id','test_start','test_end','n_test','RMSE_abs_price','MAE_abs_price']].to_string(index=False))
+		sys.exit(0)
+
+	# Train and evaluate one pooled model for all coins:
+	if args.pooled:
+		if allow_ML_Linear_Model:
+			model_LinReg, results_df_LinReg = train_pooled_model(df_full,LinearRegression())
+			print("✅ Pooled LinearRegression model:")
+			print(results_df_LinReg.to_string(index=False))
+			if args.register:
+				register('PooledLinearRegression', model_LinReg, results_df_LinReg)
+		if allow_ML_RF_Model:
+			model_RF, results_df_RF = train_pooled_model(
+				df_full,RandomForestRegressor(
+					n_estimators=RF_n_estimators,max_depth=RF_max_depth,random_state=17,n_jobs=-1),
+				coin_encoding='code')
+			print("✅ Pooled RandomForestRegressor model:")
+			print(results_df_RF.to_string(index=False))
+			if args.register:
+				register('PooledRandomForestRegressor', model_RF, results_df_RF)
+		sys.exit(0)
+
 	# Train and evaluate ML Linear Regression model:
 	if allow_ML_Linear_Model:
-		models_LinReg, results_df_LinReg = train_per_coin_models_LinearRegression(df_full)
-		plot_predictions(df_full,models_LinReg,save_image=save_image)
+		models_LinReg, results_df_LinReg, predictions_LinReg = train_per_coin_models_LinearRegression(
+			df_full,max_workers=args.max_workers,return_predictions=True)
+		if args.register:
+			register('LinearRegression', models_LinReg, results_df_LinReg)
+		plot_predictions(df_full,models_LinReg,save_image=save_image,predictions=predictions_LinReg)
 
 	if allow_ML_RF_Model:
-		models_RF, results_df_RF = train_per_coin_rf_models(
-			df_full,n_estimators=RF_n_estimators,max_depth=RF_max_depth)
-		plot_predictions(df_full,models_RF,save_image=save_image)
\ No newline at end of file
+		models_RF, results_df_RF, predictions_RF = train_per_coin_rf_models(
+			df_full,n_estimators=RF_n_estimators,max_depth=RF_max_depth,max_workers=args.max_workers,
+			return_predictions=True)
+		if args.register:
+			register('RandomForestRegressor', models_RF, results_df_RF)
+		plot_predictions(df_full,models_RF,save_image=save_image,predictions=predictions_RF)
\ No newline at end of file
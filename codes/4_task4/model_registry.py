@@ -0,0 +1,219 @@
+# model_registry.py
+# Versioned storage of the trained ML models, for inference without retraining.
+
+import os
+import json
+import time
+import joblib
+import numpy as np
+import pandas as pd
+
+# ==============
+
+class StackedLinearModels:
+	"""
+	Per-coin linear models stored as one coefficient matrix (one row per coin) and one intercept
+	vector, so the rows of all coins are scored in one vectorized operation. The arrays can be
+	memory-mapped from .npy files.
+	--- Inputs ---
+	{coins} [list]: Coins, in the order of the rows of {coef}.
+	{coef} [numpy array]: Coefficients, of shape (n_coins, n_features).
+	{intercept} [numpy array]: Intercepts, of shape (n_coins,).
+	{feature_cols} [list]: Feature columns, in the order of the coefficients.
+	{coin_col} [string]: Coin column.
+	"""
+	def __init__(self, coins, coef, intercept, feature_cols, coin_col='coin_id'):
+		self.coins = list(coins)
+		self.coef = coef
+		self.intercept = intercept
+		self.feature_cols = list(feature_cols)
+		self.coin_col = coin_col
+
+	def predict(self, df):
+		"""
+		Prediction of every row (NaN for coins without a model).
+		"""
+		X = df[self.feature_cols].to_numpy(dtype=float)
+		codes = pd.Categorical(df[self.coin_col].astype(str), categories=self.coins).codes
+		known = codes >= 0
+		y_pred = np.full(len(df), np.nan)
+		y_pred[known] = np.einsum('ij,ij->i', X[known], self.coef[codes[known]]) + self.intercept[codes[known]]
+		return y_pred
+
+class PerCoinModels:
+	"""
+	Any per-coin models, scored coin by coin on the rows of every coin.
+	--- Inputs ---
+	{models} [dict]: Fitted models, by coin.
+	{feature_cols} [list]: Feature columns used in training.
+	{coin_col} [string]: Coin column.
+	"""
+	def __init__(self, models, feature_cols, coin_col='coin_id'):
+		self.models = models
+		self.feature_cols = list(feature_cols)
+		self.coin_col = coin_col
+
+	def predict(self, df):
+		"""
+		Prediction of every row (NaN for coins without a model).
+		"""
+		y_pred = np.full(len(df), np.nan)
+		coins = df[self.coin_col].astype(str).to_numpy()
+		for coin, rows in pd.Series(np.arange(len(df))).groupby(coins):
+			if coin in self.models:
+				y_pred[rows.to_numpy()] = self.models[coin].predict(df.iloc[rows.to_numpy()][self.feature_cols])
+		return y_pred
+
+# ==============
+
+class ModelRegistry:
+	"""
+	Trained models saved as versions in "<registry_dir>/<name>/vNNNN/", each with a "meta.json" file
+	(feature pipeline, feature columns, data watermark, metrics) and the models:
+	- per-coin linear models as "coef.npy" and "intercept.npy" (memory-mapped when loaded);
+	- any other models as "models.joblib" (uncompressed, so its arrays are memory-mapped when loaded).
+	"<registry_dir>/<name>/LATEST" holds the latest version, and is only updated once the version is
+	complete.
+	--- Inputs ---
+	{registry_dir} [string]: Root folder of the registry.
+	"""
+	def __init__(self, registry_dir):
+		self.registry_dir = registry_dir
+
+	def versions(self, name):
+		"""
+		Saved versions of a model, in order.
+		"""
+		folder = os.path.join(self.registry_dir, name)
+		if not os.path.isdir(folder):
+			return []
+		return sorted(v for v in os.listdir(folder) if v.startswith('v') and v[1:].isdigit())
+
+	def latest(self, name):
+		"""
+		Latest complete version of a model, or None.
+		"""
+		try:
+			with open(os.path.join(self.registry_dir, name, 'LATEST'), 'r') as f:
+				return f.read().strip()
+		except OSError:
+			return None
+
+	def save(
+		self,
+		name,
+		models,
+		pipeline_params,
+		watermark,
+		target='price_usd',
+		ref_price='price_usd-1_orig',
+		coin_col='coin_id',
+		results_df=None
+		):
+		"""
+		Save trained models as a new version.
+		--- Inputs ---
+		{name} [string]: Model name (e.g. 'LinearRegression').
+		{models} [dict | PooledCoinModel]: Per-coin models from `train_per_coin_*`, or a pooled model.
+		{pipeline_params} [string]: Feature pipeline of the training data (see `FeaturePipeline.params`).
+		{watermark} [string | Timestamp]: Latest date of the training data.
+		{target} [string]: Target column.
+		{ref_price} [string]: Reference price, to scale normalized predictions back to absolute prices.
+		{coin_col} [string]: Coin column.
+		{results_df} [pandas DataFrame]: Evaluation results (coin_id and metrics columns), saved as metadata.
+
+		--- Returns ---
+		version [string]: Saved version, e.g. 'v0003'.
+		"""
+		versions = self.versions(name)
+		version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+		folder = os.path.join(self.registry_dir, name, version)
+		os.makedirs(folder)
+
+		# Feature columns, in training order (per-coin models are fitted on dataframes):
+		pooled = not isinstance(models, dict)
+		feature_cols = models.feature_cols if pooled else list(next(iter(models.values())).feature_names_in_)
+
+		# Per-coin linear models as stacked arrays, other models as one joblib file:
+		stacked = not pooled and all(
+			hasattr(m, 'coef_') and np.ndim(m.coef_) == 1 and np.ndim(m.intercept_) == 0 for m in models.values())
+		if stacked:
+			coins = sorted(models)
+			np.save(os.path.join(folder, 'coef.npy'), np.vstack([models[c].coef_ for c in coins]))
+			np.save(os.path.join(folder, 'intercept.npy'), np.array([models[c].intercept_ for c in coins], dtype=float))
+		else:
+			coins = sorted(models.coins if pooled else models)
+			joblib.dump(models, os.path.join(folder, 'models.joblib'))
+
+		meta = {
+			'name': name,
+			'version': version,
+			'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+			'kind': 'pooled' if pooled else ('stacked_linear' if stacked else 'per_coin'),
+			'model': repr(models) if pooled else str(next(iter(models.values()))).split('(')[0],
+			'pipeline': pipeline_params,
+			'feature_cols': list(feature_cols),
+			'target': target,
+			'ref_price': ref_price,
+			# The trainers fit the target divided by the reference price:
+			'normalized_target': True,
+			'coin_col': coin_col,
+			'watermark': str(pd.Timestamp(watermark).date()),
+			'coins': [str(c) for c in coins],
+			'results': results_df.astype({'coin_id': str}).to_dict(orient='records') if results_df is not None else None
+		}
+		with open(os.path.join(folder, 'meta.json'), 'w') as f:
+			json.dump(meta, f, indent=2, default=float)
+
+		# Publish the version:
+		tmp_path = os.path.join(self.registry_dir, name, 'LATEST.tmp')
+		with open(tmp_path, 'w') as f:
+			f.write(version)
+		os.replace(tmp_path, os.path.join(self.registry_dir, name, 'LATEST'))
+
+		return version
+
+	def load(
+		self,
+		name,
+		version=None
+		):
+		"""
+		Load a saved version of a model, memory-mapping its arrays.
+		--- Inputs ---
+		{name} [string]: Model name.
+		{version} [string]: Version to load (default: None, the latest one).
+
+		--- Returns ---
+		model [StackedLinearModels | PerCoinModels | PooledCoinModel]: Model with a `predict(df)` method that
+			scores the rows of all coins at once (normalized if meta['normalized_target']).
+		meta [dict]: Metadata of the version.
+
+		--- Raises ---
+		FileNotFoundError: If there is no saved version.
+		"""
+		version = version or self.latest(name)
+		if version is None:
+			raise FileNotFoundError(f"No saved version of model '{name}' in {self.registry_dir}")
+		folder = os.path.join(self.registry_dir, name, version)
+		with open(os.path.join(folder, 'meta.json'), 'r') as f:
+			meta = json.load(f)
+
+		if meta['kind'] == 'stacked_linear':
+			model = StackedLinearModels(
+				meta['coins'],
+				np.load(os.path.join(folder, 'coef.npy'), mmap_mode='r'),
+				np.load(os.path.join(folder, 'intercept.npy'), mmap_mode='r'),
+				meta['feature_cols'], coin_col=meta['coin_col'])
+		else:
+			models = joblib.load(os.path.join(folder, 'models.joblib'), mmap_mode='r')
+			if meta['kind'] == 'per_coin':
+				# Single-day scoring is faster without a thread pool per model:
+				for m in models.values():
+					if 'n_jobs' in m.get_params():
+						m.set_params(n_jobs=1)
+				model = PerCoinModels(models, meta['feature_cols'], coin_col=meta['coin_col'])
+			else:
+				model = models
+
+		return model, meta
@@ -0,0 +1,309 @@
+# online_features.py
+# Incremental computation of the features of a FeaturePipeline, one new day at a time.
+
+import numpy as np
+import pandas as pd
+
+from feature_pipeline import FeaturePipeline
+from helper_functions import coin_positions, drop_runs, calendar_flags
+
+# ==============
+
+class OnlineFeatureEngine:
+	"""
+	Per-coin state of a `FeaturePipeline`, to compute the features of new days without going
+	through the history again. Every feature only looks back a bounded number of rows or days, so
+	the state of a coin is:
+	- the number of rows seen and the date of the latest one;
+	- the previous values needed by the trend windows, the lags and the daily change (lag buffers);
+	- for every risk stage, the current drop streaks and the date of their latest trigger.
+	Each new row is computed with the same operations, in the same order, as the batch kernels of
+	helper_functions.py, so the features are identical to `FeaturePipeline.transform` over the full
+	history. The window sums are recomputed over the buffered values rather than updated by adding
+	the new value and subtracting the oldest one, which would not give the same floating-point results.
+
+	Example:
+		engine = OnlineFeatureEngine(pipeline).fit(df_history)
+		df_new_features = engine.update(df_new_days)
+	--- Inputs ---
+	{pipeline} [FeaturePipeline]: Pipeline with the recorded stages.
+	"""
+	def __init__(self, pipeline):
+		self.pipeline = pipeline
+		self.coins = {} # State of every coin, by coin name
+		self.watermark = None # Latest date seen
+
+	def buffer_sizes(self):
+		"""
+		Number of previous values to keep for every buffered column.
+		"""
+		sizes = {}
+		for name, options in self.pipeline.stages:
+			if name == 'risk':
+				# Daily change:
+				sizes['price_usd'] = max(sizes.get('price_usd', 0), 1)
+			elif name == 'trend_var':
+				windows = options['window_back_days']
+				for window in (windows if isinstance(windows, (list, tuple)) else [windows]):
+					sizes['price_usd'] = max(sizes.get('price_usd', 0), int(window))
+			elif name == 'lags':
+				target_col = options['target_col']
+				sizes[target_col] = max(sizes.get(target_col, 0), options['win'])
+
+		return sizes
+
+	def fit(
+		self,
+		df
+		):
+		"""
+		Build the state of every coin from its history (vectorized over all coins).
+		--- Inputs ---
+		{df} [pandas DataFrame]: Daily prices, with coin_id, date and price_usd columns.
+
+		--- Returns ---
+		self [OnlineFeatureEngine]: The engine, ready to `update`.
+		"""
+		self.coins = {}
+		self.watermark = None
+		if df.empty:
+			return self
+
+		# Sort by coin and date:
+		coin_codes = pd.factorize(df['coin_id'], sort=True)[0]
+		order = np.lexsort((df['date'].to_numpy(), coin_codes))
+		codes = coin_codes[order]
+		positions = coin_positions(codes)
+		dates = df['date'].to_numpy(dtype='datetime64[ns]')[order]
+		prices = df['price_usd'].to_numpy(dtype=float)[order]
+		values = {col: df[col].to_numpy(dtype=float)[order] for col in self.buffer_sizes()}
+
+		# First and last row of every coin:
+		ends = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True])
+		starts = ends - positions[ends]
+
+		# Drop streaks and latest trigger of every risk stage:
+		idx = np.arange(len(prices))
+		runs = drop_runs(positions, prices) if any(name == 'risk' for name, _ in self.pipeline.stages) else None
+		risk_states = []
+		for name, options in self.pipeline.stages:
+			if name != 'risk':
+				risk_states.append(None)
+				continue
+			last_triggers = [
+				np.maximum.accumulate(np.where(run >= options['drop_streak_days'], idx, -1)) for run in runs]
+			risk_states.append((runs, last_triggers))
+
+		for start, end in zip(starts, ends):
+			coin = str(df['coin_id'].iloc[order[end]])
+			stages = []
+			for risk_state in risk_states:
+				if risk_state is None:
+					stages.append(None)
+					continue
+				runs, last_triggers = risk_state
+				stages.append({
+					'run': [int(run[end]) for run in runs],
+					'trigger': [dates[t[end]] if t[end] >= start else None for t in last_triggers]})
+			self.coins[coin] = {
+				'n': int(end - start + 1),
+				'last_date': dates[end],
+				'values': {
+					col: [np.float64(v) for v in arr[max(start, end - size + 1):end + 1]] if size else []
+					for (col, size), arr in zip(self.buffer_sizes().items(), values.values())},
+				'stages': stages}
+		self.watermark = dates.max()
+
+		return self
+
+	def update(
+		self,
+		df_new
+		):
+		"""
+		Compute the features of new rows and add them to the state.
+		--- Inputs ---
+		{df_new} [pandas DataFrame]: New daily prices, with the same columns as the history. Every row must
+			be after the latest date of its coin.
+
+		--- Returns ---
+		df_features [pandas DataFrame]: Same columns as `FeaturePipeline.transform`, for the new rows only,
+			sorted by coin and date.
+
+		--- Raises ---
+		ValueError: If a new row is not after the latest date of its coin.
+		"""
+		n = len(df_new)
+		stages = self.pipeline.stages
+		sizes = self.buffer_sizes()
+
+		# Sort by coin and date:
+		coin_codes = pd.factorize(df_new['coin_id'], sort=True)[0]
+		order = np.lexsort((df_new['date'].to_numpy(), coin_codes))
+		coins = df_new['coin_id'].astype(str).to_numpy()[order]
+		dates = df_new['date'].to_numpy(dtype='datetime64[ns]')[order]
+		values = {col: df_new[col].to_numpy(dtype=float)[order] for col in set(sizes) | {'price_usd'}}
+
+		# Output columns, same as the batch pipeline:
+		output_order = FeaturePipeline.plan_columns(df_new.columns, stages)
+		data = {}
+		for col in df_new.columns:
+			if df_new[col].dtype.kind == 'f':
+				data[col] = df_new[col].to_numpy(dtype=float)[order]
+			else:
+				data[col] = df_new[col].array.take(order)
+		for i, (name, options) in enumerate(stages):
+			for col in FeaturePipeline.stage_outputs(name, options):
+				if name == 'risk' or col.startswith('trend'):
+					data[col] = np.empty(n, dtype=object)
+				elif name != 'calendar':
+					data[col] = np.full(n, np.nan)
+
+		# Closed-form OLS weights of every trend window (see `rolling_slope_and_variance`):
+		weights = {}
+		for name, options in stages:
+			if name == 'trend_var':
+				windows = options['window_back_days']
+				for window in (windows if isinstance(windows, (list, tuple)) else [windows]):
+					x_centered = np.arange(int(window) + 1, dtype=float) - int(window) / 2
+					weights[int(window)] = x_centered / np.sum(x_centered**2)
+
+		for j in range(n):
+			state = self.coins.setdefault(coins[j], {
+				'n': 0, 'last_date': None,
+				'values': {col: [] for col in sizes},
+				'stages': [{'run': [0, 0], 'trigger': [None, None]} if name == 'risk' else None for name, _ in stages]})
+			if state['last_date'] is not None and dates[j] <= state['last_date']:
+				raise ValueError(f"New row of {coins[j]} on {dates[j]} is not after its latest date {state['last_date']}")
+			price = np.float64(values['price_usd'][j])
+			prev_prices = state['values'].get('price_usd', [])
+
+			for i, (name, options) in enumerate(stages):
+				if name == 'risk':
+					risk_state = state['stages'][i]
+					# Flags of the previous {risk_period_days} days (see `risk_levels`):
+					had = [False, False]
+					if state['n'] > 0:
+						cutoff = state['last_date'] - np.timedelta64(options['risk_period_days'], 'D')
+						had = [trigger is not None and trigger > cutoff for trigger in risk_state['trigger']]
+					data['risk_level'][j] = 'High' if had[0] else ('Medium' if had[1] else 'Low')
+
+					# Extend the drop streaks with the daily change of the current day (see `drop_runs`):
+					pct_change = (price / prev_prices[-1] - 1) * 100 if state['n'] > 0 else np.nan
+					drops = [pct_change <= -50, (pct_change <= -20) and (pct_change > -50)]
+					for k, drop in enumerate(drops):
+						risk_state['run'][k] = risk_state['run'][k] + 1 if drop else 0
+						if risk_state['run'][k] >= options['drop_streak_days']:
+							risk_state['trigger'][k] = dates[j]
+
+				elif name == 'trend_var':
+					windows = options['window_back_days']
+					for window in (windows if isinstance(windows, (list, tuple)) else [windows]):
+						suffix = f"_{window}" if isinstance(windows, (list, tuple)) else ""
+						window = int(window)
+						win = window + 1
+						if state['n'] < window:
+							continue
+						# Same sums, in the same order, as `rolling_slope_and_variance`:
+						y = (prev_prices[len(prev_prices) - window:] if window else []) + [price]
+						weighted_sum = np.float64(0)
+						total = np.float64(0)
+						for k in range(win):
+							weighted_sum += weights[window][k] * y[k]
+							total += y[k]
+						mean = total / win
+						squares = np.float64(0)
+						for k in range(win):
+							deviation = y[k] - mean
+							squares += deviation * deviation
+						data[f'variance{suffix}'][j] = squares / (win - 1)
+
+						# Trend category (see `trend_and_variance`):
+						if options['trend_method'] == "compare_extremes":
+							rel_diff = (price - y[0]) / y[0]
+						elif options['trend_method'] == "slope":
+							rel_diff = weighted_sum*win / price
+						else:
+							raise ValueError("trend_method must be 'slope' or 'compare_extremes'")
+						fraction_criterion = options['fraction_criterion']
+						if rel_diff > fraction_criterion:
+							data[f'trend{suffix}'][j] = "Rising"
+						elif np.abs(rel_diff) <= fraction_criterion:
+							data[f'trend{suffix}'][j] = "Flat"
+						elif rel_diff < -fraction_criterion:
+							data[f'trend{suffix}'][j] = "Dropping"
+
+				elif name == 'lags':
+					target_col = options['target_col']
+					buffer = state['values'][target_col]
+					lags = [buffer[-i] if i <= len(buffer) and i <= state['n'] else np.nan for i in range(1, options['win'] + 1)]
+					if options['normalize']:
+						data[f'{target_col}-1_orig'][j] = lags[0]
+						lags = [lag / np.float64(lags[0]) for lag in lags]
+					for i_lag, lag in enumerate(lags, start=1):
+						data[f'{target_col}-{i_lag}'][j] = lag
+
+			# Add the current row to the state:
+			for col, size in sizes.items():
+				if size:
+					buffer = state['values'][col]
+					buffer.append(np.float64(values[col][j]))
+					del buffer[:-size]
+			state['n'] += 1
+			state['last_date'] = dates[j]
+
+		# Mapping of the risk levels (by the last risk stage, as in the batch pipeline) and calendar flags, vectorized:
+		risk_options = [options for name, options in stages if name == 'risk']
+		if risk_options and risk_options[-1]['risk_map'] is not None:
+			data['risk_level'] = pd.Series(data['risk_level'], dtype=object).map(risk_options[-1]['risk_map']).to_numpy()
+		for name, options in stages:
+			if name == 'calendar':
+				data.update(calendar_flags(dates, options['calendars']))
+		if n:
+			self.watermark = max(dates.max(), self.watermark) if self.watermark is not None else dates.max()
+
+		return pd.DataFrame({col: data[col] for col in output_order})
+
+	def to_dict(self):
+		"""
+		State of the engine as a JSON-serializable dictionary (dates as ISO strings).
+		"""
+		def date_str(date):
+			return None if date is None else str(date)
+
+		return {
+			'watermark': date_str(self.watermark),
+			'coins': {
+				coin: {
+					'n': state['n'],
+					'last_date': date_str(state['last_date']),
+					'values': {col: [float(v) for v in buffer] for col, buffer in state['values'].items()},
+					'stages': [
+						None if stage is None else {'run': list(stage['run']), 'trigger': [date_str(t) for t in stage['trigger']]}
+						for stage in state['stages']]}
+				for coin, state in self.coins.items()}}
+
+	@classmethod
+	def from_dict(
+		cls,
+		pipeline,
+		data
+		):
+		"""
+		Restore an engine saved with `to_dict`.
+		"""
+		def to_date(date_str):
+			return None if date_str is None else np.datetime64(date_str, 'ns')
+
+		engine = cls(pipeline)
+		engine.watermark = to_date(data['watermark'])
+		for coin, state in data['coins'].items():
+			engine.coins[coin] = {
+				'n': state['n'],
+				'last_date': to_date(state['last_date']),
+				'values': {col: [np.float64(v) for v in buffer] for col, buffer in state['values'].items()},
+				'stages': [
+					None if stage is None else {'run': list(stage['run']), 'trigger': [to_date(t) for t in stage['trigger']]}
+					for stage in state['stages']]}
+
+		return engine
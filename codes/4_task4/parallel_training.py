@@ -0,0 +1,210 @@
+# parallel_training.py
+# Training of one ML model per coin, spread across a pool of processes.
+
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.base import clone
+from threadpoolctl import threadpool_limits
+
+from evaluation import rescale_predictions
+
+# ==============
+
+def feature_columns(
+	df,
+	drop_cols,
+	extra_cols=()
+	):
+	"""
+	Columns used as predictors: every column of {df} except {drop_cols} and {extra_cols}. Every name in
+	{drop_cols} also drops its per-window variants (e.g. 'trend' also drops 'trend_7' and 'trend_14',
+	see `FeaturePipeline.add_trend_and_variance`).
+	--- Inputs ---
+	{df} [pandas DataFrame]: Features, target and reference price of every coin and day.
+	{drop_cols} [list]: Columns not used as predictors, with their per-window variants.
+	{extra_cols} [list]: Other columns not used as predictors (e.g. the target and reference price).
+
+	--- Returns ---
+	feature_cols [list]: Feature columns, in the order of {df}.
+	"""
+	prefixes = tuple(f'{col}_' for col in drop_cols)
+	return [
+		c for c in df.columns
+		if c not in list(drop_cols) + list(extra_cols) and not c.startswith(prefixes)]
+
+def coin_matrix(
+	df,
+	feature_cols,
+	target,
+	ref_price,
+	coin_col='coin_id',
+	date_col='date'
+	):
+	"""
+	Build one float matrix for all coins, sorted by coin and date: the feature columns, then the
+	target normalized by the reference price (the predicted variable, as in README), and the
+	reference price.
+	--- Inputs ---
+	{target} [string]: Target column (absolute price).
+	{ref_price} [string]: Reference price (previous-day price).
+	--- Returns ---
+	data [numpy array]: Matrix of shape (len(df), len(feature_cols) + 2).
+	coins [list]: Coins, in sorted order.
+	bounds [numpy array]: Row where every coin starts, plus the total number of rows.
+	"""
+	coin_codes, coins = pd.factorize(df[coin_col], sort=True)
+	order = np.lexsort((df[date_col].to_numpy(), coin_codes))
+	data = df[list(feature_cols) + [target, ref_price]].to_numpy(dtype=float)[order]
+	data[:, -2] /= data[:, -1]
+	bounds = np.searchsorted(coin_codes[order], np.arange(len(coins) + 1))
+
+	return data, list(coins), bounds
+
+def fit_coin_model(
+	data,
+	coin,
+	start,
+	split,
+	stop,
+	feature_cols,
+	estimator,
+	threads=None
+	):
+	"""
+	Fit a copy of {estimator} on the training rows of one coin and predict its test rows.
+	--- Inputs ---
+	{data} [numpy array | string]: Matrix built by `coin_matrix`, or the path of a .npy file with it
+		(opened as a memory map, so the processes share the same pages).
+	{coin} [string]: Coin name.
+	{start}, {split}, {stop} [int]: First training row, first test row and end row of the coin.
+	{feature_cols} [list]: Names of the feature columns.
+	{estimator} [sklearn estimator]: Unfitted model, cloned before fitting.
+	{threads} [int]: Maximum number of threads of the fit (default: None, no limit).
+
+	--- Returns ---
+	coin [string]: Coin name.
+	model [sklearn estimator]: Fitted model.
+	y_pred_norm [numpy array]: Predictions of the test rows.
+	"""
+	if isinstance(data, str):
+		data = np.load(data, mmap_mode='r')
+	n_features = len(feature_cols)
+
+	# Define predictors (X) and targets (y) for train/test, keeping the feature names:
+	X_train = pd.DataFrame(data[start:split, :n_features], columns=feature_cols)
+	y_train = data[start:split, n_features]
+	X_test = pd.DataFrame(data[split:stop, :n_features], columns=feature_cols)
+
+	# Fit model, with at most {threads} threads (BLAS/OpenMP pools and joblib workers):
+	model = clone(estimator)
+	if threads is not None and 'n_jobs' in model.get_params():
+		model.set_params(n_jobs=threads)
+	with threadpool_limits(limits=threads):
+		model.fit(X_train, y_train)
+		y_pred_norm = model.predict(X_test)
+
+	return coin, model, y_pred_norm
+
+# ==============
+
+def run_coin_tasks(
+	data,
+	function,
+	tasks,
+	max_workers=None
+	):
+	"""
+	Run function(data, *task) for every task across a pool of processes. The matrix is written once
+	to a memory-mapped .npy file shared by the workers, so every task only carries its own arguments
+	(e.g. the row range of a coin).
+	--- Inputs ---
+	{data} [numpy array]: Matrix shared by all the tasks (see `coin_matrix`).
+	{function} [function]: Module-level function, accepting the matrix or the path of its .npy file.
+	{tasks} [list]: Arguments of every task, as tuples.
+	{max_workers} [int]: Number of processes (default: None, all cores). With 1, the tasks run one
+		after another in the current process.
+
+	--- Returns ---
+	[generator]: Result of every task, in order of completion.
+	"""
+	max_workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+	# Sequential run, in the current process:
+	if max_workers == 1:
+		for task in tasks:
+			yield function(data, *task)
+		return
+
+	# Share the matrix through a memory-mapped file, then fan the tasks out:
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		data_path = os.path.join(tmp_dir, 'features.npy')
+		np.save(data_path, data)
+		with ProcessPoolExecutor(max_workers=max_workers) as pool:
+			futures = [pool.submit(function, data_path, *task) for task in tasks]
+			for future in as_completed(futures):
+				yield future.result()
+
+# ==============
+
+def fit_per_coin_models(
+	df,
+	estimator,
+	feature_cols,
+	target='price_usd',
+	ref_price='price_usd-1_orig',
+	coin_col='coin_id',
+	date_col='date',
+	train_frac=0.75,
+	max_workers=None,
+	threads_per_worker=1
+	):
+	"""
+	Train one model per coin (chronological split of every coin, see `split_train_test`), with the
+	coins spread across a pool of processes (see `run_coin_tasks`). The workers only return their test
+	predictions, which are rescaled together once all the fits are done (see evaluation.py).
+	--- Inputs ---
+	{df} [pandas DataFrame]: Features, target and reference price of every coin and day.
+	{estimator} [sklearn estimator]: Unfitted model, cloned for every coin.
+	{feature_cols} [list]: Columns used as predictors.
+	{target} [string]: Target column (absolute price), normalized by {ref_price} for training.
+	{ref_price} [string]: Reference price to scale the target back to absolute prices.
+	{coin_col} [string]: Coin column.
+	{date_col} [string]: Date column.
+	{train_frac} [float]: Fraction of the days of every coin used for training.
+	{max_workers} [int]: Number of processes (default: None, all cores). With 1, the coins are trained one
+		after another in the current process, with the estimator settings as they are.
+	{threads_per_worker} [int]: Maximum number of threads of every fit in the pool (default: 1).
+
+	--- Returns ---
+	models [dict]: Fitted model of every coin, in sorted order.
+	predictions [pandas DataFrame]: Test rows of all coins (see `rescale_predictions`).
+	"""
+	data, coins, bounds = coin_matrix(df, feature_cols, target, ref_price, coin_col, date_col)
+	coin_codes = pd.factorize(df[coin_col], sort=True)[0]
+	order = np.lexsort((df[date_col].to_numpy(), coin_codes))
+	parallel = min(max_workers or os.cpu_count() or 1, len(coins)) > 1
+	splits = bounds[:-1] + ((bounds[1:] - bounds[:-1]) * train_frac).astype(int)
+	tasks = [
+		(coin, start, split, stop, feature_cols, estimator, threads_per_worker if parallel else None)
+		for coin, start, split, stop in zip(coins, bounds[:-1], splits, bounds[1:])]
+	test_rows = np.concatenate([np.arange(split, stop) for split, stop in zip(splits, bounds[1:])])
+
+	# Collect the models and the test predictions as the fits finish:
+	models = {}
+	y_pred_norm = np.full(len(data), np.nan)
+	split_of = dict(zip(coins, splits))
+	for coin, model, coin_predictions in run_coin_tasks(data, fit_coin_model, tasks, max_workers=max_workers):
+		models[coin] = model
+		y_pred_norm[split_of[coin]:split_of[coin] + len(coin_predictions)] = coin_predictions
+
+	# Scale all the test rows back to absolute prices, in one step:
+	n_features = len(feature_cols)
+	predictions = rescale_predictions(
+		np.searchsorted(bounds, test_rows, side='right') - 1, coins,
+		df[date_col].to_numpy()[order][test_rows], data[test_rows, n_features], y_pred_norm[test_rows],
+		data[test_rows, n_features + 1], coin_col=coin_col, date_col=date_col)
+
+	return {coin: models[coin] for coin in coins}, predictions
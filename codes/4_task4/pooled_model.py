@@ -0,0 +1,163 @@
+# pooled_model.py
+# One ML model for all coins, with the coin identity as a feature.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+
+from helper_functions import coin_positions
+from evaluation import rescale_predictions, coin_metrics
+from parallel_training import feature_columns
+
+# ==============
+
+class PooledCoinModel:
+	"""
+	Single model trained on the rows of all coins, instead of one model per coin. The lag features are
+	normalized by the previous-day price (see `normalize_prices`), so they are comparable across coins,
+	and the target is normalized the same way. The coin identity is added as a feature:
+	- 'onehot': one sparse indicator column per coin (a per-coin intercept for linear models);
+	- 'code': one integer column with the coin index (enough for tree models).
+	Only one estimator and the list of coins are stored, and `predict` scores the rows of all the coins
+	in one call. Coins not seen in training get no coin feature ('onehot') or code -1 ('code').
+	--- Inputs ---
+	{estimator} [sklearn estimator]: Unfitted model.
+	{feature_cols} [list]: Columns used as predictors, besides the coin.
+	{coin_col} [string]: Coin column.
+	{ref_price} [string]: Reference price, to scale predictions back to absolute prices.
+	{coin_encoding} [string]: 'onehot' (default) or 'code'.
+	"""
+	def __init__(
+		self,
+		estimator,
+		feature_cols,
+		coin_col='coin_id',
+		ref_price='price_usd-1_orig',
+		coin_encoding='onehot'
+		):
+		if coin_encoding not in ('onehot', 'code'):
+			raise ValueError("coin_encoding must be 'onehot' or 'code'")
+		self.estimator = clone(estimator)
+		self.feature_cols = list(feature_cols)
+		self.coin_col = coin_col
+		self.ref_price = ref_price
+		self.coin_encoding = coin_encoding
+		self.coins = None # Coins seen in training, in sorted order
+
+	def __repr__(self):
+		return f"Pooled{self.estimator!r}"
+
+	def design_matrix(self, df):
+		"""
+		Predictors of every row: the feature columns and the coin encoding.
+		"""
+		X = df[self.feature_cols].to_numpy(dtype=float)
+		codes = pd.Categorical(df[self.coin_col].astype(str), categories=self.coins).codes
+		if self.coin_encoding == 'code':
+			return np.column_stack([X, codes])
+
+		known = codes >= 0
+		onehot = sparse.csr_matrix(
+			(np.ones(known.sum()), (np.flatnonzero(known), codes[known])), shape=(len(df), len(self.coins)))
+		return sparse.hstack([sparse.csr_matrix(X), onehot], format='csr')
+
+	def fit(
+		self,
+		df,
+		y_norm
+		):
+		"""
+		Fit the model on the rows of all coins at once.
+		--- Inputs ---
+		{df} [pandas DataFrame]: Feature, coin and reference price columns.
+		{y_norm} [numpy array]: Target, normalized by the reference price.
+
+		--- Returns ---
+		self [PooledCoinModel]: Fitted model.
+		"""
+		self.coins = sorted(df[self.coin_col].astype(str).unique())
+		self.estimator.fit(self.design_matrix(df), np.asarray(y_norm, dtype=float))
+		return self
+
+	def predict(
+		self,
+		df
+		):
+		"""
+		Predict the normalized target of every row, for all coins in one call.
+		"""
+		return self.estimator.predict(self.design_matrix(df))
+
+	def predict_price(
+		self,
+		df
+		):
+		"""
+		Predict absolute prices: normalized predictions times the reference price.
+		"""
+		return self.predict(df) * df[self.ref_price].to_numpy(dtype=float)
+
+# ==============
+
+def train_pooled_model(
+	df,
+	estimator,
+	target='price_usd',
+	ref_price='price_usd-1_orig',
+	coin_col='coin_id',
+	date_col='date',
+	drop_cols=['coin_id', 'date', 'risk_level', 'trend', 'variance'],
+	train_frac=0.75,
+	coin_encoding='onehot'
+	):
+	"""
+	Train one `PooledCoinModel` for all coins. Every coin is split chronologically as in the per-coin
+	models (the first {train_frac} of its days for training, see `split_train_test`), and the training
+	rows of all coins are fitted at once.
+	--- Inputs ---
+	{df} [pandas DataFrame]: Features, absolute target and reference price of every coin and day.
+	{estimator} [sklearn estimator]: Unfitted model (e.g. LinearRegression()).
+	{target} [string]: Target column (absolute price), normalized by {ref_price} for training.
+	{ref_price} [string]: Reference price (previous-day price).
+	{coin_col} [string]: Coin column.
+	{date_col} [string]: Date column.
+	{drop_cols} [list]: Columns not used as predictors, with their per-window variants (e.g. 'trend' also
+		drops 'trend_7'). The target and reference price are always dropped. The variance is dropped by
+		default: it is in price units, so it is not comparable across coins.
+	{train_frac} [float]: Fraction of the days of every coin used for training.
+	{coin_encoding} [string]: Encoding of the coin identity, 'onehot' or 'code' (see `PooledCoinModel`).
+
+	--- Returns ---
+	model [PooledCoinModel]: Fitted model.
+	results_df [pandas DataFrame]: RMSE, MAE and MAPE on absolute prices of the test days of every coin
+		(see `coin_metrics`).
+	"""
+	feature_cols = feature_columns(df, drop_cols, [ref_price, target])
+
+	# Sort by coin and date, and split every coin chronologically:
+	coin_codes = pd.factorize(df[coin_col], sort=True)[0]
+	order = np.lexsort((df[date_col].to_numpy(), coin_codes))
+	df_sorted = df.iloc[order].reset_index(drop=True)
+	positions = coin_positions(coin_codes[order])
+	coin_sizes = np.bincount(coin_codes[order])[coin_codes[order]]
+	is_train = positions < (coin_sizes * train_frac).astype(int)
+
+	# Normalized target:
+	ref_prices = df_sorted[ref_price].to_numpy(dtype=float)
+	y_norm = df_sorted[target].to_numpy(dtype=float) / ref_prices
+	coins = sorted(df_sorted[coin_col].astype(str).unique())
+
+	# Train once on all coins, and score every test row in one call:
+	model = PooledCoinModel(
+		estimator, feature_cols, coin_col=coin_col, ref_price=ref_price, coin_encoding=coin_encoding)
+	model.fit(df_sorted[is_train], y_norm[is_train])
+	df_test = df_sorted[~is_train]
+	predictions = rescale_predictions(
+		np.searchsorted(coins, df_test[coin_col].astype(str).to_numpy()), coins, df_test[date_col].to_numpy(),
+		y_norm[~is_train], model.predict(df_test), ref_prices[~is_train], coin_col=coin_col, date_col=date_col)
+
+	# Metrics on absolute prices, for all coins at once:
+	results_df = coin_metrics(predictions, coin_col=coin_col)
+
+	return model, results_df
@@ -0,0 +1,109 @@
+# predict.py
+# Forecast the next-day price of every coin with the saved ML models, without retraining
+
+import os
+import time
+import pandas as pd
+import argparse
+from dotenv import load_dotenv
+
+from helper_functions import CACHE_DIR, MODEL_REGISTRY_DIR, get_data_from_postgres
+from feature_pipeline import FeaturePipeline
+from model_registry import ModelRegistry
+
+# Get environmental variables:
+load_dotenv("../../.env")
+PASSWORD = os.getenv("POSTGRES_PASSWORD") # Postgres password
+
+def predict_next_day(
+	model,
+	meta,
+	df
+	):
+	"""
+	Forecast the price of every coin on the day after its newest day, in one batch. One row is added per
+	coin at that day, without a price, so its lagged prices, calendar flags and risk level (all computed
+	from the previous days) are the features the model needs.
+	--- Inputs ---
+	{model} [object]: Model loaded from the registry (see `ModelRegistry.load`).
+	{meta} [dict]: Metadata of the model.
+	{df} [pandas DataFrame]: Daily prices of the last days (at least `FeaturePipeline.lookback_days`).
+
+	--- Returns ---
+	df_pred [pandas DataFrame]: coin_id, forecast date, last observed price and predicted price of every coin.
+
+	--- Raises ---
+	ValueError: If the model uses features of the same day (trend and variance windows end on the
+		scored day, whose price is not known yet).
+	"""
+	pipeline = FeaturePipeline.from_params(meta['pipeline'])
+	coin_col = meta['coin_col']
+
+	# Refuse features that need the price of the forecast day itself:
+	same_day_cols = [
+		col for name, options in pipeline.stages if name == 'trend_var'
+		for col in FeaturePipeline.stage_outputs(name, options) if col in meta['feature_cols']]
+	if same_day_cols:
+		raise ValueError(
+			f"{meta['model']} {meta['version']} uses same-day features {same_day_cols}, "
+			f"which cannot be computed for the next day. Retrain it without --apply_trend_var.")
+
+	# One row per coin on the day after its newest day, with an unknown price:
+	df_next = df.loc[df.groupby(coin_col, observed=True)['date'].idxmax(), [coin_col, 'date']]
+	df_next['date'] = df_next['date'] + pd.Timedelta(days=1)
+	df_next = df_next[df_next[coin_col].notna()]
+
+	# Same features as in training, over the last days and the forecast day:
+	df_features = pipeline.transform(pd.concat([df, df_next], ignore_index=True))
+	df_features = df_features.groupby(coin_col, observed=True).tail(1)
+
+	# Skip the coins with too few days for the features:
+	df_complete = df_features.dropna(subset=meta['feature_cols'] + [meta['ref_price']])
+	if len(df_complete) < len(df_features):
+		print(f"⚠️ {len(df_features) - len(df_complete)} coins skipped (too few days before the forecast day)")
+
+	# Score all coins at once (scaled back to absolute prices if the target was normalized):
+	y_pred = model.predict(df_complete)
+	if meta['normalized_target']:
+		y_pred = y_pred * df_complete[meta['ref_price']].to_numpy(dtype=float)
+	return pd.DataFrame({
+		'coin_id': df_complete[coin_col].astype(str).to_numpy(),
+		'date': df_complete['date'].to_numpy(),
+		'last_price_usd': df_complete[meta['ref_price']].to_numpy(),
+		'prediction_usd': y_pred})
+
+if __name__ == "__main__":
+	# Define command-line interface (CLI) arguments:
+	parser = argparse.ArgumentParser(description="Forecast the next-day price of every coin with a saved model")
+	parser.add_argument("--model", type=str, help="Saved model name, e.g. LinearRegression (default) or RandomForestRegressor")
+	parser.add_argument("--version", type=str, help="Saved version, e.g. v0001 (default: latest)")
+	parser.add_argument("--table", type=str, help="Table name: crypto_daily_data (default) or coin_data")
+	parser.add_argument("--no_cache", action="store_true", help="Read from Postgres instead of the local Parquet cache")
+	parser.add_argument("--coins", nargs="+", help="Coins to forecast (space-separated). Leave off for all.")
+	parser.add_argument("--output", type=str, help="CSV file to save the predictions")
+
+	# Parse the CLI arguments:
+	args = parser.parse_args()
+
+	# Set variables:
+	model_name = args.model if args.model else 'LinearRegression'
+	table = args.table if args.table else 'crypto_daily_data'
+
+	# Load the saved model (arrays are memory-mapped):
+	t_start = time.perf_counter()
+	model, meta = ModelRegistry(MODEL_REGISTRY_DIR).load(model_name, version=args.version)
+
+	# Get the last days needed by the features (one more week in case of missing days):
+	lookback_days = FeaturePipeline.from_params(meta['pipeline']).lookback_days() + 7
+	df = get_data_from_postgres(
+		password=PASSWORD,table=table,coins=args.coins,last_n_days=lookback_days,
+		cache_dir=None if args.no_cache else CACHE_DIR)
+
+	# Forecast the next day of every coin:
+	df_pred = predict_next_day(model, meta, df)
+	print(f"✅ {meta['model']} {meta['version']} (trained up to {meta['watermark']}), "
+		f"forecast {len(df_pred)} coins in {time.perf_counter() - t_start:.2f}s:")
+	print(df_pred.to_string(index=False))
+	if args.output:
+		df_pred.to_csv(args.output, index=False)
+		print(f'Predictions saved: "{args.output}"')
@@ -7,7 +7,7 @@ import psycopg2
 import argparse
 from dotenv import load_dotenv
 
-from helper_functions import get_data_from_postgres, apply_transformation_to_orig_df
+from helper_functions import CACHE_DIR, FEATURE_STORE_DIR, get_data_from_postgres, apply_transformation_to_orig_df
 
 # Get environmental variables:
 load_dotenv("../../.env")
@@ -17,6 +17,11 @@ if __name__ == "__main__":
 	# Define command-line interface (CLI) arguments:
 	parser = argparse.ArgumentParser(description="Apply feature engineering to daily datasets")
 	parser.add_argument("--table", type=str, help="Table name: crypto_daily_data (default) or coin_data")
+	parser.add_argument("--no_cache", action="store_true", help="Read from Postgres instead of the local Parquet cache")
+	parser.add_argument("--no_feature_store", action="store_true", help="Compute all features instead of reusing the stored ones")
+	parser.add_argument("--coins", nargs="+", help="Coins to analyze (space-separated). Leave off for all.")
+	parser.add_argument("--start_date", type=str, help="First date to read, YYYY-MM-DD (default: earliest)")
+	parser.add_argument("--end_date", type=str, help="Last date to read, YYYY-MM-DD (default: latest)")
 	parser.add_argument("--apply_risk", action="store_true", help="Assign risks")
 	parser.add_argument("--risk_streak_days", type=int, help="Number of dropping streak days for risk assignment (default: 1)")
 	parser.add_argument("--risk_period_days", type=int, help="Number of days for the risk period (default: 30)")
@@ -55,7 +60,9 @@ if __name__ == "__main__":
 	apply_calendar_features = args.apply_calendar_features if args.apply_calendar_features else False
 
 	# Get information as dataframe:
-	df = get_data_from_postgres(password=PASSWORD,table=table)
+	df = get_data_from_postgres(
+		password=PASSWORD,table=table,coins=args.coins,start_date=args.start_date,end_date=args.end_date,
+		cache_dir=None if args.no_cache else CACHE_DIR)
 
 	# Apply transformations
 	df_full = apply_transformation_to_orig_df(
@@ -70,7 +77,8 @@ if __name__ == "__main__":
 		apply_lagged_prices=apply_lagged_prices,
 		apply_calendar_features=apply_calendar_features,
 		apply_riks_mapping=apply_risk_mapping,
-		apply_price_normalization=apply_price_normalization
+		apply_price_normalization=apply_price_normalization,
+		store_dir=None if args.no_feature_store else FEATURE_STORE_DIR
 		)
 
 	# Display in screen
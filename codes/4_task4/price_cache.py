@@ -0,0 +1,276 @@
+# price_cache.py
+# Local Parquet cache of the daily price tables, refreshed with the new rows only.
+
+import os
+import json
+import shutil
+import pandas as pd
+
+# Parquet support is optional, without it the prices are read from Postgres every time:
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+
+# ==============
+
+class PriceCache:
+	"""
+	Local copy of a price table, stored as Parquet files partitioned by year
+	("<cache_dir>/<table>/year=YYYY/part-NNNNN.parquet") plus a "meta.json" file.
+
+	The metadata keeps a watermark (latest cached date), the number of rows and the sum of prices
+	of every year up to that date, the table OID and a fingerprint of its schema. On every refresh:
+	- If the table was recreated, its schema changed or new columns are requested, the cache is rebuilt.
+	- The years whose row count or price sum up to the watermark changed (deleted, updated or
+	  backfilled rows) are downloaded again and replace their cached parts.
+	- The rows newer than the watermark are downloaded and appended as new parts.
+	All checks and downloads of a refresh run in one REPEATABLE READ transaction, so they see the
+	same snapshot of the table.
+	Known trade-off: the check is one grouped COUNT/SUM over the whole table on every refresh, even
+	when nothing changed, since the price tables have no modification timestamp and no index led by
+	the date. Only the downloads and the rewritten parts are limited to the changed years and the new
+	rows.
+	--- Inputs ---
+	{cache_dir} [string]: Root folder of the cache.
+	{table} [string]: Name of the price table.
+	{price_var} [string]: Name of the price column in the table.
+	{max_parts_per_year} [int]: Number of parts in a year folder above which they are merged into one.
+	"""
+	def __init__(self, cache_dir, table, price_var='price_usd', max_parts_per_year=16):
+		self.folder = os.path.join(cache_dir, table)
+		self.table = table
+		self.price_var = price_var
+		self.max_parts_per_year = max_parts_per_year
+		self.meta_path = os.path.join(self.folder, 'meta.json')
+
+	@staticmethod
+	def available():
+		"""
+		Check if Parquet files can be written and read (requires pyarrow).
+		"""
+		return pyarrow is not None
+
+	def load_meta(self):
+		"""
+		Read the cache metadata, or None if there is no valid cache.
+		"""
+		try:
+			with open(self.meta_path, 'r') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def save_meta(self, meta):
+		"""
+		Write the cache metadata atomically: parts not listed in it are ignored.
+		"""
+		tmp_path = self.meta_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(meta, f, indent=2)
+		os.replace(tmp_path, self.meta_path)
+
+	def table_identity(self, cursor):
+		"""
+		Get the OID of the table and a fingerprint of its columns and types.
+		"""
+		cursor.execute(f"""
+			SELECT
+			'{self.table}'::regclass::oid::bigint,
+			md5(string_agg(column_name || ':' || data_type, ',' ORDER BY ordinal_position))
+			FROM information_schema.columns
+			WHERE table_schema = current_schema() AND table_name = %s
+			""", (self.table,))
+		oid, fingerprint = cursor.fetchone()
+		return oid, fingerprint
+
+	def table_state(self, cursor, watermark):
+		"""
+		Get the latest date of the table and, for every year, the row count and price sum up to the
+		watermark and over all its rows (one scan of the table).
+		--- Returns ---
+		max_date [string]: Latest date of the table (None if it is empty).
+		years_old [dict]: [row count, price sum] of every year up to the watermark, by year.
+		years_new [dict]: [row count, price sum] of every year, by year.
+		"""
+		cursor.execute(f"""
+			SELECT
+			EXTRACT(YEAR FROM date)::int,
+			MAX(date)::text,
+			COUNT(*) FILTER (WHERE date <= %(watermark)s::date),
+			COALESCE(SUM({self.price_var}) FILTER (WHERE date <= %(watermark)s::date), 0)::text,
+			COUNT(*),
+			COALESCE(SUM({self.price_var}), 0)::text
+			FROM {self.table}
+			GROUP BY 1
+			""", {'watermark': watermark})
+		rows = cursor.fetchall()
+		max_date = max((row[1] for row in rows), default=None)
+		years_old = {str(year): [n_old, sum_old] for year, _, n_old, sum_old, _, _ in rows if n_old}
+		years_new = {str(year): [n_rows, price_sum] for year, _, _, _, n_rows, price_sum in rows}
+		return max_date, years_old, years_new
+
+	def write_parts(self, df, meta):
+		"""
+		Append a dataframe to the cache, as one new part per year, and record the parts in meta.
+		"""
+		for year, df_year in df.groupby(df['date'].dt.year):
+			year_folder = os.path.join(self.folder, f'year={year}')
+			os.makedirs(year_folder, exist_ok=True)
+			part = os.path.join(f'year={year}', f"part-{meta['next_part']:05d}.parquet")
+			df_year.to_parquet(os.path.join(self.folder, part), index=False)
+			meta['parts'].setdefault(str(year), []).append(part)
+			meta['next_part'] += 1
+
+	def compact(self, meta):
+		"""
+		Merge the parts of the years with too many of them into a single part.
+		"""
+		for year, parts in meta['parts'].items():
+			if len(parts) <= self.max_parts_per_year:
+				continue
+			df_year = self.read_parts(parts)
+			part = os.path.join(f'year={year}', f"part-{meta['next_part']:05d}.parquet")
+			df_year.to_parquet(os.path.join(self.folder, part), index=False)
+			meta['parts'][year] = [part]
+			meta['next_part'] += 1
+			# The old parts can be removed once the new metadata is saved:
+			self.save_meta(meta)
+			for old_part in parts:
+				os.remove(os.path.join(self.folder, old_part))
+
+	def read_parts(self, parts):
+		"""
+		Read and concatenate Parquet parts.
+		"""
+		dfs = [pd.read_parquet(os.path.join(self.folder, part)) for part in parts]
+		df = pd.concat(dfs, ignore_index=True)
+		# Categories may differ between parts:
+		df['coin_id'] = df['coin_id'].astype(str)
+		return df
+
+	def refresh(
+		self,
+		conn,
+		fetch,
+		extra_cols=None
+		):
+		"""
+		Bring the cache up to date with the table.
+		--- Inputs ---
+		{conn} [psycopg2 connection]: Open connection (not in a transaction yet).
+		{fetch} [function]: fetch(conn, start_date=..., end_date=..., extra_cols=...) returning the rows
+			of the table as a dataframe (see `read_prices` in helper_functions.py).
+		{extra_cols} [list]: Additional columns that must be cached.
+
+		--- Returns ---
+		n_new [int]: Number of downloaded rows.
+		"""
+		# Same snapshot for every query of the refresh:
+		conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+		with conn.cursor() as cursor:
+			oid, fingerprint = self.table_identity(cursor)
+			meta = self.load_meta()
+			columns = sorted(set(extra_cols or []) | set(meta['extra_cols'] if meta else []))
+
+			# Check if the cache can be updated (a cache of an empty table has no watermark, so it is
+			# rebuilt):
+			valid = (
+				meta is not None
+				and meta.get('watermark') is not None
+				and 'years' in meta
+				and meta['oid'] == oid
+				and meta['fingerprint'] == fingerprint
+				and set(extra_cols or []) <= set(meta['extra_cols'])
+			)
+			max_date, years_old, years_new = self.table_state(cursor, meta['watermark'] if valid else None)
+
+		# Years with deleted, updated or backfilled rows up to the watermark:
+		stale_years = sorted(
+			(year for year in set(years_old) | set(meta['years']) if years_old.get(year) != meta['years'].get(year)),
+			key=int) if valid else []
+		if valid and not stale_years and max_date == meta['watermark']:
+			return 0
+
+		if valid:
+			# Download the changed years again, up to the watermark, and the rows newer than the watermark:
+			old_parts = [part for year in stale_years for part in meta['parts'].pop(year, [])]
+			watermark = pd.Timestamp(meta['watermark'])
+			ranges = [
+				(pd.Timestamp(int(year), 1, 1).date(), min(pd.Timestamp(int(year), 12, 31), watermark).date())
+				for year in stale_years if int(year) <= watermark.year]
+			if max_date is not None and max_date > meta['watermark']:
+				ranges.append(((watermark + pd.Timedelta(days=1)).date(), max_date))
+		else:
+			# Rebuild from scratch:
+			old_parts = []
+			shutil.rmtree(self.folder, ignore_errors=True)
+			os.makedirs(self.folder)
+			meta = {'oid': oid, 'fingerprint': fingerprint, 'extra_cols': columns, 'parts': {}, 'next_part': 0}
+			ranges = [(None, max_date)]
+		n_new = 0
+		for start_date, end_date in ranges:
+			df_new = fetch(conn, start_date=start_date, end_date=end_date, extra_cols=meta['extra_cols'])
+			self.write_parts(df_new, meta)
+			n_new += len(df_new)
+
+		# Save the new state, then remove the replaced parts:
+		meta.update({'watermark': max_date, 'years': years_new})
+		self.save_meta(meta)
+		for old_part in old_parts:
+			os.remove(os.path.join(self.folder, old_part))
+		self.compact(meta)
+
+		return n_new
+
+	def read(
+		self,
+		coins=None,
+		start_date=None,
+		end_date=None,
+		last_n_days=None,
+		extra_cols=None
+		):
+		"""
+		Read cached prices, with the same filters as `get_data_from_postgres`. Only the year
+		partitions overlapping the requested dates are read.
+
+		--- Returns ---
+		df [pandas DataFrame]: Columns coin_id (categorical), date (datetime), price_usd (float64) and the
+			extra columns, sorted by coin and date.
+		"""
+		meta = self.load_meta()
+
+		# Define the date range (a cache of an empty table has no watermark):
+		if last_n_days and (end_date or meta['watermark']):
+			last_date = pd.Timestamp(end_date if end_date else meta['watermark'])
+			first_date = last_date - pd.Timedelta(days=int(last_n_days) - 1)
+			start_date = max(pd.Timestamp(start_date), first_date) if start_date else first_date
+			end_date = last_date
+
+		# Select the partitions to read:
+		years = sorted(meta['parts'], key=int)
+		if start_date:
+			years = [y for y in years if int(y) >= pd.Timestamp(start_date).year]
+		if end_date:
+			years = [y for y in years if int(y) <= pd.Timestamp(end_date).year]
+		parts = [part for y in years for part in meta['parts'][y]]
+		columns = ['coin_id', 'date', 'price_usd'] + list(extra_cols or [])
+		if parts:
+			df = self.read_parts(parts)[columns]
+		else:
+			df = pd.DataFrame({col: [] for col in columns}).astype(
+				{'coin_id': 'object', 'date': 'datetime64[ns]', 'price_usd': 'float64'})
+
+		# Apply filters:
+		mask = pd.Series(True, index=df.index)
+		if coins:
+			mask &= df['coin_id'].isin(list(coins))
+		if start_date:
+			mask &= df['date'] >= pd.Timestamp(start_date)
+		if end_date:
+			mask &= df['date'] <= pd.Timestamp(end_date)
+		df = df[mask].sort_values(['coin_id', 'date']).reset_index(drop=True)
+		df['coin_id'] = df['coin_id'].astype('category')
+
+		return df
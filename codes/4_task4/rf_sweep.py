@@ -0,0 +1,187 @@
+# rf_sweep.py
+# Hyperparameter sweep of the per-coin Random Forest models.
+
+import os
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from threadpoolctl import threadpool_limits
+
+from parallel_training import coin_matrix, feature_columns, run_coin_tasks
+from evaluation import rmse_abs_price
+
+# ==============
+
+def sweep_configs(
+	param_grid,
+	n_iter=None,
+	random_state=17
+	):
+	"""
+	Configurations of a sweep: all the combinations of {param_grid} (grid search), or {n_iter} of them
+	drawn at random (random search). 'n_estimators' is not part of the configurations: every forest is
+	grown through its values (see `sweep_coin`).
+	--- Inputs ---
+	{param_grid} [dict]: Values of every `RandomForestRegressor` parameter, as lists.
+	{n_iter} [int]: Number of configurations drawn at random (default: None, all of them).
+	{random_state} [int]: Seed of the random search.
+
+	--- Returns ---
+	configs [list]: Parameters of every configuration, as dicts.
+	n_estimators [list]: Numbers of trees, in increasing order (default: [100]).
+	"""
+	grid = dict(param_grid)
+	n_estimators = sorted(set(int(n) for n in grid.pop('n_estimators', [100])))
+	if n_iter and n_iter < len(ParameterGrid(grid)):
+		configs = list(ParameterSampler(grid, n_iter=n_iter, random_state=random_state))
+	else:
+		configs = list(ParameterGrid(grid))
+
+	return configs, n_estimators
+
+def sweep_coin(
+	data,
+	coin,
+	start,
+	val_start,
+	stop,
+	n_features,
+	configs,
+	n_estimators,
+	keep_fraction=0.5,
+	random_state=17,
+	threads=None
+	):
+	"""
+	Successive halving of the configurations of one coin. Every forest is fitted with the first number
+	of trees and scored on the validation rows; only the best {keep_fraction} of the configurations are
+	grown to the next number of trees, and so on. Forests are warm-started, so growing one only fits the
+	new trees.
+	--- Inputs ---
+	{data} [numpy array | string]: Matrix built by `coin_matrix`, or the path of its .npy file.
+	{coin} [string]: Coin name.
+	{start}, {val_start}, {stop} [int]: First training row, first validation row and end row of the coin.
+	{n_features} [int]: Number of feature columns of the matrix.
+	{configs} [list]: Parameters of every configuration (see `sweep_configs`).
+	{n_estimators} [list]: Numbers of trees, in increasing order.
+	{keep_fraction} [float]: Fraction of the configurations grown to the next number of trees (1: no
+		early stopping).
+	{random_state} [int]: Seed of the forests.
+	{threads} [int]: Maximum number of threads of the fits (default: None, all cores).
+
+	--- Returns ---
+	coin [string]: Coin name.
+	scores [list]: (configuration index, n_estimators, RMSE, pruned) for every fitted forest.
+	"""
+	if isinstance(data, str):
+		data = np.load(data, mmap_mode='r')
+
+	# Define predictors (X) and targets (y) for train/validation:
+	X_train, y_train = data[start:val_start, :n_features], data[start:val_start, n_features]
+	X_val, y_val = data[val_start:stop, :n_features], data[val_start:stop, n_features]
+	ref_prices = data[val_start:stop, n_features + 1]
+
+	forests = {
+		i: RandomForestRegressor(warm_start=True, random_state=random_state, n_jobs=threads or -1, **config)
+		for i, config in enumerate(configs)}
+	alive = list(forests)
+	scores = []
+	with threadpool_limits(limits=threads):
+		for step, n_trees in enumerate(n_estimators):
+			# Grow the remaining forests and score them:
+			rmse = {}
+			for i in alive:
+				forests[i].set_params(n_estimators=n_trees)
+				forests[i].fit(X_train, y_train)
+				rmse[i] = rmse_abs_price(y_val, forests[i].predict(X_val), ref_prices)
+
+			# Keep the best configurations for the next number of trees:
+			ranked = sorted(alive, key=rmse.get)
+			last_step = step == len(n_estimators) - 1
+			n_keep = len(ranked) if last_step else max(1, int(np.ceil(len(ranked) * keep_fraction)))
+			scores.extend((i, n_trees, rmse[i], not last_step and rank >= n_keep) for rank, i in enumerate(ranked))
+			for i in ranked[n_keep:]:
+				del forests[i]
+			alive = ranked[:n_keep]
+
+	return coin, scores
+
+# ==============
+
+def sweep_random_forest(
+	df,
+	param_grid,
+	n_iter=None,
+	target='price_usd',
+	ref_price='price_usd-1_orig',
+	coin_col='coin_id',
+	date_col='date',
+	drop_cols=['coin_id', 'date', 'risk_level', 'trend'],
+	train_frac=0.75,
+	val_frac=0.2,
+	keep_fraction=0.5,
+	random_state=17,
+	max_workers=None,
+	threads_per_worker=1
+	):
+	"""
+	Tune the per-coin Random Forests on features built once. Every coin is split chronologically as in
+	the per-coin models (see `split_train_test`); the last {val_frac} of its training days are used for
+	validation, so its test days are left untouched. The feature matrix of all coins is built once and the
+	coins are spread across a pool of processes (see `run_coin_tasks`), largest coins first, each running a
+	successive halving of the configurations (see `sweep_coin`).
+	--- Inputs ---
+	{df} [pandas DataFrame]: Features, target and reference price of every coin and day (no NaN values).
+	{param_grid} [dict]: Values of every `RandomForestRegressor` parameter, as lists (see `sweep_configs`).
+	{n_iter} [int]: Number of configurations drawn at random (default: None, grid search).
+	{target} [string]: Target column (absolute price), normalized by {ref_price} for training.
+	{ref_price} [string]: Reference price to scale the target back to absolute prices.
+	{coin_col} [string]: Coin column.
+	{date_col} [string]: Date column.
+	{drop_cols} [list]: Columns not used as predictors, with their per-window variants (see `feature_columns`).
+		The target and reference price are always dropped.
+	{train_frac} [float]: Fraction of the days of every coin used for training (and validation).
+	{val_frac} [float]: Fraction of the training days used for validation.
+	{keep_fraction} [float]: Fraction of the configurations kept at every number of trees (see `sweep_coin`).
+	{random_state} [int]: Seed of the random search and of the forests.
+	{max_workers} [int]: Number of processes (default: None, all cores).
+	{threads_per_worker} [int]: Maximum number of threads of every fit in the pool (default: 1).
+
+	--- Returns ---
+	results [pandas DataFrame]: One row per coin, configuration and number of trees, with the validation
+		RMSE_abs_price and whether the configuration was pruned after it.
+	best [pandas DataFrame]: Best configuration and number of trees of every coin.
+	"""
+	configs, n_estimators = sweep_configs(param_grid, n_iter=n_iter, random_state=random_state)
+
+	# Build the feature matrix once (rows sorted by coin and date):
+	feature_cols = feature_columns(df, drop_cols, [ref_price, target])
+	data, coins, bounds = coin_matrix(df, feature_cols, target, ref_price, coin_col, date_col)
+
+	# Train/validation rows of every coin, largest coins first so that none is left running alone at the end:
+	parallel = min(max_workers or os.cpu_count() or 1, len(coins)) > 1
+	tasks = []
+	for coin, start, stop in zip(coins, bounds[:-1], bounds[1:]):
+		split = start + int((stop - start) * train_frac)
+		val_start = split - int((split - start) * val_frac)
+		if val_start > start + 1 and split > val_start:
+			tasks.append((
+				coin, start, val_start, split, len(feature_cols), configs, n_estimators, keep_fraction,
+				random_state, threads_per_worker if parallel else None))
+	tasks.sort(key=lambda task: task[3] - task[1], reverse=True)
+
+	# Sweep every coin, in parallel:
+	rows = [
+		(coin, *score)
+		for coin, scores in run_coin_tasks(data, sweep_coin, tasks, max_workers=max_workers)
+		for score in scores]
+	scores = pd.DataFrame(rows, columns=[coin_col, 'config', 'n_estimators', 'RMSE_abs_price', 'pruned'])
+
+	# One table with the parameters of every configuration:
+	params = pd.DataFrame(configs, index=pd.RangeIndex(len(configs), name='config')).reset_index()
+	results = scores.merge(params, on='config').sort_values([coin_col, 'config', 'n_estimators'])
+	results = results[[coin_col, 'config', *params.columns.drop('config'), 'n_estimators', 'RMSE_abs_price', 'pruned']]
+	best = results.loc[results.groupby(coin_col)['RMSE_abs_price'].idxmin()]
+
+	return results.reset_index(drop=True), best.reset_index(drop=True)
@@ -7,7 +7,7 @@ import psycopg2
 import argparse
 from dotenv import load_dotenv
 
-from helper_functions import get_data_from_postgres, plot_recent_history
+from helper_functions import CACHE_DIR, get_data_from_postgres, plot_recent_history
 
 # Get environmental variables:
 load_dotenv("../../.env")
@@ -17,6 +17,7 @@ if __name__ == "__main__":
 	# Define command-line interface (CLI) arguments:
 	parser = argparse.ArgumentParser(description="View data history for bitcoin, ethereum and cardano")
 	parser.add_argument("--table", type=str, help="Table name: crypto_daily_data (default) or coin_data")
+	parser.add_argument("--no_cache", action="store_true", help="Read from Postgres instead of the local Parquet cache")
 	parser.add_argument("--coins", nargs="+", help="Coins to analyze (space-separated). Leave off for all.")
 	parser.add_argument("--last_date", type=str, help="Last date to retrieve information (default: latest)")
 	parser.add_argument("--days", type=int, help="Number of days to look back (default: 30)")
@@ -35,8 +36,11 @@ if __name__ == "__main__":
 	# If save_image is provided:
 	save_image = args.save_image if args.save_image else False		
 
-	# Get information as dataframe:
-	df = get_data_from_postgres(password=PASSWORD,table=table)
+	# Get information as dataframe (only the selected coins and days):
+	df = get_data_from_postgres(
+		password=PASSWORD,table=table,coins=coins,
+		end_date=None if last_date=='latest' else last_date,last_n_days=days,
+		cache_dir=None if args.no_cache else CACHE_DIR)
 
 	plot_recent_history(
 		df,